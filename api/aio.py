@@ -0,0 +1,46 @@
+"""
+Async versions of every function under `api`, with the same modules, names and signatures.
+
+```
+import api.aio
+response = await api.aio.reports.export_report_to_ptrac(base_url, headers, client_id, report_id)
+```
+
+Every function under `api` ends with `return request.<method>(...)`. The async version is a copy of the function with
+`request` bound to `utils.async_request_handler` instead of `utils.request_handler`, so it returns an awaitable that
+sends the request with aiohttp. The copies are made when this module is imported, so they can't drift from the
+synchronous wrappers.
+"""
+import inspect
+import types
+
+import api
+import utils.async_request_handler as async_request
+
+
+def _make_async(func: types.FunctionType, module_globals: dict) -> types.FunctionType:
+    async_func = types.FunctionType(func.__code__, module_globals, func.__name__, func.__defaults__, func.__closure__)
+    async_func.__kwdefaults__ = func.__kwdefaults__
+    async_func.__doc__ = func.__doc__
+    async_func.__qualname__ = func.__qualname__
+    return async_func
+
+
+def _make_async_module(module: types.ModuleType) -> types.ModuleType:
+    """
+    Creates a module with an async version of each function defined in a module under `api`, and a nested module for
+    each of its sub modules
+    """
+    async_module = types.ModuleType(f'{__name__}.{module.__name__[len("api."):]}', module.__doc__)
+    module_globals = {**vars(module), "request": async_request}
+    for name, value in vars(module).items():
+        if inspect.isfunction(value) and value.__module__ == module.__name__:
+            setattr(async_module, name, _make_async(value, module_globals))
+        elif inspect.ismodule(value) and value.__name__.startswith(f'{module.__name__}.'):
+            setattr(async_module, name, _make_async_module(value))
+    return async_module
+
+
+for _name, _module in vars(api).items():
+    if inspect.ismodule(_module) and _module.__name__.startswith("api.") and _module.__name__ != __name__:
+        globals()[_name] = _make_async_module(_module)
@@ -28,7 +28,7 @@ The following values can be used in the `sort.order` field:
     name = "Get Tenant Assets"
     root = "/api/v2"
     path = f'/tenant/assets'
-    return request.post(base_url, headers, root+path, name, payload)
+    return request.post(base_url, headers, root+path, name, payload, retry_safe=True)
 
 def get_assets_by_client(base_url, headers, clientId, payload):
     """
@@ -56,7 +56,7 @@ value: "ba", // required string allows "empty string" if filtering by "tags" mus
     name = "List Clients"
     root = "/api/v2"
     path = f'/clients'
-    return request.post(base_url, headers, root+path, name, payload)
+    return request.post(base_url, headers, root+path, name, payload, retry_safe=True)
 
 def get_client(base_url, headers, clientId):
     """
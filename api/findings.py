@@ -82,7 +82,7 @@ The following values can be used in the `sort.order` field:
     name = "Get Findings by Report"
     root = "/api/v2"
     path = f'/clients/{clientId}/reports/{reportId}/findings'
-    return request.post(base_url, headers, root+path, name, payload)
+    return request.post(base_url, headers, root+path, name, payload, retry_safe=True)
 
 def get_finding(base_url, headers, clientId, reportId, findingId):
     """
@@ -68,7 +68,7 @@ The following values can be used in the `sort.order` field:
     name = "Get Report List"
     root = "/api/v2"
     path = f'/reports'
-    return request.post(base_url, headers, root+path, name, payload)
+    return request.post(base_url, headers, root+path, name, payload, retry_safe=True)
 
 def get_report(base_url, headers, clientId, reportId, payload):
     """
@@ -196,16 +196,18 @@ def bulk_adjust_status_of_report(base_url, headers, payload):
     path = f'/reports/bulk/status'
     return request.post(base_url, headers, root+path, name, payload)
 
-def export_report_to_ptrac(base_url, headers, clientId, reportId):
+def export_report_to_ptrac(base_url, headers, clientId, reportId, stream_to=None):
     """
     This request **exports a report** in ptrac format for further manipulation and future importing back into PlexTrac.
 
 The `instanceUrl` ,`clientId,` and `reportId` is needed to execute.
+
+    Pass a file opened in binary mode as `stream_to` to write the PTRAC to the file as it downloads, instead of loading it.
     """
     name = "Export Report to Ptrac"
     root = "/api/v1"
     path = f'/client/{clientId}/report/{reportId}/export/ptrac'
-    return request.get(base_url, headers, root+path, name)
+    return request.get(base_url, headers, root+path, name, stream_to=stream_to)
 
 def export_report_to_word(base_url, headers, clientId, reportId, includeEvidence, templateID):
     """
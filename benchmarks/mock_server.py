@@ -0,0 +1,278 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple, Union
+
+
+@dataclass
+class MockServerConfig:
+    clients: int = 10
+    reports_per_client: int = 10
+    findings_per_report: int = 25
+    ptrac_size: int = 1024 * 1024 # approximate size in bytes of each exported PTRAC, padded with evidence
+    latency: float = 0.02 # seconds added to every response
+    latency_jitter: float = 0.01 # random seconds, between 0 and this value, added on top of `latency`
+    error_rate: float = 0.0 # chance between 0 and 1 that a request fails with a 503
+    retry_after: Union[int, None] = None # Retry-After header sent with 503 responses, in seconds
+    seed: int = 0
+    report_updated_at: bool = False # add the last updated time to report list records. the list from Plextrac instances only has the created time, it is loaded from the Get Report endpoint instead
+
+
+class MockPlextracData():
+    """
+    A class to generate the clients, reports, findings and PTRACs served by the mock server. Everything is generated
+    from the config, so two servers started with the same config serve the same data.
+    """
+    def __init__(self, config: MockServerConfig):
+        self.config = config
+        self.clients = [self.get_client(client_id) for client_id in range(1, config.clients+1)]
+        self.reports = [self.get_report(client_id, client_id*1000 + i) for client_id in range(1, config.clients+1) for i in range(config.reports_per_client)]
+        self.reports_by_id = {report['id']: report for report in self.reports}
+        self._evidence_padding = "A" * max(0, config.ptrac_size)
+        self._lock = threading.Lock()
+        self._next_client_id = config.clients + 1
+        self._next_report_id = 10 ** 9
+        self.imported_reports = 0
+        self.imported_bytes = 0
+
+    def get_client(self, client_id: int) -> dict:
+        return {
+            "client_id": client_id,
+            "cuid": f'client-{client_id}',
+            "tenant_id": 0,
+            "name": f'Mock Client {client_id}',
+            "poc": "Mock POC",
+            "poc_email": "poc@example.com",
+            "description": "",
+            "logo": None,
+            "doc_type": "client",
+            "users": {},
+            "tags": ["mock"]
+        }
+
+    def get_report(self, client_id: int, report_id: int) -> dict:
+        return {
+            "id": report_id,
+            "client_id": client_id,
+            "name": f'Mock Report {report_id}',
+            "status": "Draft",
+            "tags": ["mock"],
+            "created_at": 1700000000000 + report_id,
+            **({"updatedAt": 1700000000000 + report_id} if self.config.report_updated_at else {})
+        }
+
+    def get_finding(self, report_id: int, index: int) -> dict:
+        return {
+            "flaw_id": report_id * 1000 + index,
+            "title": f'Mock Finding {index}',
+            "severity": ["Critical", "High", "Medium", "Low", "Informational"][index % 5],
+            "status": "Open",
+            "description": "Mock finding description " * 10
+        }
+
+    def get_ptrac(self, report_id: int) -> bytes:
+        """
+        Builds the PTRAC of a report. The evidence is added as a raw string instead of through `json.dumps`, so large
+        PTRACs don't slow down the server.
+        """
+        report = self.reports_by_id[report_id]
+        ptrac = {
+            "report_info": {"name": report['name'], "status": report['status'], "tags": report['tags']},
+            "client_info": {"name": f'Mock Client {report["client_id"]}'},
+            "flaws_array": [self.get_finding(report_id, i) for i in range(self.config.findings_per_report)],
+            "summary": {},
+            "procedures": []
+        }
+        head = json.dumps(ptrac)[:-1]
+        return f'{head}, "evidence": [{{"id": "{report_id}-evidence", "data": "{self._evidence_padding}"}}]}}'.encode('utf-8')
+
+    def create_client(self) -> int:
+        with self._lock:
+            client_id = self._next_client_id
+            self._next_client_id += 1
+        return client_id
+
+    def import_report(self, size: int) -> int:
+        with self._lock:
+            report_id = self._next_report_id
+            self._next_report_id += 1
+            self.imported_reports += 1
+            self.imported_bytes += size
+        return report_id
+
+
+def _get_page(records: list, payload: dict, data_key: str) -> dict:
+    pagination = payload.get("pagination", {})
+    offset = int(pagination.get("offset", 0))
+    limit = int(pagination.get("limit", 25))
+    return {"status": "success", data_key: records[offset:offset+limit], "meta": {"pagination": {"offset": offset, "limit": limit, "total": len(records)}}}
+
+
+class MockPlextracRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests sent by the workflows and `utils/data_utils` to a Plextrac instance. Only the endpoints needed
+    to authenticate, list clients, reports and findings, export PTRACs, and import clients and PTRACs are implemented.
+    """
+    protocol_version = "HTTP/1.1" # keep-alive, the same as a real instance
+    data: MockPlextracData = None
+    config: MockServerConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status_code: int, body: Union[dict, bytes], headers: Dict[str, str] = {}) -> None:
+        if isinstance(body, dict):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length > 0 else b''
+
+    def _handle(self, method: str) -> None:
+        body = self._read_body()
+        time.sleep(self.config.latency + random.uniform(0, self.config.latency_jitter))
+        if self.config.error_rate > 0 and random.random() < self.config.error_rate:
+            headers = {"Retry-After": str(self.config.retry_after)} if self.config.retry_after != None else {}
+            return self._send(503, {"status": "error", "message": "Mock server error"}, headers)
+
+        for route_method, pattern, handler in ROUTES:
+            match = re.fullmatch(pattern, self.path.split("?")[0])
+            if route_method == method and match != None:
+                status_code, response_body = handler(self.data, body, self.headers.get("Content-Type", ""), *match.groups())
+                return self._send(status_code, response_body)
+        self._send(404, {"status": "error", "message": f'Mock server does not implement {method} {self.path}'})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+def _load_json(body: bytes) -> dict:
+    return json.loads(body) if len(body) > 0 else {}
+
+
+ROUTES: List[Tuple[str, str, Callable]] = [
+    ("GET", r"/api/v1/?", lambda data, body, content_type: (200, {"text": "Authenticate at /authenticate"})),
+    ("POST", r"/api/v1/authenticate", lambda data, body, content_type: (200, {"status": "success", "token": "mock-token", "tenant_id": 0, "mfa_enabled": False})),
+    ("POST", r"/api/v2/clients", lambda data, body, content_type: (200, _get_page(data.clients, _load_json(body), "data"))),
+    ("POST", r"/api/v2/reports", lambda data, body, content_type: (200, _get_page(data.reports, _load_json(body), "data"))),
+    ("POST", r"/api/v2/clients/(\d+)/reports/(\d+)/findings", lambda data, body, content_type, client_id, report_id: (200, _get_page([data.get_finding(int(report_id), i) for i in range(data.config.findings_per_report)], _load_json(body), "data"))),
+    ("GET", r"/api/v1/client/(\d+)/report/(\d+)", lambda data, body, content_type, client_id, report_id: (200, {**data.reports_by_id[int(report_id)], "updatedAt": 1700000000000 + int(report_id)}) if int(report_id) in data.reports_by_id else (404, {"status": "error", "message": "Report not found"})),
+    ("GET", r"/api/v1/client/(\d+)/report/(\d+)/export/ptrac", lambda data, body, content_type, client_id, report_id: (200, data.get_ptrac(int(report_id))) if int(report_id) in data.reports_by_id else (404, {"status": "error", "message": "Report not found"})),
+    ("POST", r"/api/v1/client/create", lambda data, body, content_type: (200, {"status": "success", "client_id": data.create_client()})),
+    ("POST", r"/api/v1/client/(\d+)/report/import", lambda data, body, content_type, client_id: (200, {"status": "success", "report_id": data.import_report(len(body))}) if content_type.startswith("multipart/form-data") else (400, {"status": "error", "message": "Expected multipart form data"})),
+]
+
+
+class MockPlextracServer():
+    """
+    A class to run a local stand-in for a Plextrac instance, used to benchmark the script without a real tenant
+    """
+    def __init__(self, config: MockServerConfig = None, host: str = "127.0.0.1", port: int = 0):
+        """
+        :param config: data and behavior of the server, defaults to MockServerConfig()
+        :type config: MockServerConfig, optional
+        :param host: defaults to "127.0.0.1"
+        :type host: str, optional
+        :param port: port to listen on, 0 picks a free port, defaults to 0
+        :type port: int, optional
+        """
+        self.config = config if config != None else MockServerConfig()
+        random.seed(self.config.seed)
+        self.data = MockPlextracData(self.config)
+        handler = type("Handler", (MockPlextracRequestHandler,), {"data": self.data, "config": self.config})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> "MockPlextracServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = MockServerConfig()
+    parser.add_argument("--clients", type=int, default=defaults.clients, help="number of clients on the server")
+    parser.add_argument("--reports-per-client", type=int, default=defaults.reports_per_client, help="number of reports under each client")
+    parser.add_argument("--findings-per-report", type=int, default=defaults.findings_per_report, help="number of findings in each report")
+    parser.add_argument("--ptrac-size", type=int, default=defaults.ptrac_size, help="approximate size of each PTRAC in bytes")
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="seconds added to every response")
+    parser.add_argument("--latency-jitter", type=float, default=defaults.latency_jitter, help="max random seconds added on top of --latency")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="chance between 0 and 1 that a request fails with a 503")
+    parser.add_argument("--retry-after", type=int, default=defaults.retry_after, help="Retry-After header sent with 503 responses, in seconds")
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="random seed for latency and errors")
+    parser.add_argument("--report-updated-at", action="store_true", help="include the last updated time in report list records")
+
+
+def get_config_from_args(args: argparse.Namespace) -> MockServerConfig:
+    return MockServerConfig(
+        clients=args.clients,
+        reports_per_client=args.reports_per_client,
+        findings_per_report=args.findings_per_report,
+        ptrac_size=args.ptrac_size,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        report_updated_at=args.report_updated_at
+    )
+
+
+def get_args_from_config(config: MockServerConfig) -> List[str]:
+    """
+    :return: command line arguments to start a mock server with the same config
+    :rtype: List[str]
+    """
+    args = [
+        "--clients", str(config.clients),
+        "--reports-per-client", str(config.reports_per_client),
+        "--findings-per-report", str(config.findings_per_report),
+        "--ptrac-size", str(config.ptrac_size),
+        "--latency", str(config.latency),
+        "--latency-jitter", str(config.latency_jitter),
+        "--error-rate", str(config.error_rate),
+        "--seed", str(config.seed)
+    ]
+    if config.retry_after != None:
+        args += ["--retry-after", str(config.retry_after)]
+    return args
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local mock Plextrac instance for benchmarking")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockPlextracServer(get_config_from_args(args), host=args.host, port=args.port)
+    print(f'Mock Plextrac instance running at {server.base_url}/api/v1 - Press Ctrl+C to stop', flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,226 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # run from any directory
+
+import settings
+from benchmarks.mock_server import MockPlextracData, MockServerConfig, add_config_arguments, get_args_from_config, get_config_from_args
+
+
+BENCHMARKS = ["list_reports", "export_reports", "export_clients", "import_reports"]
+# higher is better for these results, lower is better for the rest
+THROUGHPUT_RESULTS = ["reports_per_sec", "mb_per_sec"]
+
+
+def get_peak_rss_mb() -> float:
+    """
+    :return: peak resident memory of the current process in MB, or 0 if it can't be measured on this OS
+    :rtype: float
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS, KB everywhere else
+    return peak_rss / 1024 / 1024 if sys.platform == "darwin" else peak_rss / 1024
+
+
+def run_benchmark(name: str, base_url: str, config: MockServerConfig) -> dict:
+    """
+    Runs a single benchmark against a running mock server. Called in its own process, so the peak memory measured
+    only includes this benchmark.
+
+    :param name: one of `BENCHMARKS`
+    :type name: str
+    :param base_url: URL of the mock server
+    :type base_url: str
+    :param config: config the mock server was started with
+    :type config: MockServerConfig
+    :return: dictionary of results
+    :rtype: dict
+    """
+    settings.console_log_level = logging.WARNING
+    settings.save_logs_to_file = False
+    # imported after changing settings, the logger is created on import
+    import utils.globals as globals
+    from utils.auth_handler import Auth
+    import utils.concurrency_utils as concurrency
+    import utils.data_utils as data
+    import utils.request_handler as request_handler
+    from workflows.clients_reports import ClientReportsWorkflow
+    from workflows.reports import ReportsWorkflow
+
+    globals.auth = Auth({"instance_url": base_url, "username": "benchmark", "password": "benchmark"})
+    globals.auth.handle_authentication()
+    folder_path = tempfile.mkdtemp(prefix=f'benchmark_{name}_')
+
+    reports = []
+    if name != "import_reports":
+        data.get_page_of_reports(reports=reports, auth=globals.auth)
+
+    start_time = time.perf_counter()
+    if name == "list_reports":
+        reports = []
+        data.get_page_of_reports(reports=reports, auth=globals.auth)
+        processed = len(reports)
+        total_bytes = 0
+
+    elif name == "export_reports":
+        workflow = ReportsWorkflow()
+        processed = 0
+        total_bytes = 0
+        export_report = lambda report: workflow.create_report_ptrac_with_json_object(report, folder_path)
+        for report, file_path, e in concurrency.run_concurrently(export_report, reports, max_workers=settings.export_workers):
+            if e == None:
+                processed += 1
+                total_bytes += os.path.getsize(file_path)
+
+    elif name == "export_clients":
+        workflow = ClientReportsWorkflow()
+        processed = 0
+        total_bytes = 0
+        clients = []
+        data.get_page_of_clients(clients=clients, auth=globals.auth)
+        reports_by_client_id = data.group_reports_by_client_id(reports)
+        for client in clients:
+            zip_file_path, exported_reports = workflow.create_client_zip(client, reports_by_client_id.get(client['client_id'], []), folder_path)
+            processed += len(exported_reports)
+            total_bytes += sum(exported_report['size'] for exported_report in exported_reports)
+
+    elif name == "import_reports":
+        # PTRACs are written straight from the mock data, one at a time, so creating them isn't part of the benchmark
+        mock_data = MockPlextracData(config)
+        file_paths = []
+        for report in mock_data.reports:
+            file_path = f'{folder_path}/{report["id"]}.ptrac'
+            with open(file_path, 'wb') as f:
+                f.write(mock_data.get_ptrac(report['id']))
+            file_paths.append(file_path)
+        start_time = time.perf_counter()
+        processed = 0
+        total_bytes = 0
+        import_ptrac = lambda file_path: data.import_ptrac_report(file_path, 1, auth=globals.auth)
+        for file_path, response, e in concurrency.run_concurrently(import_ptrac, file_paths, max_workers=settings.import_workers):
+            if e == None:
+                processed += 1
+                total_bytes += os.path.getsize(file_path)
+    else:
+        raise ValueError(f'Unknown benchmark \'{name}\'')
+
+    elapsed = time.perf_counter() - start_time
+    shutil.rmtree(folder_path, ignore_errors=True)
+    return {
+        "benchmark": name,
+        "reports": processed,
+        "seconds": round(elapsed, 3),
+        "reports_per_sec": round(processed / elapsed, 2) if elapsed > 0 else 0,
+        "mb_per_sec": round(total_bytes / 1024 / 1024 / elapsed, 2) if elapsed > 0 else 0,
+        "peak_rss_mb": round(get_peak_rss_mb(), 1),
+        "requests": request_handler.request_metrics.to_dict()
+    }
+
+
+def compare_results(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """
+    :return: list of regressions, results that are worse than the baseline by more than `tolerance`
+    :rtype: List[str]
+    """
+    regressions = []
+    baseline_by_name = {result['benchmark']: result for result in baseline}
+    for result in results:
+        baseline_result = baseline_by_name.get(result['benchmark'])
+        if baseline_result == None:
+            continue
+        for key in THROUGHPUT_RESULTS:
+            if baseline_result[key] > 0 and result[key] < baseline_result[key] * (1 - tolerance):
+                regressions.append(f'{result["benchmark"]} {key}: {result[key]} < baseline {baseline_result[key]}')
+        if baseline_result['peak_rss_mb'] > 0 and result['peak_rss_mb'] > baseline_result['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f'{result["benchmark"]} peak_rss_mb: {result["peak_rss_mb"]} > baseline {baseline_result["peak_rss_mb"]}')
+    return regressions
+
+
+def print_results(results: List[dict]) -> None:
+    headers = ["Benchmark", "Reports", "Seconds", "Reports/sec", "MB/sec", "Peak RSS (MB)"]
+    rows = [[result['benchmark'], str(result['reports']), str(result['seconds']), str(result['reports_per_sec']), str(result['mb_per_sec']), str(result['peak_rss_mb'])] for result in results]
+    widths = [max(len(row[i]) for row in [headers] + rows) for i in range(len(headers))]
+    for row in [headers] + rows:
+        print(" | ".join(value.ljust(widths[i]) for i, value in enumerate(row)).rstrip())
+
+
+def get_settings_overrides(args: argparse.Namespace) -> Dict[str, int]:
+    overrides = {}
+    if args.export_workers != None:
+        overrides['export_workers'] = args.export_workers
+    if args.import_workers != None:
+        overrides['import_workers'] = args.import_workers
+    if args.pagination_workers != None:
+        overrides['pagination_workers'] = args.pagination_workers
+    return overrides
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmarks against a local mock Plextrac instance")
+    parser.add_argument("benchmarks", nargs="*", default=BENCHMARKS, help=f'benchmarks to run, defaults to all: {", ".join(BENCHMARKS)}')
+    parser.add_argument("--export-workers", type=int, help="override settings.export_workers")
+    parser.add_argument("--import-workers", type=int, help="override settings.import_workers")
+    parser.add_argument("--pagination-workers", type=int, help="override settings.pagination_workers")
+    parser.add_argument("--save", help="save results to this JSON file")
+    parser.add_argument("--compare", help="compare results to a JSON file saved with --save, exits with status 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="fraction a result can be worse than the baseline before it counts as a regression, defaults to 0.2")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS) # used internally to run a single benchmark in its own process
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    config = get_config_from_args(args)
+
+    for key, value in get_settings_overrides(args).items():
+        setattr(settings, key, value)
+
+    if args.run_one != None:
+        print(json.dumps(run_benchmark(args.run_one, args.base_url, config)))
+        sys.exit(0)
+
+    # the mock server runs in its own process, so it doesn't count towards the memory or CPU of the benchmarks
+    root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config_args = get_args_from_config(config)
+    override_args = []
+    for key, value in get_settings_overrides(args).items():
+        override_args += [f'--{key.replace("_", "-")}', str(value)]
+    server = subprocess.Popen([sys.executable, "-m", "benchmarks.mock_server", "--port", "0"] + config_args, cwd=root_path, stdout=subprocess.PIPE, text=True)
+    try:
+        base_url = server.stdout.readline().split(" running at ")[1].split("/api/v1")[0]
+        results = []
+        for name in args.benchmarks:
+            print(f'Running {name}...')
+            benchmark = subprocess.run([sys.executable, "-m", "benchmarks.run_benchmarks", "--run-one", name, "--base-url", base_url] + config_args + override_args, cwd=root_path, stdout=subprocess.PIPE, text=True)
+            if benchmark.returncode != 0:
+                print(f'Benchmark {name} failed')
+                continue
+            results.append(json.loads(benchmark.stdout.strip().splitlines()[-1]))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_results(results)
+    if args.save != None:
+        with open(args.save, 'w', encoding="utf8") as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved results to \'{args.save}\'')
+    if args.compare != None:
+        with open(args.compare, 'r', encoding="utf8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if len(regressions) > 0:
+            sys.exit(1)
+        print(f'No regressions compared to \'{args.compare}\'')
@@ -1,6 +1,9 @@
 import yaml
 import time
+import argparse
+import sys
 from rich import print
+from rich.markup import escape
 
 import beaupy as binput
 
@@ -9,7 +12,12 @@ import utils.globals as globals
 import utils.log_handler as logger
 log = logger.log
 from utils.auth_handler import Auth
+from utils.catalog_handler import ExportCatalog
+from utils.search_index_handler import SearchIndex, SNIPPET_MATCH_START, SNIPPET_MATCH_END
+import utils.request_handler as request_handler
 from workflows.clients_reports import ClientReportsWorkflow
+from workflows.jobs import JobRunner, load_job_file
+from workflows.migration import MigrationWorkflow
 from workflows.reports import ReportsWorkflow
 from workflows.templates import TemplatesWorkflow
 
@@ -65,6 +73,7 @@ This script is broken up into multiple workflows that manage different modules o
         f":authenticate to instance {globals.auth.get_auth_status() if globals.auth!=None else '(no authentication session)'}",
         ":clients and reports",
         ":reports",
+        ":migrate to another instance",
         # ":report/export templates & style guides",
         ":exit"
     ]
@@ -79,11 +88,187 @@ This script is broken up into multiple workflows that manage different modules o
     workflows = {
         ":clients and reports": ClientReportsWorkflow,
         ":reports": ReportsWorkflow,
+        ":migrate to another instance": MigrationWorkflow,
         ":report/export templates & style guides": TemplatesWorkflow,
     }
     workflows[workflow_selection]().start()
 
+def get_job_from_args(args: argparse.Namespace) -> dict:
+    """
+    :return: job for `JobRunner` built from the options of a headless command
+    :rtype: dict
+    """
+    job = {
+        "workflow": args.command.replace("-", "_"),
+        "client_ids": args.client_id,
+        "report_ids": args.report_id,
+        "tags": args.tag,
+        "all": args.all,
+        "include_reports": not args.no_reports,
+        "paths": args.path
+    }
+    if args.command == "import-reports":
+        job['client_id'] = args.client_id[0] if len(args.client_id) > 0 else None
+        job['client_ids'] = []
+    return job
+
+def run_headless(args: argparse.Namespace) -> int:
+    """
+    Runs a headless command without any prompts. Authentication details are read from config.yaml, since there is no
+    one to enter them.
+
+    :return: exit status, 0 if every job succeeded, 1 otherwise
+    :rtype: int
+    """
+    try:
+        with open("config.yaml", 'r') as f:
+            config = yaml.safe_load(f) or {}
+    except Exception as e:
+        log.exception(f'Could not load config.yaml\n{e}')
+        return 1
+    missing = [key for key in ["instance_url", "username", "password"] if config.get(key) in [None, ""]]
+    if len(missing) > 0:
+        log.error(f'Headless commands need {", ".join(missing)} in config.yaml')
+        return 1
+
+    try:
+        jobs = load_job_file(args.job_file) if args.command == "run-jobs" else [get_job_from_args(args)]
+    except Exception as e:
+        log.exception(f'Could not load jobs\n{e}')
+        return 1
+
+    globals.auth = Auth(config)
+    try:
+        globals.auth.authenticate_headless()
+    except Exception as e:
+        log.error(f'{e}{f" - {e.__cause__}" if e.__cause__ != None else ""}')
+        return 1
+
+    return 0 if JobRunner().run_jobs(jobs) else 1
+
+def run_catalog_query(args: argparse.Namespace) -> int:
+    """
+    Prints the clients or reports in the export catalog matching the options of the `catalog` command. Only reads the
+    local catalog, so no authentication is needed.
+
+    :return: exit status, 0 if anything was found, 1 otherwise
+    :rtype: int
+    """
+    try:
+        catalog = ExportCatalog()
+        if args.clients:
+            rows = catalog.find_clients(client_ids=args.client_id, tags=args.tag, name=args.name, latest_only=not args.all_exports)
+        else:
+            rows = catalog.find_reports(report_ids=args.report_id, client_ids=args.client_id, tags=args.tag, name=args.name, latest_only=not args.all_exports)
+        catalog.close()
+    except Exception as e:
+        log.exception(f'Could not query export catalog\n{e}')
+        return 1
+    for row in rows:
+        if args.clients:
+            print(f'Client: {row["name"]} | ID: {row["client_id"]} | Reports: {row["reports"]} | Exported: {row["started_at"]} | File: {row["file_path"]}')
+        else:
+            location = f'{row["file_path"]} -> {row["zip_entry"]} (offset {row["zip_offset"]})' if row["zip_entry"] != None else row["file_path"]
+            print(f'Report: {row["name"]} | ID: {row["report_id"]} | Client ID: {row["client_id"]} | Findings: {row["findings"]} | Exported: {row["started_at"]} | File: {location}')
+    log.info(f'Found {len(rows)} exported {"client" if args.clients else "report"}(s) in the catalog')
+    return 0 if len(rows) > 0 else 1
+
+def run_search(args: argparse.Namespace) -> int:
+    """
+    Runs the `index` or `search` command against the full-text search index of exported findings and narratives. Only
+    reads local exports, so no authentication is needed.
+
+    :return: exit status. for `index`, 0 if every PTRAC was indexed. for `search`, 0 if anything was found
+    :rtype: int
+    """
+    try:
+        search_index = SearchIndex()
+        if args.command == "index":
+            indexed, failed = search_index.update()
+            search_index.close()
+            log.success(f'Indexed {indexed} PTRAC(s)') if failed < 1 else log.error(f'Indexed {indexed} PTRAC(s), could not read {failed} PTRAC(s)')
+            return 0 if failed < 1 else 1
+        if args.update:
+            search_index.update()
+        start_time = time.time()
+        results = search_index.search(" ".join(args.query), limit=args.limit, raw_query=args.fts)
+        search_time = time.time() - start_time
+        search_index.close()
+    except Exception as e:
+        log.exception(f'Could not search exported reports\n{e}')
+        return 1
+    for result in results:
+        for report in result['reports']:
+            location = f'{report["file_path"]} -> {report["zip_entry"]}' if report["zip_entry"] != None else report["file_path"]
+            print(f'Report: {report["name"]} | ID: {report["report_id"]} | Client ID: {report["client_id"]} | Exported: {report["started_at"]} | File: {location}')
+        snippet = escape(result['snippet']).replace(SNIPPET_MATCH_START, "[b]").replace(SNIPPET_MATCH_END, "[/b]")
+        print(f'  {result["section"].capitalize()}: {escape(result["title"])}\n  {snippet}\n')
+    log.info(f'Found {len(results)} matching finding(s) and narrative(s) in {round(search_time*1000, 1)} ms')
+    return 0 if len(results) > 0 else 1
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Script for getting large amounts of data out of Plextrac for backup or migration")
+    parser.add_argument("--resume", action="store_true", help="when exporting clients or reports, skip anything already exported by the last unfinished export run")
+    parser.add_argument("--incremental", action="store_true", help="when exporting clients or reports, only download reports that are new or changed since the last complete export run")
+    parser.add_argument("--record", metavar="CASSETTE", help="record the response of every request to a cassette file, to replay later with --replay")
+    parser.add_argument("--replay", metavar="CASSETTE", help="replay responses from a cassette file recorded with --record instead of sending requests to the instance")
+    parser.add_argument("--replay-speed", type=float, default=0, help="when replaying, speed to replay the recorded response times at. 1 for the original timing, 2 for twice as fast, 0 (default) for no delay")
+    # headless commands, run a workflow without any prompts. with no command the interactive menu is started
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND", help="run a workflow headless instead of starting the interactive menu")
+    for command, help in [
+        ("export-clients", "export clients, and their reports, to client ZIPs"),
+        ("export-reports", "export reports to PTRACs"),
+        ("import-clients", "create clients, and their reports, from client ZIPs"),
+        ("import-reports", "create reports under an existing client from PTRACs")
+    ]:
+        subparser = subparsers.add_parser(command, help=help)
+        if command.startswith("export"):
+            subparser.add_argument("--client-id", action="append", default=[], help="client to export, or export the reports of. can be repeated")
+            subparser.add_argument("--tag", action="append", default=[], help=f'export {command.split("-")[1]} with this tag. can be repeated')
+            subparser.add_argument("--all", action="store_true", help=f'export all {command.split("-")[1]} if no other selectors are given')
+        elif command == "import-clients":
+            subparser.add_argument("--path", action="append", default=[], help="file, folder or glob pattern of files to import. can be repeated. required unless --report-id is given, then the files holding the reports are found in the export catalog")
+        else:
+            subparser.add_argument("--path", action="append", default=[], required=True, help="file, folder or glob pattern of files to import. can be repeated")
+        if command == "export-clients":
+            subparser.add_argument("--no-reports", action="store_true", help="only export client details, not their reports")
+        if command == "export-reports":
+            subparser.add_argument("--report-id", action="append", default=[], help="report to export. can be repeated")
+        if command == "import-reports":
+            subparser.add_argument("--client-id", action="append", default=[], required=True, help="existing client to import the reports to")
+        if command == "import-clients":
+            subparser.add_argument("--report-id", action="append", default=[], help="only restore this report, and the client it is under. can be repeated")
+        subparser.set_defaults(client_id=[], report_id=[], tag=[], all=False, no_reports=False, path=[])
+    subparser = subparsers.add_parser("run-jobs", help="run every job in a YAML job file")
+    subparser.add_argument("job_file", help="file path of the job file")
+    subparser = subparsers.add_parser("catalog", help="find where clients and reports were exported to, from the local export catalog")
+    subparser.add_argument("--clients", action="store_true", help="find exported clients instead of reports")
+    subparser.add_argument("--report-id", action="append", default=[], help="report to find. can be repeated")
+    subparser.add_argument("--client-id", action="append", default=[], help="client to find, or find the reports of. can be repeated")
+    subparser.add_argument("--tag", action="append", default=[], help="find clients or reports with this tag. can be repeated")
+    subparser.add_argument("--name", help="find clients or reports with this text in their name")
+    subparser.add_argument("--all-exports", action="store_true", help="list every export of each client or report, not just the most recent")
+    subparsers.add_parser("index", help="add exported PTRACs in the export catalog to the full-text search index")
+    subparser = subparsers.add_parser("search", help="search the findings and narratives of exported reports")
+    subparser.add_argument("query", nargs="+", help="words that must all be in the finding or narrative")
+    subparser.add_argument("--limit", type=int, default=20, help="max number of findings and narratives to show, defaults to 20")
+    subparser.add_argument("--fts", action="store_true", help="use SQLite FTS5 query syntax, e.g. 'sql* OR xss' or 'NEAR(apache struts)'")
+    subparser.add_argument("--update", action="store_true", help="index new exports before searching")
+    globals.args = parser.parse_args()
+    if globals.args.command == "import-clients" and len(globals.args.path) < 1 and len(globals.args.report_id) < 1:
+        parser.error("import-clients needs at least one --path, or --report-id to find the files in the export catalog")
+    if globals.args.record != None:
+        request_handler.start_cassette("record", globals.args.record)
+    elif globals.args.replay != None:
+        request_handler.start_cassette("replay", globals.args.replay, replay_speed=globals.args.replay_speed)
+
+    if globals.args.command == "catalog":
+        sys.exit(run_catalog_query(globals.args))
+    if globals.args.command in ["index", "search"]:
+        sys.exit(run_search(globals.args))
+    if globals.args.command != None:
+        sys.exit(run_headless(globals.args))
+
     binput.console.clear()
     for i in settings.script_info:
         print(i)
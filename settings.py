@@ -13,6 +13,65 @@ verify_ssl = True
 # number of times to retry a request before throwing an error. will only throw the last error encountered if
 # number of retries is exceeded. set to 0 to disable retrying requests
 retries = 0
+# seconds to wait before the first retry. each following retry waits up to twice as long, with a random amount of
+# jitter so workers don't all retry at the same time. a Retry-After header sent on a 429 or 503 response is used instead
+retry_backoff_base = 1
+# max seconds to wait before any retry, including waits requested by a Retry-After header
+retry_backoff_max = 60
+# which failures are retried. POST requests that create or change data are never retried, since the instance may have
+# processed a request even if the response failed
+retry_connection_errors = True
+retry_bad_json = True
+retry_status_codes = [408, 429, 500, 502, 503, 504]
+# the latency, size and status codes of requests to each API endpoint are printed in a table at the end of each
+# workflow. set this to true to also save them to a JSON file under exported_data/metrics
+save_request_metrics = False
+# max number of keep-alive connections held open to each Plextrac instance. requests to the same instance reuse these
+# connections instead of opening a new TCP+TLS connection per request. should be at least the number of workers used
+# by any concurrent operations
+connection_pool_size = 10
+# max number of pages requested at the same time when loading paginated lists, like the list of clients or reports.
+# the first page is always loaded on its own to get the total number of records. set to 1 to load one page at a time.
+# also used for the last updated time of each report loaded by incremental exports
+pagination_workers = 4
+# max number of requests sent per second to each Plextrac instance, shared by all workers. set to 0 for no limit
+requests_per_second = 0
+# max number of requests waiting on a response from each Plextrac instance at the same time, shared by all workers. set
+# to 0 for no limit
+max_concurrent_requests = 8
+# when enabled, the request rate and number of concurrent requests are lowered when the instance starts responding
+# slower or with 429/5xx errors, then slowly raised back to the limits above while the instance is healthy. use this
+# when running against a production instance that other users are working on
+adaptive_rate_limit = False
+# auth sessions expire after 15 mins. the auth token is renewed in the background this many seconds after
+# authenticating, using the entered credentials. users with MFA enabled are prompted again when the session expires
+# instead. set to 0 to only renew the token when it expires
+auth_refresh_interval = 600
+
+# IMPORTS
+# max number of reports being imported at the same time. each import waits for the instance to process the PTRAC, so
+# keep this low to avoid overloading the instance being imported to. set to 1 to import one report at a time
+import_workers = 2
+
+# EXPORTS
+# number of reports downloaded at the same time when exporting. set to 1 to export one report at a time
+export_workers = 4
+# each export run records the clients and reports it has finished in a manifest under exported_data/manifests, which
+# is used to resume the run with the --resume option. the manifest is saved after this many clients or reports finish
+manifest_checkpoint_interval = 10
+# save exported data to a content-addressed store under exported_data/content_store instead of creating client ZIPs and
+# PTRAC files. each client JSON, PTRAC and piece of PTRAC evidence is saved once under the hash of its content, and the
+# manifest of each export run is the snapshot index pointing into the store. select the manifest when importing
+use_content_store = False
+# keep a SQLite catalog of every client and report exported at exported_data/catalog.db, to find which export holds a
+# report without opening every client ZIP. see the `catalog` command of main.py
+update_export_catalog = True
+
+# MIGRATIONS
+# when migrating directly between instances, reports are downloaded from the source instance with up to export_workers
+# at a time and uploaded to the target instance with up to import_workers at a time. this is the max number of
+# downloaded reports held in memory waiting to be uploaded, before downloads pause for the uploads to catch up
+migration_queue_size = 4
 
 # description of script that will be print line by line when the script is run
 script_info = [
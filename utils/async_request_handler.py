@@ -0,0 +1,305 @@
+import asyncio
+import json
+import os
+import time
+from json import JSONDecodeError
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, Coroutine, Dict, Iterable, Tuple, Union
+
+import aiohttp
+
+import settings
+import utils.log_handler as logger
+log = logger.log
+import utils.request_handler as request_handler
+from utils.request_handler import PTWrapperLibraryResponse, IDEMPOTENT_METHODS, DOWNLOAD_CHUNK_SIZE
+
+from api.exceptions import *
+
+
+class PTAsyncSessionPool():
+    """
+    Async counterpart of `request_handler.PTSessionPool`. One `aiohttp.ClientSession` is kept per Plextrac instance,
+    keyed by `Auth.base_url`, so requests sent from an event loop to the same instance reuse open connections.
+
+    aiohttp sessions belong to the event loop they were created in, so the pool is used from one event loop at a time
+    and its sessions are closed when the coroutine started by `run` finishes. Like the sync sessions, they don't keep
+    cookies, since a session can be shared by several users or tenants on the same instance.
+    """
+    def __init__(self, pool_size: int):
+        """
+        :param pool_size: max number of connections kept open to each Plextrac instance
+        :type pool_size: int
+        """
+        self.pool_size = max(1, int(pool_size))
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def get_session(self, base_url: str) -> aiohttp.ClientSession:
+        """
+        Returns the session for a Plextrac instance, creating it on first use
+
+        :param base_url: URL to PT instance including protocol (ex. https://example.plextrac.com)
+        :type base_url: str
+        :return: pooled session shared by all async requests to the instance
+        :rtype: aiohttp.ClientSession
+        """
+        session = self._sessions.get(base_url)
+        if session == None or session.closed:
+            log.debug(f'Creating async session for \'{base_url}\' with {self.pool_size} connection(s)')
+            connector = aiohttp.TCPConnector(limit_per_host=self.pool_size, ssl=None if settings.verify_ssl else False)
+            session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+            self._sessions[base_url] = session
+        return session
+
+    async def close(self) -> None:
+        """
+        Closes all sessions and their open connections
+        """
+        sessions = list(self._sessions.values())
+        self._sessions = {}
+        for session in sessions:
+            await session.close()
+
+
+session_pool = PTAsyncSessionPool(settings.connection_pool_size)
+
+
+def run(main: Coroutine) -> Any:
+    """
+    Runs a coroutine that sends async requests in a new event loop, like `asyncio.run`, and closes the pooled sessions
+    once it finishes
+
+    ```
+    import api.aio
+    response = async_request_handler.run(api.aio.reports.export_report_to_ptrac(base_url, headers, client_id, report_id))
+    ```
+
+    :param main: coroutine to run
+    :type main: Coroutine
+    :return: return value of the coroutine
+    :rtype: Any
+    """
+    async def run_and_close():
+        try:
+            return await main
+        finally:
+            await session_pool.close()
+    return asyncio.run(run_and_close())
+
+
+async def _acquire(rate_limiter: request_handler.PTRateLimiter) -> None:
+    """
+    Waits without blocking the event loop until a request can be sent. Async requests take their slots and tokens from
+    the same per-instance rate limiters as the sync requests.
+    """
+    start = time.monotonic()
+    while True:
+        wait_time = rate_limiter.try_acquire()
+        if wait_time <= 0:
+            break
+        await asyncio.sleep(wait_time)
+    rate_limiter.add_wait_time(time.monotonic() - start)
+
+
+def _get_form_data(files) -> Union[aiohttp.FormData, None]:
+    """
+    Converts multipart form data given in the format used by `requests`, a dictionary of field name to a file object or
+    a tuple of (file name, value, content type), to `aiohttp.FormData`. Created again for each attempt, after the files
+    are rewound.
+    """
+    if files == None:
+        return None
+    form_data = aiohttp.FormData()
+    for field_name, value in files.items():
+        if isinstance(value, tuple):
+            file_name = value[0]
+            content = value[1]
+            content_type = value[2] if len(value) > 2 else None
+        else:
+            file_name = os.path.basename(value.name) if isinstance(getattr(value, "name", None), str) else field_name
+            content = value
+            content_type = None
+        form_data.add_field(field_name, content, filename=file_name, content_type=content_type)
+    return form_data
+
+
+async def _do(http_method: str, base_url: str, headers: dict, endpoint: str, name: str, data: Dict = None, files = None, retry_safe: bool = None, stream_to: BinaryIO = None) -> PTWrapperLibraryResponse:
+    """
+    Async counterpart of `request_handler._do`. Requests are sent with aiohttp from the running event loop, with the same
+    retries, per-instance rate limits, metrics and auth token renewal as the sync requests, and return the same
+    `PTWrapperLibraryResponse`, with the `aiohttp.ClientResponse` as its `response`.
+
+    While a cassette is recording or replaying, requests are sent by `request_handler._do` on a thread instead, since
+    the cassette keeps `requests` responses.
+
+    See `request_handler._do` for the parameters and exceptions
+    """
+    if request_handler.cassette != None:
+        return await asyncio.to_thread(request_handler._do, http_method, base_url, headers, endpoint, name, data=data, files=files, retry_safe=retry_safe, stream_to=stream_to)
+
+    full_url = base_url + endpoint
+    log_line_pre = f"method={http_method}, url={full_url}"
+    log_line_post = ', '.join((log_line_pre, "success={}, status_code={}, message={}"))
+    if retry_safe == None:
+        retry_safe = http_method in IDEMPOTENT_METHODS
+    max_retries = settings.retries if retry_safe else 0
+
+    rate_limiter = request_handler.rate_limiters.get_limiter(base_url)
+    retries = 0
+    auth_refreshed = False
+    while True:
+        # Log HTTP params and perform an HTTP request, catching and re-raising any exceptions
+        try:
+            log.debug(log_line_pre)
+            await _acquire(rate_limiter)
+            request_start = time.monotonic()
+            status_code = None
+            headers_latency = None
+            bytes_out = len(json.dumps(data).encode('utf-8')) if data != None and files == None else 0
+            bytes_in = 0
+            # the auth headers can be renewed in place by another worker, send a copy so the token sent is known
+            sent_headers = dict(headers) if headers != None else None
+            sent_token = sent_headers.get("Authorization") if sent_headers != None else None
+            try:
+                # like `requests`, the JSON payload isn't sent with multipart form data
+                async with session_pool.get_session(base_url).request(http_method, full_url, headers=sent_headers, json=data if files == None else None, data=_get_form_data(files)) as response:
+                    headers_latency = time.monotonic() - request_start
+                    status_code = response.status
+                    body = b''
+                    if stream_to != None and 299 >= status_code >= 200:
+                        stream_to.seek(0)
+                        stream_to.truncate()
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            stream_to.write(chunk)
+                            bytes_in += len(chunk)
+                        stream_to.flush()
+                    else:
+                        body = await response.read()
+                        bytes_in = len(body)
+            finally:
+                latency = time.monotonic() - request_start
+                # like the sync requests, the limiter gets the time until the response headers arrived
+                rate_limiter.release(headers_latency if headers_latency != None else latency, status_code)
+                request_handler.request_metrics.add_request(name, latency, status_code, bytes_out=bytes_out, bytes_in=bytes_in)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if settings.retry_connection_errors and retries < max_retries:
+                retries += 1
+                delay = request_handler._get_retry_delay(retries)
+                log.exception(f'Request failed - {name}. Retrying in {round(delay, 1)}s... ({retries}/{max_retries})\nException: {str(e)}')
+                request_handler.request_metrics.add_retry(name, delay)
+                await asyncio.sleep(delay)
+                request_handler._rewind_files(files)
+                continue
+            else:
+                raise PTWrapperLibraryException(f'Request failed - {name}') from e
+        # Retry failed status codes before checking the response body, error pages are often not JSON
+        is_success = 299 >= response.status >= 200
+        log_line = log_line_post.format(is_success, response.status, response.reason)
+        # Renew an expired auth token and send the request again, once. the token is renewed by the sync auth handler, on a thread
+        refresh = getattr(headers, "refresh", None)
+        if response.status == 401 and not auth_refreshed and sent_token != None and refresh != None:
+            auth_refreshed = True
+            log.debug(f'{log_line}. Renewing auth token and retrying...')
+            if await asyncio.to_thread(refresh, sent_token):
+                request_handler._rewind_files(files)
+                continue
+        if not is_success and response.status in settings.retry_status_codes and retries < max_retries:
+            retries += 1
+            delay = request_handler._get_retry_delay(retries, response.status, response.headers)
+            log.exception(f'{log_line}. Retrying in {round(delay, 1)}s... ({retries}/{max_retries})')
+            request_handler.request_metrics.add_retry(name, delay)
+            await asyncio.sleep(delay)
+            request_handler._rewind_files(files)
+            continue
+        # A streamed response body was already written to the file
+        if stream_to != None and is_success:
+            log.debug(log_line)
+            return PTWrapperLibraryResponse(response, response.status, message=response.reason)
+        # Deserialize JSON output to Python object, or return failed PTWrapperLibraryResponse on exception
+        try:
+            data_out = json.loads(body)
+        except (ValueError, JSONDecodeError) as e:
+            if is_success and settings.retry_bad_json and retries < max_retries:
+                retries += 1
+                delay = request_handler._get_retry_delay(retries)
+                log.exception(f'{log_line_post.format(False, response.status, e)}. Retrying in {round(delay, 1)}s... ({retries}/{max_retries})')
+                request_handler.request_metrics.add_retry(name, delay)
+                await asyncio.sleep(delay)
+                request_handler._rewind_files(files)
+                continue
+            elif is_success:
+                raise PTWrapperLibraryJSONResponse(f'Bad JSON response - {name}') from e
+            data_out = {}
+        # If status_code in 200-299 range, return success PTWrapperLibraryResponse with data, otherwise raise exception
+        if is_success:
+            log.debug(log_line)
+            return PTWrapperLibraryResponse(response, response.status, message=response.reason, json=data_out)
+        log.exception(f'{log_line}, pt_message={data_out.get("message") if isinstance(data_out, dict) else None}')
+        raise PTWrapperLibraryFailed(f'{name} - {response.status}: {response.reason}')
+
+
+async def get(base_url: str, headers: dict, endpoint: str, name: str, stream_to: BinaryIO = None) -> PTWrapperLibraryResponse:
+    """
+    Async GET request wrapper, see `request_handler.get`
+    """
+    return await _do(http_method='GET', base_url=base_url, headers=headers, endpoint=endpoint, name=name, stream_to=stream_to)
+
+async def post(base_url: str, headers: dict, endpoint: str, name: str, data: Dict = None, files = None, retry_safe: bool = False) -> PTWrapperLibraryResponse:
+    """
+    Async POST request wrapper, see `request_handler.post`
+    """
+    return await _do(http_method='POST', base_url=base_url, headers=headers, endpoint=endpoint, name=name, data=data, files=files, retry_safe=retry_safe)
+
+async def put(base_url: str, headers: dict, endpoint: str, name: str, data: Dict = None) -> PTWrapperLibraryResponse:
+    """
+    Async PUT request wrapper, see `request_handler.put`
+    """
+    return await _do(http_method='PUT', base_url=base_url, headers=headers, endpoint=endpoint, name=name, data=data)
+
+async def delete(base_url: str, headers: dict, endpoint: str, name: str, data: Dict = None) -> PTWrapperLibraryResponse:
+    """
+    Async DELETE request wrapper, see `request_handler.delete`
+    """
+    return await _do(http_method='DELETE', base_url=base_url, headers=headers, endpoint=endpoint, name=name, data=data)
+
+
+async def map_concurrently(func: Callable[[Any], Awaitable], items: Iterable, limit: int = 100) -> AsyncIterator[Tuple[Any, Any, Union[Exception, None]]]:
+    """
+    Async counterpart of `concurrency_utils.run_concurrently`. Awaits `func` for each item with at most `limit` pending
+    at once and yields the outcome of each as soon as it finishes. Items are pulled from `items` lazily. The number of
+    requests actually sent at the same time is still bounded by the rate limiter of each instance.
+
+    :param func: async function to call with each item
+    :type func: Callable[[Any], Awaitable]
+    :param items: items to pass to `func`
+    :type items: Iterable
+    :param limit: max number of calls to `func` pending at the same time, defaults to 100
+    :type limit: int, optional
+    :yield: tuple of (item, return value of `func` or None, exception raised by `func` or None)
+    :rtype: AsyncIterator[Tuple[Any, Any, Union[Exception, None]]]
+    """
+    items = iter(items)
+    pending = {}
+
+    def submit_next() -> bool:
+        for item in items:
+            pending[asyncio.ensure_future(func(item))] = item
+            return True
+        return False
+
+    for _ in range(max(1, int(limit))):
+        if not submit_next():
+            break
+    try:
+        while len(pending) > 0:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                item = pending.pop(task)
+                submit_next()
+                if task.exception() != None:
+                    yield item, None, task.exception()
+                else:
+                    yield item, task.result(), None
+    finally:
+        # stop pending work if the caller stops early
+        for task in pending:
+            task.cancel()
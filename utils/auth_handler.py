@@ -1,11 +1,14 @@
 from getpass import getpass
 import json
+import threading
 import time
 
+import settings
 import utils.log_handler as logger
 log = logger.log
 import api
 import utils.input_utils as input
+import utils.request_handler as request_handler
 
 class Auth():
     
@@ -15,10 +18,18 @@ class Auth():
         self.username = args.get('username')
         self.password = args.get('password')
         self.tenant_id = None
-        self.auth_headers = {}
+        # requests rejected with 401 are retried once after the token is renewed
+        self.auth_headers = request_handler.PTAuthHeaders(refresh=self.refresh_authentication)
+        self.mfa_enabled = False
+        self.headless = False # authenticated with `authenticate_headless`, so the user is never prompted
 
         self.time_since_last_auth = None
 
+        # shared by all workers, so only one thread re-authenticates and any MFA prompt is only shown once
+        self._lock = threading.RLock()
+        self._refreshing = False
+        self._refresh_timer = None
+
 
     def add_auth_header(self, authorization_token):
         self.auth_headers["Authorization"] = authorization_token
@@ -55,16 +66,162 @@ class Auth():
 
         to prevent the auth from timing out after it was checked, but before it can be received by the API,
         checks whether we are in the last minute of the 15 min auth window
-        """
-        if self.time_since_last_auth == None:
-            self.handle_authentication()
 
-        if time.time() - self.time_since_last_auth > 840:
-            self.handle_authentication()
+        the token is normally renewed in the background before this happens, see `refresh_authentication`
+        """
+        if self.time_since_last_auth == None or time.time() - self.time_since_last_auth > 840:
+            with self._lock:
+                # another worker may have re-authenticated while this one waited for the lock
+                if self.time_since_last_auth == None:
+                    self.authenticate_headless() if self.headless else self.handle_authentication()
+                elif time.time() - self.time_since_last_auth > 840:
+                    self.refresh_authentication()
         
         return self.auth_headers
 
 
+    def refresh_authentication(self, expired_token: str = None) -> bool:
+        """
+        Renews the auth token. Workers share a single refresh: a worker calling this while another worker is
+        refreshing waits for that refresh instead of starting its own.
+
+        The token is renewed with the saved credentials without prompting the user. If that isn't possible, like when
+        the user has MFA enabled, the user is prompted to authenticate again.
+
+        :param expired_token: the token a request was rejected with. if the token has already been renewed since, nothing is done, defaults to None
+        :type expired_token: str, optional
+        :return: whether there is a new token to retry the request with
+        :rtype: bool
+        """
+        with self._lock:
+            if self._refreshing: # the refresh itself was rejected
+                return False
+            if expired_token != None and expired_token != self.auth_headers.get("Authorization"):
+                return True
+            self._refreshing = True
+            try:
+                if self._renew_token():
+                    log.debug(f'Renewed auth token for \'{self.username}\' on \'{self.base_url}\'')
+                    self._schedule_refresh()
+                    return True
+                if self.headless:
+                    log.error(f'Could not renew auth token for \'{self.username}\' on \'{self.base_url}\'')
+                    return False
+                log.info(f'User session for \'{self.username}\' on \'{self.base_url}\' instance needs to be renewed')
+                self.handle_authentication()
+                return True
+            finally:
+                self._refreshing = False
+
+
+    def _renew_token(self) -> bool:
+        """
+        Authenticates again with the saved credentials, without prompting the user
+
+        :return: whether a new token was received
+        :rtype: bool
+        """
+        if self.username == None or self.password == None or self.mfa_enabled:
+            return False
+        authenticate_data = {
+            "username": self.username,
+            "password": self.password
+        }
+        # without the expired token, so a rejected authentication can't start a refresh of its own
+        headers = {key: value for key, value in self.auth_headers.items() if key != "Authorization"}
+        try:
+            response = api._authentication.authenticate.authentication(self.base_url, headers, authenticate_data)
+        except Exception as e:
+            log.exception(f'Could not renew auth token\n{e}')
+            return False
+        if response.json.get('status') != "success" or response.json.get('mfa_enabled') or response.json.get('token') == None:
+            return False
+        self.add_auth_header(response.json.get('token'))
+        self.time_since_last_auth = time.time()
+        return True
+
+
+    def _schedule_refresh(self) -> None:
+        """
+        Renews the token in the background `settings.auth_refresh_interval` seconds after authenticating, before the
+        session expires. Tokens of users with MFA enabled can't be renewed without a prompt, and are renewed when the
+        session expires instead.
+        """
+        if self._refresh_timer != None:
+            self._refresh_timer.cancel()
+        if self.mfa_enabled or settings.auth_refresh_interval <= 0:
+            return
+        self._refresh_timer = threading.Timer(settings.auth_refresh_interval, self._background_refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+
+    def _background_refresh(self) -> None:
+        """
+        Renews the token on the timer thread. Never prompts the user: if the token can't be renewed here, it is renewed
+        by the next request that needs it, see `get_auth_headers` and `refresh_authentication`
+        """
+        with self._lock:
+            if self._refreshing:
+                return
+            # a request rejected while renewing, including the authentication request itself, doesn't start another refresh
+            self._refreshing = True
+            try:
+                renewed = self._renew_token()
+            finally:
+                self._refreshing = False
+            if renewed:
+                log.debug(f'Renewed auth token for \'{self.username}\' on \'{self.base_url}\' in the background')
+                self._schedule_refresh()
+            else:
+                log.debug(f'Could not renew auth token in the background, will renew when the session expires')
+
+
+    def authenticate_headless(self) -> None:
+        """
+        Authenticates with the instance URL, credentials and optional Cloudflare token passed in, for runs with no one to
+        answer prompts. Makes a single attempt and never prompts the user. The token is renewed in the background with
+        the same credentials.
+
+        :raises Exception: the instance URL, username or password is missing, the instance could not be reached, the
+        credentials were rejected, or the user has MFA enabled
+        """
+        missing = [name for name, value in [("instance_url", self.base_url), ("username", self.username), ("password", self.password)] if value in [None, ""]]
+        if len(missing) > 0:
+            raise Exception(f'Missing {", ".join(missing)} needed to authenticate without prompts')
+        self.headless = True
+        if self.cf_token != None:
+            self.add_cf_auth_header(self.cf_token)
+
+        log.info(f'Authenticating to \'{self.base_url}\' as \'{self.username}\'')
+        try:
+            response = api.tenant.root_request(self.base_url, dict(self.auth_headers))
+        except Exception as e:
+            raise Exception(f'Could not connect to \'{self.base_url}\'. Either the API is offline or the URL is incorrect') from e
+        if not response.has_json_response or response.json.get('text') != "Authenticate at /authenticate":
+            raise Exception(f'Could not validate instance URL \'{self.base_url}\'')
+
+        authenticate_data = {
+            "username": self.username,
+            "password": self.password
+        }
+        try:
+            response = api._authentication.authenticate.authentication(self.base_url, self.auth_headers, authenticate_data)
+        except Exception as e:
+            raise Exception(f'Could not authenticate to \'{self.base_url}\'') from e
+        if response.json.get('status') != "success":
+            raise Exception(f'Could not authenticate to \'{self.base_url}\' with the credentials given')
+        self.tenant_id = response.json.get('tenant_id')
+        self.mfa_enabled = bool(response.json.get('mfa_enabled'))
+        if self.mfa_enabled:
+            raise Exception(f'User \'{self.username}\' has MFA enabled, which needs a prompt for the MFA code')
+
+        self.add_auth_header(response.json.get('token'))
+        self.time_since_last_auth = time.time()
+        log.success('Authenticated')
+        self._schedule_refresh()
+
+
     def handle_instance_url(self):
         """
         prompts user for their plextrac url, checks that the API is up and running, then sets the url
@@ -173,6 +330,7 @@ class Auth():
                 return self.handle_authentication()
 
         self.tenant_id = response.json.get('tenant_id')
+        self.mfa_enabled = bool(response.json.get('mfa_enabled'))
 
         if response.json.get('mfa_enabled'):
             log.info('MFA detected for user')
@@ -195,3 +353,4 @@ class Auth():
         self.add_auth_header(response.json.get('token'))
         self.time_since_last_auth = time.time()
         log.success('Authenticated')
+        self._schedule_refresh()
@@ -0,0 +1,128 @@
+import base64
+import gzip
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from hashlib import sha256
+from typing import Deque, Dict, Union
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import utils.log_handler as logger
+log = logger.log
+from api.exceptions import PTWrapperLibraryException
+
+
+RECORDED_HEADERS = ["Content-Type", "Retry-After"]
+
+
+def get_request_key(http_method: str, endpoint: str, data: Union[dict, None]) -> str:
+    """
+    Requests are matched to recorded responses by method, endpoint and a hash of the payload. The base URL is not part
+    of the key, so a cassette can be replayed against any instance URL. Multipart file data is not part of the key.
+
+    :return: key of the request
+    :rtype: str
+    """
+    payload_hash = sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()[:16] if data != None else ""
+    return f'{http_method} {endpoint} {payload_hash}'
+
+
+class PTCassette():
+    """
+    A class to record the responses of real requests to an on disk cassette, and replay them offline later. Used to
+    profile and tune workflows against realistic data without access to the Plextrac instance it was recorded from.
+
+    The cassette is a gzip compressed file with one JSON line per response. Each line holds the request key, the
+    status code, a few headers, the body, and how long the response took. Request headers and payloads are not saved,
+    but response bodies are, including the auth token returned when authenticating.
+
+    When replaying, requests with the same key get the recorded responses in the order they were recorded.
+    """
+    def __init__(self, mode: str, file_path: str, replay_speed: float = 0):
+        """
+        :param mode: "record" or "replay"
+        :type mode: str
+        :param file_path: file path of the cassette
+        :type file_path: str
+        :param replay_speed: when replaying, responses are delayed by their recorded time divided by this value. 1 replays
+        with the original timing, 2 twice as fast, and 0 returns every response immediately, defaults to 0
+        :type replay_speed: float, optional
+        """
+        if mode not in ["record", "replay"]:
+            raise ValueError(f'Invalid cassette mode \'{mode}\', must be "record" or "replay"')
+        self.mode = mode
+        self.file_path = file_path
+        self.replay_speed = max(0.0, float(replay_speed))
+        self.recorded = 0
+        self.replayed = 0
+        self._lock = threading.Lock()
+        self._responses: Dict[str, Deque[dict]] = defaultdict(deque)
+        self._file = None
+
+        if mode == "record":
+            self._file = gzip.open(file_path, 'wt', encoding="utf8")
+            log.info(f'Recording responses to cassette \'{file_path}\'')
+        else:
+            with gzip.open(file_path, 'rt', encoding="utf8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._responses[entry['key']].append(entry)
+            log.info(f'Replaying {sum(len(entries) for entries in self._responses.values())} recorded response(s) from cassette \'{file_path}\'')
+
+    def record(self, http_method: str, endpoint: str, data: Union[dict, None], response: requests.Response, latency: float) -> None:
+        """
+        Adds a response to the cassette
+        """
+        try:
+            body = {"text": response.content.decode('utf-8')}
+        except UnicodeDecodeError:
+            body = {"base64": base64.b64encode(response.content).decode('ascii')}
+        entry = {
+            "key": get_request_key(http_method, endpoint, data),
+            "status_code": response.status_code,
+            "reason": response.reason,
+            "headers": {key: response.headers[key] for key in RECORDED_HEADERS if key in response.headers},
+            "latency": round(latency, 4),
+            **body
+        }
+        line = json.dumps(entry)
+        with self._lock:
+            self._file.write(line + "\n")
+            self.recorded += 1
+
+    def replay(self, http_method: str, base_url: str, endpoint: str, data: Union[dict, None]) -> requests.Response:
+        """
+        Returns the next recorded response for a request, after waiting the recorded time scaled by `replay_speed`
+
+        :raises PTWrapperLibraryException: no recorded response left for the request
+        :return: recorded response
+        :rtype: requests.Response
+        """
+        key = get_request_key(http_method, endpoint, data)
+        with self._lock:
+            entries = self._responses.get(key)
+            if entries == None or len(entries) < 1:
+                raise PTWrapperLibraryException(f'No recorded response in cassette \'{self.file_path}\' for request \'{key}\'')
+            entry = entries.popleft()
+            self.replayed += 1
+        if self.replay_speed > 0:
+            time.sleep(entry['latency'] / self.replay_speed)
+
+        response = requests.Response()
+        response.status_code = entry['status_code']
+        response.reason = entry['reason']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = entry['text'].encode('utf-8') if "text" in entry else base64.b64decode(entry['base64'])
+        response.encoding = "utf-8"
+        response.request = requests.Request(method=http_method, url=base_url+endpoint, json=data).prepare()
+        return response
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file != None:
+                self._file.close()
+                self._file = None
+                log.info(f'Recorded {self.recorded} response(s) to cassette \'{self.file_path}\'')
@@ -0,0 +1,364 @@
+import os
+import sqlite3
+import threading
+import zipfile
+from hashlib import sha256
+from typing import BinaryIO, List, Union
+
+import utils.log_handler as logger
+log = logger.log
+import utils.json_stream_utils as json_stream
+from utils.manifest_handler import ExportManifest
+
+
+CATALOG_FILE_PATH = "exported_data/catalog.db"
+CATALOG_BATCH_SIZE = 100 # rows buffered before they are written to the catalog in a single transaction
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS exports (
+    export_id INTEGER PRIMARY KEY,
+    manifest_path TEXT UNIQUE,
+    workflow TEXT,
+    base_url TEXT,
+    started_at TEXT,
+    status TEXT,
+    content_store TEXT
+);
+CREATE TABLE IF NOT EXISTS clients (
+    export_id INTEGER,
+    client_id TEXT,
+    name TEXT,
+    file_path TEXT,
+    size INTEGER,
+    reports INTEGER,
+    PRIMARY KEY (export_id, client_id)
+);
+CREATE TABLE IF NOT EXISTS reports (
+    export_id INTEGER,
+    report_id TEXT,
+    client_id TEXT,
+    name TEXT,
+    status TEXT,
+    report_hash TEXT,
+    file_path TEXT,
+    zip_entry TEXT,
+    zip_offset INTEGER,
+    compressed_size INTEGER,
+    size INTEGER,
+    sha256 TEXT,
+    findings INTEGER,
+    evidence INTEGER,
+    PRIMARY KEY (export_id, report_id)
+);
+CREATE TABLE IF NOT EXISTS tags (
+    export_id INTEGER,
+    object_type TEXT,
+    object_id TEXT,
+    tag TEXT
+);
+CREATE INDEX IF NOT EXISTS reports_by_report_id ON reports (report_id);
+CREATE INDEX IF NOT EXISTS reports_by_client_id ON reports (client_id);
+CREATE INDEX IF NOT EXISTS clients_by_client_id ON clients (client_id);
+CREATE INDEX IF NOT EXISTS tags_by_tag ON tags (tag, object_type);
+CREATE INDEX IF NOT EXISTS tags_by_object ON tags (export_id, object_type, object_id);
+"""
+
+REPORT_COLUMNS = ["export_id", "report_id", "client_id", "name", "status", "report_hash", "file_path", "zip_entry", "zip_offset", "compressed_size", "size", "sha256", "findings", "evidence"]
+CLIENT_COLUMNS = ["export_id", "client_id", "name", "file_path", "size", "reports"]
+
+
+def get_ptrac_details(ptrac: Union[bytes, str, BinaryIO]) -> dict:
+    """
+    Gets the details of a PTRAC that are saved in the catalog, without parsing the whole PTRAC
+
+    :param ptrac: raw PTRAC JSON, file path of a PTRAC file, or a seekable file opened in binary mode, which is read from the start
+    :type ptrac: Union[bytes, str, BinaryIO]
+    :return: dictionary of {"sha256": str, "findings": int, "evidence": int}, with None for values that couldn't be read
+    :rtype: dict
+    """
+    details = {"sha256": None, "findings": None, "evidence": None}
+    try:
+        if isinstance(ptrac, bytes):
+            details['sha256'] = sha256(ptrac).hexdigest()
+        elif hasattr(ptrac, "read"):
+            hash = sha256()
+            ptrac.seek(0)
+            for chunk in iter(lambda: ptrac.read(json_stream.STREAM_CHUNK_SIZE), b''):
+                hash.update(chunk)
+            details['sha256'] = hash.hexdigest()
+            ptrac.seek(0)
+        else:
+            hash = sha256()
+            with open(ptrac, 'rb') as f:
+                for chunk in iter(lambda: f.read(json_stream.STREAM_CHUNK_SIZE), b''):
+                    hash.update(chunk)
+            details['sha256'] = hash.hexdigest()
+        summary = json_stream.load_ptrac_summary(ptrac)
+        details['findings'] = summary['findings']
+        details['evidence'] = summary['evidence']
+    except Exception as e:
+        log.debug(f'Could not read PTRAC details for the catalog. {e}')
+    if hasattr(ptrac, "seek"):
+        ptrac.seek(0)
+    return details
+
+
+class ExportCatalog():
+    """
+    A class to keep a local SQLite catalog of everything exported, at `exported_data/catalog.db`. Each export run
+    adds the clients and reports it exported, with their names, tags, file paths, the offset of each report's entry
+    inside its client ZIP, the sha256 hash of each PTRAC and its number of findings and evidence. Finding where a
+    report was backed up is then a query instead of opening every client ZIP.
+
+    Rows are buffered and written in bulk, one transaction per client, or per `CATALOG_BATCH_SIZE` reports.
+    """
+    def __init__(self, file_path: str = CATALOG_FILE_PATH):
+        """
+        :param file_path: file path of the SQLite database, created if it doesn't exist, defaults to CATALOG_FILE_PATH
+        :type file_path: str, optional
+        """
+        self.file_path = file_path
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(file_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(CATALOG_SCHEMA)
+        # catalogs created before reports were compared by the hash of their report list record
+        if "report_hash" not in [row[1] for row in self._connection.execute("PRAGMA table_info(reports)").fetchall()]:
+            self._connection.execute("ALTER TABLE reports ADD COLUMN report_hash TEXT")
+        self._lock = threading.Lock()
+        self._clients = []
+        self._reports = []
+        self._tags = []
+
+    def start_export(self, manifest: ExportManifest) -> int:
+        """
+        Adds the export run of a manifest to the catalog
+
+        :param manifest: manifest of the export run
+        :type manifest: ExportManifest
+        :return: id of the export in the catalog, passed when adding the clients and reports of the run
+        :rtype: int
+        """
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO exports (manifest_path, workflow, base_url, started_at, status, content_store) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(manifest_path) DO UPDATE SET status = excluded.status",
+                (manifest.file_path, manifest.data['workflow'], manifest.data['base_url'], manifest.data['started_at'], manifest.data['status'], manifest.data.get('content_store'))
+            )
+            return self._connection.execute("SELECT export_id FROM exports WHERE manifest_path = ?", (manifest.file_path,)).fetchone()[0]
+
+    def finish_export(self, export_id: int, status: str) -> None:
+        """
+        Writes any buffered rows and updates the status of the export
+
+        :param status: status of the export manifest, "in_progress" or "complete"
+        :type status: str
+        """
+        self.flush()
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE exports SET status = ? WHERE export_id = ?", (status, export_id))
+
+    def _get_previous_details(self, report_id, report_hash: str) -> Union[dict, None]:
+        """
+        Reports that are linked or copied from a previous export without being downloaded have the same details as
+        when they were last cataloged with the same report list record
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT sha256, findings, evidence FROM reports WHERE report_id = ? AND report_hash = ? AND sha256 IS NOT NULL ORDER BY export_id DESC LIMIT 1",
+                (str(report_id), report_hash)
+            ).fetchone()
+        return dict(row) if row != None else None
+
+    def add_report(self, export_id: int, report: dict, file_path: str, details: dict = {}, zip_info: zipfile.ZipInfo = None) -> None:
+        """
+        Buffers a report to add to the catalog. If its hash and findings count aren't passed in, they are read from the
+        file if it is a PTRAC file. For reports reused from a previous export by an incremental export, they are copied
+        from the last time the same version of the report was cataloged.
+
+        :param export_id: id of the export returned by `start_export`
+        :type export_id: int
+        :param report: report object returned from the POST List Reports endpoint
+        :type report: dict
+        :param file_path: file path of the client ZIP, PTRAC file, or content store object the report was exported to
+        :type file_path: str
+        :param details: any of {"size", "report_hash", "sha256", "findings", "evidence"} already known, and "unchanged": True
+        if the report was reused from a previous export instead of being downloaded, defaults to {}
+        :type details: dict, optional
+        :param zip_info: entry of the report in its client ZIP, defaults to None
+        :type zip_info: zipfile.ZipInfo, optional
+        """
+        report_hash = details.get('report_hash')
+        if details.get('sha256') == None:
+            previous_details = self._get_previous_details(report['id'], report_hash) if details.get('unchanged') and report_hash != None else None
+            if previous_details == None and zip_info == None and file_path.endswith(".ptrac"):
+                previous_details = get_ptrac_details(file_path)
+            details = {**details, **(previous_details or {})}
+        row = {
+            "export_id": export_id,
+            "report_id": str(report['id']),
+            "client_id": str(report.get('client_id')),
+            "name": report.get('name'),
+            "status": report.get('status'),
+            "report_hash": report_hash,
+            "file_path": file_path,
+            "zip_entry": zip_info.filename if zip_info != None else None,
+            "zip_offset": zip_info.header_offset if zip_info != None else None,
+            "compressed_size": zip_info.compress_size if zip_info != None else None,
+            "size": zip_info.file_size if zip_info != None else details.get('size'),
+            "sha256": details.get('sha256'),
+            "findings": details.get('findings'),
+            "evidence": details.get('evidence')
+        }
+        with self._lock:
+            self._reports.append(tuple(row[column] for column in REPORT_COLUMNS))
+            self._tags += [(export_id, "report", str(report['id']), tag) for tag in report.get('tags') or []]
+            flush_needed = len(self._reports) >= CATALOG_BATCH_SIZE
+        if flush_needed:
+            self.flush()
+
+    def add_client(self, export_id: int, client: dict, file_path: str, exported_reports: List[dict]) -> None:
+        """
+        Adds a client and the reports exported with it to the catalog, in a single transaction. If the client was
+        exported to a client ZIP, the offset of each report's entry is read from the ZIP's central directory.
+
+        :param export_id: id of the export returned by `start_export`
+        :type export_id: int
+        :param client: client object returned from the POST List Clients endpoint
+        :type client: dict
+        :param file_path: file path of the client ZIP, or content store object, the client was exported to
+        :type file_path: str
+        :param exported_reports: list of {"report", "file_name", "size", "report_hash"} for each report exported with the client,
+        with "file_path" if the report was saved to its own file, "sha256", "findings" and "evidence" if known, and
+        "unchanged" if the report was reused from a previous export
+        :type exported_reports: List[dict]
+        """
+        zip_infos = {}
+        if file_path.endswith(".zip"):
+            try:
+                with zipfile.ZipFile(file_path, 'r') as zip_file:
+                    zip_infos = {info.filename: info for info in zip_file.infolist()}
+            except Exception as e:
+                log.exception(f'Could not read entries of client ZIP \'{file_path}\' for the catalog\n{e}')
+
+        for exported_report in exported_reports:
+            self.add_report(export_id, exported_report['report'], exported_report.get('file_path', file_path), details=exported_report, zip_info=zip_infos.get(exported_report.get('file_name')))
+        row = {
+            "export_id": export_id,
+            "client_id": str(client['client_id']),
+            "name": client.get('name'),
+            "file_path": file_path,
+            "size": os.path.getsize(file_path) if os.path.exists(file_path) else None,
+            "reports": len(exported_reports)
+        }
+        with self._lock:
+            self._clients.append(tuple(row[column] for column in CLIENT_COLUMNS))
+            self._tags += [(export_id, "client", str(client['client_id']), tag) for tag in client.get('tags') or []]
+        self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes all buffered rows to the catalog in a single transaction
+        """
+        with self._lock:
+            if len(self._clients) < 1 and len(self._reports) < 1:
+                return
+            try:
+                with self._connection:
+                    # rows added again, e.g. when resuming, replace the rows from before along with their tags
+                    object_keys = [(row[0], "client", row[1]) for row in self._clients] + [(row[0], "report", row[1]) for row in self._reports]
+                    self._connection.executemany("DELETE FROM tags WHERE export_id = ? AND object_type = ? AND object_id = ?", object_keys)
+                    self._connection.executemany(f'INSERT OR REPLACE INTO clients ({", ".join(CLIENT_COLUMNS)}) VALUES ({", ".join("?" for column in CLIENT_COLUMNS)})', self._clients)
+                    self._connection.executemany(f'INSERT OR REPLACE INTO reports ({", ".join(REPORT_COLUMNS)}) VALUES ({", ".join("?" for column in REPORT_COLUMNS)})', self._reports)
+                    self._connection.executemany("INSERT INTO tags (export_id, object_type, object_id, tag) VALUES (?, ?, ?, ?)", self._tags)
+            except Exception as e:
+                log.exception(f'Could not update export catalog \'{self.file_path}\'\n{e}')
+            self._clients = []
+            self._reports = []
+            self._tags = []
+
+    def find_reports(self, report_ids: List = None, client_ids: List = None, tags: List[str] = None, name: str = None, latest_only: bool = True) -> List[dict]:
+        """
+        Finds exported reports matching all of the filters given
+
+        :param report_ids: report ids to find, defaults to None
+        :type report_ids: List, optional
+        :param client_ids: find reports under these clients, defaults to None
+        :type client_ids: List, optional
+        :param tags: find reports with any of these tags, defaults to None
+        :type tags: List[str], optional
+        :param name: find reports with this text in their name, case insensitive, defaults to None
+        :type name: str, optional
+        :param latest_only: only return the most recent export of each report, defaults to True
+        :type latest_only: bool, optional
+        :return: list of catalog rows, with the workflow, started_at time, manifest_path and content_store of the export, most recent export first
+        :rtype: List[dict]
+        """
+        return self._find("reports", "report_id", report_ids, client_ids, tags, name, latest_only)
+
+    def find_client_files(self, report_ids: List) -> List[str]:
+        """
+        Finds the files to restore reports from with the import_clients workflow. For each report, the most recent
+        client export it is in that is still on disk is used: the client ZIP, or the manifest of the export if it was
+        saved to the content store. Exports of reports on their own aren't used, since they don't have the client.
+
+        :param report_ids: reports to restore
+        :type report_ids: List
+        :return: file paths of the client ZIPs and content store export manifests holding the reports. reports that
+        aren't in any of them are left out
+        :rtype: List[str]
+        """
+        file_paths = []
+        found_report_ids = set()
+        for row in self.find_reports(report_ids=report_ids, latest_only=False):
+            if row['workflow'] != "export_clients" or row['report_id'] in found_report_ids:
+                continue
+            file_path = row['manifest_path'] if row['content_store'] != None else row['file_path']
+            if file_path == None or not os.path.isfile(file_path):
+                continue
+            found_report_ids.add(row['report_id'])
+            if file_path not in file_paths:
+                file_paths.append(file_path)
+        return file_paths
+
+    def find_clients(self, client_ids: List = None, tags: List[str] = None, name: str = None, latest_only: bool = True) -> List[dict]:
+        """
+        Finds exported clients matching all of the filters given. See `find_reports`
+        """
+        return self._find("clients", "client_id", None, client_ids, tags, name, latest_only)
+
+    def _find(self, table: str, id_column: str, ids: List, client_ids: List, tags: List[str], name: str, latest_only: bool) -> List[dict]:
+        conditions = []
+        parameters = []
+        for column, values in [(id_column, ids), ("client_id", client_ids)]:
+            if values:
+                conditions.append(f'o.{column} IN ({", ".join("?" for value in values)})')
+                parameters += [str(value) for value in values]
+        if tags:
+            conditions.append(f'EXISTS (SELECT 1 FROM tags t WHERE t.export_id = o.export_id AND t.object_type = ? AND t.object_id = o.{id_column} AND t.tag IN ({", ".join("?" for tag in tags)}))')
+            parameters += [table[:-1]] + list(tags)
+        if name:
+            conditions.append("o.name LIKE ?")
+            parameters.append(f'%{name}%')
+        query = f'SELECT o.*, e.workflow, e.started_at, e.status AS export_status, e.manifest_path, e.content_store FROM {table} o JOIN exports e ON e.export_id = o.export_id'
+        if len(conditions) > 0:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY e.started_at DESC, o.export_id DESC"
+        with self._lock:
+            rows = [dict(row) for row in self._connection.execute(query, parameters).fetchall()]
+        if not latest_only:
+            return rows
+        latest_rows = {}
+        for row in rows:
+            latest_rows.setdefault(row[id_column], row)
+        return list(latest_rows.values())
+
+    def get_tags(self, export_id: int, object_type: str, object_id) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT tag FROM tags WHERE export_id = ? AND object_type = ? AND object_id = ?", (export_id, object_type, str(object_id))).fetchall()]
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._connection.close()
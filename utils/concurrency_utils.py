@@ -0,0 +1,188 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from typing import Any, Callable, Iterable, Iterator, Tuple, Union
+import itertools
+import queue
+import threading
+
+
+def run_concurrently(func: Callable, items: Iterable, max_workers: int = 1) -> Iterator[Tuple[Any, Any, Union[Exception, None]]]:
+    """
+    Runs `func` on each item using a bounded pool of worker threads and yields the outcome of each call as soon as
+    it finishes. Results are yielded in order of completion, not the order of `items`.
+
+    At most `max_workers` items are in flight at once. Items are pulled from `items` lazily, so a generator can be
+    passed in without loading everything into memory first.
+
+    An exception raised by `func` is caught and yielded with the item, instead of stopping the remaining items.
+
+    :param func: function to call with each item
+    :type func: Callable
+    :param items: items to pass to `func`
+    :type items: Iterable
+    :param max_workers: max number of calls to `func` running at the same time, 1 runs each item in the calling thread, defaults to 1
+    :type max_workers: int, optional
+    :yield: tuple of (item, return value of `func` or None, exception raised by `func` or None)
+    :rtype: Iterator[Tuple[Any, Any, Union[Exception, None]]]
+    """
+    max_workers = max(1, int(max_workers))
+    items = iter(items)
+
+    if max_workers == 1:
+        for item in items:
+            try:
+                result = func(item)
+            except Exception as e:
+                yield item, None, e
+                continue
+            yield item, result, None
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {executor.submit(func, item): item for item in itertools.islice(items, max_workers)}
+        while len(in_flight) > 0:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                # keep the pool full before handing the finished item back to the caller
+                for next_item in itertools.islice(items, 1):
+                    in_flight[executor.submit(func, next_item)] = next_item
+                try:
+                    result = future.result()
+                except Exception as e:
+                    yield item, None, e
+                    continue
+                yield item, result, None
+
+
+def map_in_order(func: Callable, items: Iterable, max_workers: int = 1) -> Iterator[Any]:
+    """
+    Runs `func` on each item using a bounded pool of worker threads and yields the return values in the same order
+    as `items`, like the built-in `map`.
+
+    At most `max_workers` items are in flight at once, so results that finish early are only held in memory until the
+    results before them have been yielded. Items are pulled from `items` lazily.
+
+    An exception raised by `func` is re-raised when its result is reached, and no further items are started.
+
+    :param func: function to call with each item
+    :type func: Callable
+    :param items: items to pass to `func`
+    :type items: Iterable
+    :param max_workers: max number of calls to `func` running at the same time, 1 runs each item in the calling thread, defaults to 1
+    :type max_workers: int, optional
+    :yield: return value of `func` for each item, in order
+    :rtype: Iterator[Any]
+    """
+    max_workers = max(1, int(max_workers))
+    items = iter(items)
+
+    if max_workers == 1:
+        for item in items:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque(executor.submit(func, item) for item in itertools.islice(items, max_workers))
+        try:
+            while len(in_flight) > 0:
+                future = in_flight.popleft()
+                for next_item in itertools.islice(items, 1):
+                    in_flight.append(executor.submit(func, next_item))
+                yield future.result()
+        finally:
+            # stop queued work if the caller stops early or a call failed
+            for future in in_flight:
+                future.cancel()
+
+
+def run_pipeline(produce: Callable, consume: Callable, items: Iterable, producer_workers: int = 1, consumer_workers: int = 1, queue_size: int = 1) -> Iterator[Tuple[Any, Any, Union[Exception, None]]]:
+    """
+    Runs `produce` on each item, then `consume` on each produced value, with both stages running at the same time in
+    their own pools of worker threads. Produced values are passed between the stages through a bounded queue, so
+    producers wait once `queue_size` values are waiting to be consumed instead of getting ahead of the consumers.
+
+    At most `producer_workers + queue_size + consumer_workers + 1` produced values are held at once: one in each
+    producer and consumer, `queue_size` in the queue, and one more waiting for room in the queue while the producers
+    go on to the next items. Items are pulled from `items` lazily, from a background thread. Results are yielded in
+    order of completion.
+
+    An exception raised by either stage is caught and yielded with the item, instead of stopping the remaining items.
+    An exception raised while getting the next item from `items` is re-raised once the items before it are finished.
+
+    :param produce: function to call with each item, e.g. downloading something
+    :type produce: Callable
+    :param consume: function to call with each value returned by `produce`, e.g. uploading it somewhere else
+    :type consume: Callable
+    :param items: items to pass to `produce`
+    :type items: Iterable
+    :param producer_workers: max number of calls to `produce` running at the same time, defaults to 1
+    :type producer_workers: int, optional
+    :param consumer_workers: max number of calls to `consume` running at the same time, defaults to 1
+    :type consumer_workers: int, optional
+    :param queue_size: max number of produced values waiting for a consumer, defaults to 1
+    :type queue_size: int, optional
+    :yield: tuple of (item, return value of `consume` or None, exception raised by `produce` or `consume` or None)
+    :rtype: Iterator[Tuple[Any, Any, Union[Exception, None]]]
+    """
+    consumer_workers = max(1, int(consumer_workers))
+    produced = queue.Queue(maxsize=max(1, int(queue_size)))
+    results = queue.Queue()
+    stopped = threading.Event()
+    finished = object() # sent to each consumer once everything is produced, and back from each consumer once it exits
+    items_errors = []
+
+    def run_producers():
+        try:
+            for item, value, e in run_concurrently(produce, items, max_workers=producer_workers):
+                if e != None:
+                    results.put((item, None, e))
+                    continue
+                while not stopped.is_set():
+                    try:
+                        produced.put((item, value), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stopped.is_set():
+                    break
+        except Exception as e:
+            # failed to get the next item, nothing left to produce
+            items_errors.append(e)
+        finally:
+            for i in range(consumer_workers):
+                produced.put(finished)
+
+    def run_consumer():
+        while True:
+            entry = produced.get()
+            if entry is finished:
+                results.put(finished)
+                return
+            if stopped.is_set():
+                continue # the caller stopped early, drain the queue so the producers can exit
+            item, value = entry
+            try:
+                result = consume(value)
+            except Exception as e:
+                results.put((item, None, e))
+                continue
+            results.put((item, result, None))
+
+    threads = [threading.Thread(target=run_producers, daemon=True)] + [threading.Thread(target=run_consumer, daemon=True) for i in range(consumer_workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        running_consumers = consumer_workers
+        while running_consumers > 0:
+            result = results.get()
+            if result is finished:
+                running_consumers -= 1
+                continue
+            yield result
+    finally:
+        stopped.set()
+        for thread in threads:
+            thread.join()
+    if len(items_errors) > 0:
+        raise items_errors[0]
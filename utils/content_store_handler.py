@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import zlib
+from hashlib import sha256
+from typing import BinaryIO, Union
+
+import utils.log_handler as logger
+log = logger.log
+import utils.json_stream_utils as json_stream
+
+
+CONTENT_STORE_FOLDER_PATH = "exported_data/content_store"
+EVIDENCE_REF_KEY = "content_store_ref"
+
+
+class ContentStore():
+    """
+    A class to manage a content-addressed store of exported data. Each object is saved once, zlib compressed, under the
+    sha256 hash of its content at `exported_data/content_store/objects/<first 2 chars of hash>/<hash>`. Saving an object
+    that is already in the store doesn't write anything.
+
+    PTRACs are split before they are saved. Each item in the `evidence` list of a PTRAC is saved as its own object and
+    replaced with a reference `{"content_store_ref": <hash>}`, so evidence shared between reports, or between backups of
+    the same report, is only stored once.
+
+    When the content store is used, the export manifest of each run acts as the snapshot index, pointing to the objects
+    of each client and report exported in the run. See `ExportManifest`.
+    """
+    def __init__(self, folder_path: str = CONTENT_STORE_FOLDER_PATH):
+        self.folder_path = folder_path
+        self.objects_written = 0
+        self.objects_reused = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+    def get_object_path(self, hash: str) -> str:
+        return f'{self.folder_path}/objects/{hash[:2]}/{hash}'
+
+    def get_hash_from_path(self, object_path: str) -> str:
+        return os.path.basename(object_path)
+
+    def put_bytes(self, data: bytes) -> str:
+        """
+        Saves data to the store, if it isn't already saved
+
+        :param data: data to save
+        :type data: bytes
+        :return: sha256 hash the data is saved under
+        :rtype: str
+        """
+        hash = sha256(data).hexdigest()
+        object_path = self.get_object_path(hash)
+        if os.path.exists(object_path):
+            with self._lock:
+                self.objects_reused += 1
+            return hash
+
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        compressed_data = zlib.compress(data)
+        # unique temp file per thread, multiple workers can save the same object at the same time
+        temp_file_path = f'{object_path}.{threading.get_ident()}.tmp'
+        with open(temp_file_path, 'wb') as f:
+            f.write(compressed_data)
+        os.replace(temp_file_path, object_path)
+        with self._lock:
+            self.objects_written += 1
+            self.bytes_written += len(compressed_data)
+        return hash
+
+    def get_bytes(self, hash: str) -> bytes:
+        with open(self.get_object_path(hash), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def put_json(self, json_object) -> str:
+        return self.put_bytes(json.dumps(json_object).encode('utf-8'))
+
+    def get_json(self, hash: str):
+        return json.loads(self.get_bytes(hash))
+
+    def put_ptrac(self, ptrac_data: Union[bytes, BinaryIO]) -> str:
+        """
+        Saves a PTRAC to the store, saving each evidence item as a separate object. The PTRAC is read with a stream
+        reader, so only one evidence item is decoded at a time instead of the whole PTRAC
+
+        :param ptrac_data: raw PTRAC JSON, or a PTRAC file opened in binary mode, such as the temp file it was downloaded to
+        :type ptrac_data: Union[bytes, BinaryIO]
+        :return: sha256 hash the PTRAC, with references to its evidence, is saved under
+        :rtype: str
+        """
+        ptrac = {}
+        with json_stream.open_json_stream(ptrac_data) as reader:
+            for key in reader.iter_object():
+                if key == "evidence" and reader.peek_type() == "array":
+                    ptrac[key] = [{EVIDENCE_REF_KEY: self.put_json(item)} for item in reader.iter_array()]
+                else:
+                    ptrac[key] = reader.read_value()
+        return self.put_json(ptrac)
+
+    def get_ptrac(self, hash: str) -> dict:
+        """
+        Loads a PTRAC from the store, replacing evidence references with the evidence they point to
+
+        :param hash: sha256 hash the PTRAC is saved under
+        :type hash: str
+        :return: PTRAC JSON, the same as it was exported from Plextrac
+        :rtype: dict
+        """
+        ptrac = self.get_json(hash)
+        evidence = ptrac.get('evidence')
+        if isinstance(evidence, list):
+            ptrac['evidence'] = [self.get_json(item[EVIDENCE_REF_KEY]) if isinstance(item, dict) and EVIDENCE_REF_KEY in item else item for item in evidence]
+        return ptrac
+
+    def log_stats(self) -> None:
+        log.info(f'Content store - New objects saved: {self.objects_written} ({round(self.bytes_written/1024/1024, 1)} MB) | Existing objects reused: {self.objects_reused}')
@@ -1,32 +1,113 @@
 from copy import deepcopy
+from collections import defaultdict
+from hashlib import sha256
+import io
+import json
+import tempfile
+from typing import BinaryIO, Callable, Dict, Iterator, List, Tuple, Union
 
+import settings
 import utils.log_handler as logger
 log = logger.log
 from utils.auth_handler import Auth
 import utils.input_utils as input
+import utils.general_utils as utils
+import utils.concurrency_utils as concurrency
+from utils.request_handler import PTWrapperLibraryResponse
+from api.exceptions import PTWrapperLibraryFailed
 import api
 
-def get_page_of_clients(page: int = 0, clients: list = [], total_clients: int = -1, auth:Auth=None) -> bool:
+
+# keys of a report object with the last updated time of the report
+REPORT_UPDATED_AT_KEYS = ["updatedAt", "updated_at"]
+
+def _get_page_records(response: PTWrapperLibraryResponse, data_key: str, name: str) -> Tuple[list, int]:
     """
-    Handles traversing pagination results to create a list of all items.
+    Validates the response of a single page request
+
+    :raises PTWrapperLibraryFailed: the page request did not return a success status
+    :return: tuple of (list of records in the page, total number of records across all pages)
+    :rtype: Tuple[list, int]
+    """
+    if response.json.get("status") != "success":
+        raise PTWrapperLibraryFailed(f'Could not retrieve {name} from instance')
+    return response.json.get(data_key, []), int(response.json['meta']['pagination']['total'])
+
 
+def iter_paginated_records(get_page: Callable[[dict], PTWrapperLibraryResponse], limit: int, data_key: str = "data", page: int = 0, name: str = "records") -> Iterator[dict]:
+    """
+    Generic paginator for list endpoints that take a `pagination` payload and return the total number of records in
+    `meta.pagination.total`. Yields each record in the page, so callers can start processing records before every page
+    has been retrieved.
+
+    The first page is requested on its own to get the total. The remaining pages are then requested by a pool of
+    `settings.pagination_workers` workers, and records are still yielded in the original order. Records are yielded
+    straight from the response without copying.
+
+    :param get_page: function that sends the request for a single page, given the `pagination` payload. called from worker threads
+    :type get_page: Callable[[dict], PTWrapperLibraryResponse]
+    :param limit: number of records per page, must be a limit accepted by the endpoint
+    :type limit: int
+    :param data_key: key in the response JSON that holds the list of records, defaults to "data"
+    :type data_key: str, optional
     :param page: page to start on, for all results use 0, defaults to 0
     :type page: int, optional
-    :param clients: the list passed in will be added to, acts as return, defaults to []
-    :type clients: list, optional
-    :param total_clients: used for recursion to know when all pages have been gathered, defaults to -1
-    :type total_clients: int, optional
-    :param auth: Auth object for API requests
-    :type auth: Auth
+    :param name: name of the records, mentioned during exceptions, defaults to "records"
+    :type name: str, optional
+    :raises PTWrapperLibraryFailed: a page request did not return a success status
+    :yield: each record from every page, in order
+    :rtype: Iterator[dict]
+    """
+    def get_page_at_offset(offset: int) -> Tuple[list, int]:
+        payload = {
+            "pagination": {
+                "offset": offset,
+                "limit": limit
+            }
+        }
+        return _get_page_records(get_page(payload), data_key, name)
+
+    first_offset = page*limit
+    records, total = get_page_at_offset(first_offset)
+    yield from records
+    if len(records) < 1:
+        return
+
+    remaining_offsets = range(first_offset+limit, total, limit)
+    for records, _ in concurrency.map_in_order(get_page_at_offset, remaining_offsets, max_workers=settings.pagination_workers):
+        if len(records) < 1:
+            return # the total changed while paginating, there are no more records
+        yield from records
+
+
+def _add_records_to_list(records: Iterator[dict], record_list: list) -> bool:
+    """
+    Adds each record from a paginator to a list, logging the error if any page request fails
+
     :return: boolean if all page requests were successful
     :rtype: bool
     """
-    payload = {
-        "pagination": {
-            "offset": page*100,
-            "limit": 100
-        }
-    }
+    try:
+        for record in records:
+            record_list.append(record)
+    except Exception as e:
+        log.exception(e)
+        return False
+    return True
+
+
+def iter_clients(page: int = 0, auth:Auth=None) -> Iterator[dict]:
+    """
+    Yields each of the clients in the tenant, requesting one page at a time. See `iter_paginated_records`.
+
+    :param page: page to start on, for all results use 0, defaults to 0
+    :type page: int, optional
+    :param auth: Auth object for API requests
+    :type auth: Auth
+    :raises PTWrapperLibraryFailed: a page request did not return a success status
+    :yield: each client object
+    :rtype: Iterator[dict]
+    """
     # region - full structure of client data response
 
     # {
@@ -82,45 +163,37 @@ def get_page_of_clients(page: int = 0, clients: list = [], total_clients: int =
     #     }
     # }
     # endregion
-    try:
-        response = api.clients.list_clients(auth.base_url, auth.get_auth_headers(), payload)
-        if response.json.get("status") != "success":
-            log.exception(f'Could not retrieve clients from instance')
-            return False
-    except Exception as e:
-        log.exception(e)
-        return False
-    
-    total_clients = int(response.json['meta']['pagination']['total'])
-    if len(response.json['data']) > 0:
-        clients += deepcopy(response.json['data'])
-
-    if len(clients) < total_clients:
-        return get_page_of_clients(page+1, clients, total_clients, auth=auth)
-    
-    return True
+    return iter_paginated_records(lambda payload: api.clients.list_clients(auth.base_url, auth.get_auth_headers(), payload), limit=100, data_key="data", page=page, name="clients")
 
-def get_page_of_reports(page: int = 0, reports: list = [], total_reports: int = -1, auth:Auth=None) -> None:
+def get_page_of_clients(page: int = 0, clients: list = None, auth:Auth=None) -> bool:
     """
     Handles traversing pagination results to create a list of all items.
 
     :param page: page to start on, for all results use 0, defaults to 0
     :type page: int, optional
-    :param reports: the list passed in will be added to, acts as return, defaults to []
-    :type reports: list, optional
-    :param total_reports: used for recursion to know when all pages have been gathered, defaults to -1
-    :type total_reports: int, optional
+    :param clients: the list passed in will be added to, acts as return
+    :type clients: list
     :param auth: Auth object for API requests
     :type auth: Auth
     :return: boolean if all page requests were successful
     :rtype: bool
     """
-    payload = {
-        "pagination": {
-            "offset": page*1000,
-            "limit": 1000
-        }
-    }
+    if clients == None:
+        clients = []
+    return _add_records_to_list(iter_clients(page=page, auth=auth), clients)
+
+def iter_reports(page: int = 0, auth:Auth=None) -> Iterator[dict]:
+    """
+    Yields each of the reports in the tenant, requesting one page at a time. See `iter_paginated_records`.
+
+    :param page: page to start on, for all results use 0, defaults to 0
+    :type page: int, optional
+    :param auth: Auth object for API requests
+    :type auth: Auth
+    :raises PTWrapperLibraryFailed: a page request did not return a success status
+    :yield: each report object
+    :rtype: Iterator[dict]
+    """
     # region - full structure of report data response
     
     # {
@@ -204,45 +277,37 @@ def get_page_of_reports(page: int = 0, reports: list = [], total_reports: int =
     # }
 
     # endregion
-    try:
-        response = api.reports.get_report_list(auth.base_url, auth.get_auth_headers(), payload)
-        if response.json['status'] != "success":
-            log.exception(f'Could not retrieve reports from instance')
-            return False
-    except Exception as e:
-        log.exception(e)
-        return False
-    
-    total_reports = int(response.json['meta']['pagination']['total'])
-    if len(response.json['data']) > 0:
-        reports += deepcopy(response.json['data'])
+    return iter_paginated_records(lambda payload: api.reports.get_report_list(auth.base_url, auth.get_auth_headers(), payload), limit=1000, data_key="data", page=page, name="reports")
 
-    if len(reports) < total_reports:
-        return get_page_of_reports(page+1, reports, total_reports, auth=auth)
-    
-    return True
-
-def get_page_of_assets(page: int = 0, assets: list = [], total_assets: int = -1, auth:Auth=None) -> None:
+def get_page_of_reports(page: int = 0, reports: list = None, auth:Auth=None) -> bool:
     """
     Handles traversing pagination results to create a list of all items.
 
     :param page: page to start on, for all results use 0, defaults to 0
     :type page: int, optional
-    :param assets: the list passed in will be added to, acts as return, defaults to []
-    :type assets: list, optional
-    :param total_assets: used for recursion to know when all pages have been gathered, defaults to -1
-    :type total_assets: int, optional
+    :param reports: the list passed in will be added to, acts as return
+    :type reports: list
     :param auth: Auth object for API requests
     :type auth: Auth
     :return: boolean if all page requests were successful
     :rtype: bool
     """
-    payload = {
-        "pagination": {
-            "offset": page*1000,
-            "limit": 1000
-        }
-    }
+    if reports == None:
+        reports = []
+    return _add_records_to_list(iter_reports(page=page, auth=auth), reports)
+
+def iter_assets(page: int = 0, auth:Auth=None) -> Iterator[dict]:
+    """
+    Yields each of the assets in the tenant, requesting one page at a time. See `iter_paginated_records`.
+
+    :param page: page to start on, for all results use 0, defaults to 0
+    :type page: int, optional
+    :param auth: Auth object for API requests
+    :type auth: Auth
+    :raises PTWrapperLibraryFailed: a page request did not return a success status
+    :yield: each asset object
+    :rtype: Iterator[dict]
+    """
     # region - full structure of asset data response
     
     # {
@@ -317,27 +382,28 @@ def get_page_of_assets(page: int = 0, assets: list = [], total_assets: int = -1,
     # }
 
     # endregion
-    try:
-        response = api.assets.get_tenant_assets(auth.base_url, auth.get_auth_headers(), payload)
-        if response.json['status'] != "success":
-            log.exception(f'Could not retrieve assets from instance')
-            return False
-    except Exception as e:
-        log.exception(e)
-        return False
-    
-    total_assets = int(response.json['meta']['pagination']['total'])
-    if len(response.json['assets']) > 0:
-        assets += deepcopy(response.json['assets'])
+    return iter_paginated_records(lambda payload: api.assets.get_tenant_assets(auth.base_url, auth.get_auth_headers(), payload), limit=1000, data_key="assets", page=page, name="assets")
 
-    if len(assets) < total_assets:
-        return get_page_of_assets(page+1, assets, total_assets, auth=auth)
-    
-    return True
+def get_page_of_assets(page: int = 0, assets: list = None, auth:Auth=None) -> bool:
+    """
+    Handles traversing pagination results to create a list of all items.
+
+    :param page: page to start on, for all results use 0, defaults to 0
+    :type page: int, optional
+    :param assets: the list passed in will be added to, acts as return
+    :type assets: list
+    :param auth: Auth object for API requests
+    :type auth: Auth
+    :return: boolean if all page requests were successful
+    :rtype: bool
+    """
+    if assets == None:
+        assets = []
+    return _add_records_to_list(iter_assets(page=page, auth=auth), assets)
 
-def get_page_of_report_findings(client_id: int, report_id: int, page: int = 0, findings: list = [], total_findings: int = -1, auth:Auth=None) -> bool:
+def iter_report_findings(client_id: int, report_id: int, page: int = 0, auth:Auth=None) -> Iterator[dict]:
     """
-    Handles traversing pagination results to create a list of all finding in a report.
+    Yields each of the findings in a report, requesting one page at a time. See `iter_paginated_records`.
 
     :param client_id: id of client
     :type client_id: int
@@ -345,21 +411,12 @@ def get_page_of_report_findings(client_id: int, report_id: int, page: int = 0, f
     :type report_id: int
     :param page: page to start on, for all results use 0, defaults to 0
     :type page: int, optional
-    :param findings: the list passed in will be added to, acts as return, defaults to []
-    :type findings: list, optional
-    :param total_findings: used for recursion to know when all pages have been gathered, defaults to -1
-    :type total_findings: int, optional
     :param auth: Auth object for API requests
     :type auth: Auth
-    :return: boolean if all page requests were successful
-    :rtype: bool
+    :raises PTWrapperLibraryFailed: a page request did not return a success status
+    :yield: each finding object
+    :rtype: Iterator[dict]
     """
-    payload = {
-        "pagination": {
-            "offset": page*100,
-            "limit": 100
-        }
-    }
     # region - full structure of finding data response
 
     # {
@@ -633,23 +690,198 @@ def get_page_of_report_findings(client_id: int, report_id: int, page: int = 0, f
     # }
 
     # endregion
+    return iter_paginated_records(lambda payload: api.findings.get_findings_by_report(auth.base_url, auth.get_auth_headers(), client_id, report_id, payload), limit=100, data_key="data", page=page, name="findings")
+
+def get_page_of_report_findings(client_id: int, report_id: int, page: int = 0, findings: list = None, auth:Auth=None) -> bool:
+    """
+    Handles traversing pagination results to create a list of all finding in a report.
+
+    :param client_id: id of client
+    :type client_id: int
+    :param report_id: id of report
+    :type report_id: int
+    :param page: page to start on, for all results use 0, defaults to 0
+    :type page: int, optional
+    :param findings: the list passed in will be added to, acts as return
+    :type findings: list
+    :param auth: Auth object for API requests
+    :type auth: Auth
+    :return: boolean if all page requests were successful
+    :rtype: bool
+    """
+    if findings == None:
+        findings = []
+    return _add_records_to_list(iter_report_findings(client_id, report_id, page=page, auth=auth), findings)
+
+def group_reports_by_client_id(reports: List[dict]) -> Dict[int, List[dict]]:
+    """
+    Groups a list of reports by the client each report is under, in a single pass over the list.
+    The order of reports in each group matches the order they appear in `reports`.
+
+    :param reports: list of reports returned from the POST Get Report List endpoint
+    :type reports: List[dict]
+    :return: dictionary of {client_id: [report objects under client]}
+    :rtype: Dict[int, List[dict]]
+    """
+    reports_by_client_id = defaultdict(list)
+    for report in reports:
+        reports_by_client_id[report['client_id']].append(report)
+    return dict(reports_by_client_id)
+
+
+def get_report_updated_at(report: dict) -> Union[int, str, None]:
+    """
+    :param report: report object returned from the POST Get Report List or GET Get Report endpoints
+    :type report: dict
+    :return: last updated time of the report, or None if the report object doesn't include it
+    :rtype: Union[int, str, None]
+    """
+    for key in REPORT_UPDATED_AT_KEYS:
+        if report.get(key) != None:
+            return report[key]
+    return None
+
+
+def add_report_updated_at(reports: List[dict], auth:Auth=None) -> List[dict]:
+    """
+    The report list from Plextrac instances only includes when each report was created, so the record of a report
+    doesn't change when its findings or narratives are edited. Loads the last updated time of each report that doesn't
+    have one from the GET Get Report endpoint, one small request per report instead of exporting its PTRAC, and adds it
+    to a copy of the report record. Requests are sent by `settings.pagination_workers` workers.
+
+    Used by incremental exports, so `get_report_hash` can tell edited reports apart from unchanged ones. Reports whose
+    last updated time couldn't be loaded are returned without it, and are exported again.
+
+    :param reports: report objects returned from the POST Get Report List endpoint
+    :type reports: List[dict]
+    :param auth: Auth object for API requests
+    :type auth: Auth
+    :return: report objects with the last updated time of each report, in the same order
+    :rtype: List[dict]
+    """
+    missing = [report for report in reports if get_report_updated_at(report) == None]
+    if len(missing) < 1:
+        return reports
+    log.info(f'Loading the last updated time of {len(missing)} report(s)...')
+    def load_updated_at(report):
+        response = api.reports.get_report(auth.base_url, auth.get_auth_headers(), report['client_id'], report['id'], None)
+        return get_report_updated_at(response.json)
+    updated_at = {}
+    for report, value, e in concurrency.run_concurrently(load_updated_at, missing, max_workers=settings.pagination_workers):
+        if e != None:
+            log.debug(f'Could not load the last updated time of report \'{report["name"]}\'. {e}')
+        elif value != None:
+            updated_at[report['id']] = value
+    if len(updated_at) < len(missing):
+        log.warning(f'Could not load the last updated time of {len(missing)-len(updated_at)} of {len(missing)} report(s), these report(s) will be exported again')
+    return [{**report, "updatedAt": updated_at[report['id']]} if report['id'] in updated_at else report for report in reports]
+
+
+def get_report_hash(report: dict) -> Union[str, None]:
+    """
+    Returns a hash of the report record, including the last updated time of the report, that is used to check if a
+    report changed between exports. The rest of the record doesn't change when the findings or narratives of a report
+    are edited, so records without the last updated time have no hash and the report is always exported again, see
+    `add_report_updated_at`.
+
+    :param report: report object returned from the POST Get Report List endpoint
+    :type report: dict
+    :return: sha256 hash of the report data, or None if the report doesn't have a last updated time
+    :rtype: Union[str, None]
+    """
+    if get_report_updated_at(report) == None:
+        return None
+    return sha256(json.dumps(report, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_client_hash(client: dict) -> str:
+    """
+    Client objects don't have a last updated time. Returns a hash of the client data that is used to check if a
+    client changed between exports.
+
+    :param client: client object returned from the POST List Clients endpoint
+    :type client: dict
+    :return: sha256 hash of the client data
+    :rtype: str
+    """
+    return sha256(json.dumps(client, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def download_ptrac_report(report: dict, file: BinaryIO, auth:Auth=None) -> int:
+    """
+    Downloads the PTRAC of a report into a file, a chunk at a time as it is received, so the PTRAC is never held in
+    memory. Raises an exception if the report could not be downloaded, or the instance didn't return a PTRAC.
+
+    :param report: report object returned from the POST Get Report List endpoint
+    :type report: dict
+    :param file: seekable file opened in binary mode, like a temp file. left at the start of the PTRAC
+    :type file: BinaryIO
+    :param auth: Auth object for API requests
+    :type auth: Auth
+    :return: size of the PTRAC in bytes
+    :rtype: int
+    """
     try:
-        response = api.findings.get_findings_by_report(auth.base_url, auth.get_auth_headers(), client_id, report_id, payload)
-        if response.json['status'] != "success":
-            log.exception(f'Could not retrieve findings from report')
-            return False
+        api.reports.export_report_to_ptrac(auth.base_url, auth.get_auth_headers(), report['client_id'], report['id'], stream_to=file)
     except Exception as e:
-        log.exception(e)
-        return False
-    
-    total_findings = int(response.json['meta']['pagination']['total'])
-    if len(response.json['data']) > 0:
-        findings += deepcopy(response.json['data'])
+        raise Exception(f'Could not download ptrac for report \'{report["name"]}\'') from e
+    size = file.tell()
+    if not utils.probe_is_ptrac(file):
+        raise Exception(f'Export of report \'{report["name"]}\' did not return a valid PTRAC')
+    return size
 
-    if len(findings) < total_findings:
-        return get_page_of_report_findings(client_id, report_id, page+1, findings, total_findings, auth=auth)
-    
-    return True
+
+def download_ptrac_report_to_temp_file(report: dict, auth:Auth=None, folder_path: str = None, in_memory: bool = False) -> Tuple[BinaryIO, int]:
+    """
+    Downloads the PTRAC of a report into a new temp file with `download_ptrac_report`. The temp file is deleted when it
+    is closed, and is closed if the download fails.
+
+    :param report: report object returned from the POST Get Report List endpoint
+    :type report: dict
+    :param auth: Auth object for API requests
+    :type auth: Auth
+    :param folder_path: folder to create the temp file in, defaults to the system temp folder
+    :type folder_path: str, optional
+    :param in_memory: hold the PTRAC in memory instead of writing it to disk, for callers that limit how many PTRACs
+    they hold at once, like migrations, defaults to False
+    :type in_memory: bool, optional
+    :return: tuple of (temp file at the start of the PTRAC, size of the PTRAC in bytes)
+    :rtype: Tuple[BinaryIO, int]
+    """
+    ptrac_file = io.BytesIO() if in_memory else tempfile.TemporaryFile(dir=folder_path)
+    try:
+        return ptrac_file, download_ptrac_report(report, ptrac_file, auth=auth)
+    except Exception:
+        ptrac_file.close()
+        raise
+
+
+def import_ptrac_report(ptrac: Union[dict, bytes, str, BinaryIO], client_id: int, auth:Auth=None) -> PTWrapperLibraryResponse:
+    """
+    Creates a new report under a client from a PTRAC. Raw PTRAC bytes, or a PTRAC file, are uploaded as they are,
+    without being parsed and serialized again.
+
+    :param ptrac: loaded PTRAC JSON, raw PTRAC JSON, file path of a PTRAC file, or a PTRAC file opened in binary mode
+    :type ptrac: Union[dict, bytes, str, BinaryIO]
+    :param client_id: id of client to create the report under
+    :type client_id: int
+    :param auth: Auth object for API requests
+    :type auth: Auth
+    :return: response of the POST Import PTRAC Report request
+    :rtype: PTWrapperLibraryResponse
+    """
+    if isinstance(ptrac, str):
+        with open(ptrac, 'rb') as f:
+            return api.reports.import_ptrac_report(auth.base_url, auth.get_auth_headers(), client_id, {'file': f})
+    if hasattr(ptrac, "read"):
+        ptrac.seek(0)
+        return api.reports.import_ptrac_report(auth.base_url, auth.get_auth_headers(), client_id, {'file': ptrac})
+    if isinstance(ptrac, dict):
+        ptrac = json.dumps(ptrac).encode('utf-8')
+    multipart_form_data = {
+        'file': io.BytesIO(ptrac)
+    }
+    return api.reports.import_ptrac_report(auth.base_url, auth.get_auth_headers(), client_id, multipart_form_data)
 
 
 def get_writeups(writeups: list = [], auth:Auth=None) -> bool:
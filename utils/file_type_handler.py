@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+from typing import Dict, List, Union
+
+import utils.log_handler as logger
+log = logger.log
+import utils.general_utils as utils
+import utils.concurrency_utils as concurrency
+
+
+FILE_TYPE_CACHE_FILE_PATH = "exported_data/file_type_cache.json"
+FILE_TYPE_SCAN_WORKERS = 8 # files sniffed at the same time when scanning a folder. each sniff is a short read, so this is I/O bound
+
+
+class FileTypeCache():
+    """
+    A class to cache the object type of JSON files, e.g. whether a file is a client, a PTRAC or an export manifest.
+    Types are found with `utils.sniff_json_object_type`, which only reads the start and end of each file, and are saved
+    to `exported_data/file_type_cache.json` so scanning the same files again only needs a `stat` of each file.
+
+    Entries are keyed by absolute file path, and are ignored once the size or modified time of the file changes.
+    """
+    def __init__(self, file_path: str = FILE_TYPE_CACHE_FILE_PATH):
+        """
+        :param file_path: file path the cache is saved to, defaults to FILE_TYPE_CACHE_FILE_PATH
+        :type file_path: str, optional
+        """
+        self.file_path = file_path
+        self.hits = 0
+        self.misses = 0
+        self._types: Dict[str, list] = {} # {absolute file path: [size, modified time in ns, object type]}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._unsaved_changes = 0
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path, 'r', encoding="utf8") as f:
+                self._types = json.load(f)
+        except Exception as e:
+            log.exception(f'Could not load file type cache \'{self.file_path}\', starting with an empty cache\n{e}')
+            self._types = {}
+
+    def get_file_type(self, file_path: str) -> Union[str, None]:
+        """
+        :param file_path: file path of a JSON file
+        :type file_path: str
+        :return: one of ["client", "report", "ptrac", "export_manifest"], or None if the file isn't one of these types
+        :rtype: Union[str, None]
+        """
+        stat = os.stat(file_path)
+        key = os.path.abspath(file_path)
+        with self._lock:
+            self._load()
+            entry = self._types.get(key)
+            if entry != None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                self.hits += 1
+                return entry[2]
+
+        object_type = utils.sniff_json_object_type(file_path)
+        with self._lock:
+            self._types[key] = [stat.st_size, stat.st_mtime_ns, object_type]
+            self.misses += 1
+            self._unsaved_changes += 1
+        return object_type
+
+    def scan_folder(self, folder_path: str, extensions: List[str] = [".json", ".ptrac"]) -> Dict[Union[str, None], List[str]]:
+        """
+        Gets the type of every file in a folder with one of `extensions`, and saves the cache
+
+        :param folder_path: folder to scan, not including sub folders
+        :type folder_path: str
+        :param extensions: file extensions of the files to scan, defaults to [".json", ".ptrac"]
+        :type extensions: List[str], optional
+        :return: dictionary of {object type: sorted list of file paths}. files that aren't a known type, or couldn't be read, are under None
+        :rtype: Dict[Union[str, None], List[str]]
+        """
+        file_paths = [os.path.join(folder_path, file_name) for file_name in sorted(os.listdir(folder_path)) if os.path.splitext(file_name)[1] in extensions]
+        file_paths_by_type = {}
+        for file_path, object_type, e in concurrency.run_concurrently(self.get_file_type, file_paths, max_workers=FILE_TYPE_SCAN_WORKERS):
+            if e != None:
+                log.exception(f'Could not read file \'{file_path}\'\n{e}')
+            file_paths_by_type.setdefault(object_type, []).append(file_path)
+        for object_file_paths in file_paths_by_type.values():
+            object_file_paths.sort()
+        self.save()
+        log.debug(f'Scanned {len(file_paths)} file(s) in \'{folder_path}\' - file type cache hits: {self.hits} | misses: {self.misses}')
+        return file_paths_by_type
+
+    def save(self) -> None:
+        """
+        Saves the cache if any file types were added since the last save. The cache is written to a temp file and renamed
+        over the previous version.
+        """
+        with self._lock:
+            if self._unsaved_changes < 1:
+                return
+            types = dict(self._types)
+            self._unsaved_changes = 0
+        try:
+            os.makedirs(os.path.dirname(self.file_path) or ".", exist_ok=True)
+            temp_file_path = f'{self.file_path}.{threading.get_ident()}.tmp'
+            with open(temp_file_path, 'w', encoding="utf8") as f:
+                json.dump(types, f)
+            os.replace(temp_file_path, self.file_path)
+        except Exception as e:
+            log.exception(f'Could not save file type cache \'{self.file_path}\'\n{e}')
+
+
+file_type_cache = FileTypeCache()
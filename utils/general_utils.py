@@ -1,11 +1,13 @@
 import re
 import time
+import json
 from hashlib import sha256
-from typing import List
+from typing import BinaryIO, List, Tuple, Union
 import os
 
 import utils.log_handler as logger
 log = logger.log
+import utils.json_stream_utils as json_stream
 
 
 def format_key(string: str) -> str:
@@ -183,38 +185,140 @@ def get_script_root_path(start_path=None):
 
 def get_json_object_type(loaded_json):
     """
-    :return: ["client", "report", "ptrac"]
+    :return: ["client", "report", "ptrac", "export_manifest"]
     :rtype: str
     """
     if _json_is_client(loaded_json): return "client"
     if _json_is_report(loaded_json): return "report"
     if _json_is_ptrac(loaded_json): return "ptrac"
+    if _json_is_export_manifest(loaded_json): return "export_manifest"
     return None
     
 
+JSON_PROBE_SIZE = 64 * 1024 # bytes read from the start and end of a file when probing its type
+
+# top level keys every object of a type has
+CLIENT_KEYS = ["poc", "poc_email", "users", "doc_type"]
+REPORT_KEYS = ["template", "fields_template", "reviewers", "operators", "includeEvidence"]
+PTRAC_KEYS = ["report_info", "flaws_array", "summary", "evidence", "client_info", "procedures"]
+EXPORT_MANIFEST_KEYS = ["workflow", "base_url", "started_at", "status", "clients", "reports"]
+# top level keys that are only found in one type of object. used to tell the type of a large file from the keys at
+# the start of the file, when the rest of its keys are past the part that was read. a PTRAC needs two of its keys, since
+# other large JSON, like a report with its findings, can have one of them
+OBJECT_TYPE_SIGNATURES = [
+    ("ptrac", ["report_info", "flaws_array"]),
+    ("ptrac", ["report_info", "client_info"]),
+    ("ptrac", ["client_info", "flaws_array"]),
+    ("report", ["fields_template"]),
+    ("export_manifest", ["workflow", "base_url", "started_at"])
+]
+
+
+def _get_signature_object_type(keys: dict) -> Union[str, None]:
+    for object_type, signature_keys in OBJECT_TYPE_SIGNATURES:
+        if all(key in keys for key in signature_keys):
+            return object_type
+    return None
+
+
+def _scan_top_level_keys(data: Union[bytes, str], stop_at_signature: bool = False) -> Tuple[dict, bool]:
+    """
+    Reads the top level keys of a JSON object without decoding their values, except `doc_type`, which is needed to
+    tell if the object is a client
+
+    :param data: raw JSON, which can be cut off, or file path of a JSON file
+    :type data: Union[bytes, str]
+    :param stop_at_signature: stop reading once the keys read match one of `OBJECT_TYPE_SIGNATURES`, defaults to False
+    :type stop_at_signature: bool, optional
+    :return: tuple of (dictionary of {key: None, "doc_type": value} for each key read, whether the whole object was read)
+    :rtype: Tuple[dict, bool]
+    """
+    keys = {}
+    try:
+        with json_stream.open_json_stream(data) as reader:
+            for key in reader.iter_object():
+                keys[key] = reader.read_value() if key == "doc_type" else None
+                if stop_at_signature and _get_signature_object_type(keys) != None:
+                    return keys, False
+    except ValueError:
+        return keys, False
+    return keys, True
+
+
+def sniff_json_object_type(data: Union[bytes, str, BinaryIO]) -> Union[str, None]:
+    """
+    Gets the type of raw JSON, or a JSON file, without parsing all of it. Only the first and last `JSON_PROBE_SIZE`
+    bytes are read. The top level keys at the start are checked for all the keys of a type, then for the signature keys
+    that only one type has. If neither shows the type of a large file, the top level keys of the whole file are
+    scanned, without decoding their values.
+
+    A large file must start with '{' and end with '}', so a file that was cut off while being written is not valid.
+
+    :param data: raw JSON, file path of a JSON file, or a seekable file opened in binary mode, which is read from the start
+    :type data: Union[bytes, str, BinaryIO]
+    :return: one of ["client", "report", "ptrac", "export_manifest"], or None if the JSON isn't one of these types
+    :rtype: Union[str, None]
+    """
+    if isinstance(data, bytes):
+        head, tail, size = data[:JSON_PROBE_SIZE], data[-JSON_PROBE_SIZE:], len(data)
+    elif hasattr(data, "read"):
+        data.seek(0)
+        head = data.read(JSON_PROBE_SIZE)
+        size = data.seek(0, os.SEEK_END)
+        data.seek(max(0, size - JSON_PROBE_SIZE))
+        tail = data.read()
+        data.seek(0)
+    else:
+        with open(data, 'rb') as f:
+            head = f.read(JSON_PROBE_SIZE)
+            size = os.fstat(f.fileno()).st_size
+            f.seek(max(0, size - JSON_PROBE_SIZE))
+            tail = f.read()
+
+    # small enough to fully check
+    if size <= JSON_PROBE_SIZE:
+        try:
+            loaded_json = json.loads(head)
+        except ValueError:
+            return None
+        return get_json_object_type(loaded_json) if isinstance(loaded_json, dict) else None
+
+    head = head[3:] if head.startswith(b'\xef\xbb\xbf') else head
+    if not head.lstrip().startswith(b'{') or not tail.rstrip().endswith(b'}'):
+        return None
+    keys, complete = _scan_top_level_keys(head, stop_at_signature=True)
+    object_type = get_json_object_type(keys) or _get_signature_object_type(keys)
+    if object_type != None or complete:
+        return object_type
+    keys, complete = _scan_top_level_keys(data)
+    if hasattr(data, "seek"):
+        data.seek(0)
+    return get_json_object_type(keys) if complete else None
+
+
+def probe_is_ptrac(data: Union[bytes, str, BinaryIO]) -> bool:
+    """
+    Checks whether raw JSON, or a JSON file, is a PTRAC without parsing all of it. See `sniff_json_object_type`
+
+    :param data: raw JSON, file path of a JSON file, or a seekable file opened in binary mode
+    :type data: Union[bytes, str, BinaryIO]
+    :return: whether the JSON looks like a PTRAC
+    :rtype: bool
+    """
+    return sniff_json_object_type(data) == "ptrac"
+
+
 def _json_is_client(json_object) -> bool:
-    if "poc" not in list(json_object.keys()): return False
-    if "poc_email" not in list(json_object.keys()): return False
-    if "users" not in list(json_object.keys()): return False
-    if "doc_type" not in list(json_object.keys()): return False
-    if json_object['doc_type'] != "client": return False
-    return True
+    return all(key in json_object for key in CLIENT_KEYS) and json_object['doc_type'] == "client"
 
 
 def _json_is_report(json) -> bool:
-    if "template" not in list(json.keys()): return False
-    if "fields_template" not in list(json.keys()): return False
-    if "reviewers" not in list(json.keys()): return False
-    if "operators" not in list(json.keys()): return False
-    if "includeEvidence" not in list(json.keys()): return False
-    return True
+    return all(key in json for key in REPORT_KEYS)
     
 
 def _json_is_ptrac(json) -> bool:
-    if "report_info" not in list(json.keys()): return False
-    if "flaws_array" not in list(json.keys()): return False
-    if "summary" not in list(json.keys()): return False
-    if "evidence" not in list(json.keys()): return False
-    if "client_info" not in list(json.keys()): return False
-    if "procedures" not in list(json.keys()): return False
-    return True
\ No newline at end of file
+    return all(key in json for key in PTRAC_KEYS)
+
+
+def _json_is_export_manifest(json) -> bool:
+    return all(key in json for key in EXPORT_MANIFEST_KEYS)
\ No newline at end of file
@@ -3,7 +3,7 @@ import time
 from utils.auth_handler import Auth
 
 
-args = None
+args = None # command line arguments parsed in main.py
 auth:Auth = None
 
 script_time_seconds: float = time.time()
@@ -0,0 +1,341 @@
+import io
+import json
+import re
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Iterator, List, Union
+
+
+STREAM_CHUNK_SIZE = 1024 * 1024 # bytes read from the file at a time
+
+_WHITESPACE = b' \t\r\n'
+_STRING_BODY = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+_CONTAINER_SPECIAL = re.compile(rb'["{}\[\]]')
+_SCALAR_END = re.compile(rb'[,:}\]\s]')
+
+
+class JSONStreamReader():
+    """
+    A class to read a JSON document a piece at a time, without loading the whole document into memory or building
+    Python objects for the parts that aren't needed. Used for large PTRACs, where the dictionaries of the whole
+    document take many times the size of the file in memory.
+
+    The reader moves forward through the document. Values can be read with `read_value`, skipped with `skip_value`,
+    or stepped into with `iter_object` and `iter_array`. Skipped values are scanned for the end of the value without
+    being decoded, so skipping a large evidence string only costs a search for its closing quote.
+
+    Only the value being read is held in memory, along with one chunk of the file.
+    """
+    def __init__(self, file: BinaryIO, chunk_size: int = STREAM_CHUNK_SIZE):
+        """
+        :param file: file object opened in binary mode, positioned at the start of the JSON
+        :type file: BinaryIO
+        :param chunk_size: bytes read from the file at a time, defaults to STREAM_CHUNK_SIZE
+        :type chunk_size: int, optional
+        """
+        self._file = file
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._pos = 0 # position of the reader in the buffer
+        self._mark = None # position in the buffer of the start of a value being read, kept when the buffer is refilled
+        self._offset = 0 # position in the file of the start of the buffer
+        self._eof = False
+
+    def tell(self) -> int:
+        """
+        :return: position of the reader in the file
+        :rtype: int
+        """
+        return self._offset + self._pos
+
+    def _fill(self) -> bool:
+        """
+        Reads the next chunk of the file into the buffer, dropping the part of the buffer already read
+
+        :return: whether anything was read, False at the end of the file
+        :rtype: bool
+        """
+        if self._eof:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        keep = self._pos if self._mark == None else self._mark
+        if keep > 0:
+            del self._buffer[:keep]
+            self._offset += keep
+            self._pos -= keep
+            if self._mark != None:
+                self._mark -= keep
+        self._buffer += chunk
+        return True
+
+    def _peek(self) -> Union[int, None]:
+        """
+        Moves the reader past any whitespace
+
+        :return: the next byte, or None at the end of the file
+        :rtype: Union[int, None]
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, char: bytes) -> None:
+        if self._peek() != char[0]:
+            raise ValueError(f'Expected \'{char.decode()}\' at position {self.tell()} of JSON')
+        self._pos += 1
+
+    def peek_type(self) -> Union[str, None]:
+        """
+        :return: type of the next value, one of "object", "array", "string" or "scalar" for numbers, booleans and null, or None at the end of the file
+        :rtype: Union[str, None]
+        """
+        char = self._peek()
+        if char == None:
+            return None
+        return {ord('{'): "object", ord('['): "array", ord('"'): "string"}.get(char, "scalar")
+
+    def _skip_string(self) -> None:
+        self._pos += 1 # opening quote
+        while True:
+            # find() is much faster than a regex over long strings like base64 evidence
+            quote = self._buffer.find(b'"', self._pos)
+            backslash = self._buffer.find(b'\\', self._pos, quote if quote != -1 else len(self._buffer))
+            if backslash == -1 and quote != -1:
+                self._pos = quote + 1
+                return
+            if backslash != -1:
+                # the string has escaped characters, match up to the closing quote or the end of the buffer
+                self._pos = _STRING_BODY.match(self._buffer, backslash).end()
+                if self._pos < len(self._buffer) and self._buffer[self._pos] == ord('"'):
+                    self._pos += 1
+                    return
+            else:
+                self._pos = len(self._buffer)
+            if not self._fill():
+                raise ValueError(f'Unterminated string at position {self.tell()} of JSON')
+
+    def _skip_container(self) -> None:
+        depth = 0
+        while True:
+            match = _CONTAINER_SPECIAL.search(self._buffer, self._pos)
+            if match == None:
+                self._pos = len(self._buffer)
+                if not self._fill():
+                    raise ValueError(f'Unexpected end of JSON at position {self.tell()}')
+                continue
+            self._pos = match.start()
+            char = self._buffer[self._pos]
+            if char == ord('"'):
+                self._skip_string()
+                continue
+            self._pos += 1
+            depth += 1 if char in b'{[' else -1
+            if depth == 0:
+                return
+
+    def _skip_scalar(self) -> None:
+        while True:
+            match = _SCALAR_END.search(self._buffer, self._pos)
+            if match != None:
+                self._pos = match.start()
+                return
+            self._pos = len(self._buffer)
+            if not self._fill():
+                return
+
+    def skip_value(self) -> None:
+        """
+        Moves the reader past the next value without decoding it
+        """
+        value_type = self.peek_type()
+        if value_type == None:
+            raise ValueError(f'Unexpected end of JSON at position {self.tell()}')
+        if value_type == "string":
+            self._skip_string()
+        elif value_type in ["object", "array"]:
+            self._skip_container()
+        else:
+            self._skip_scalar()
+
+    def read_value(self) -> Any:
+        """
+        Decodes the next value. The whole value is held in memory, so use `iter_object` or `iter_array` to step into
+        large values instead.
+
+        :return: decoded value
+        :rtype: Any
+        """
+        self._peek()
+        self._mark = self._pos
+        try:
+            self.skip_value()
+            return json.loads(self._buffer[self._mark:self._pos])
+        finally:
+            self._mark = None
+
+    def iter_object(self) -> Iterator[str]:
+        """
+        Steps into the object at the reader and yields each of its keys. After a key is yielded, the reader is at the
+        start of its value, which the caller can read, or step into and iterate to the end. Values the caller doesn't
+        touch are skipped.
+
+        :yield: key of each item in the object
+        :rtype: Iterator[str]
+        """
+        self._expect(b'{')
+        if self._peek() == ord('}'):
+            self._pos += 1
+            return
+        while True:
+            if self.peek_type() != "string":
+                raise ValueError(f'Expected object key at position {self.tell()} of JSON')
+            key = self.read_value()
+            self._expect(b':')
+            self._peek()
+            value_position = self.tell()
+            yield key
+            if self.tell() == value_position:
+                self.skip_value()
+            char = self._peek()
+            self._pos += 1
+            if char == ord('}'):
+                return
+            if char != ord(','):
+                raise ValueError(f'Expected \',\' or \'}}\' at position {self.tell()-1} of JSON')
+
+    def iter_array(self) -> Iterator[Any]:
+        """
+        Steps into the array at the reader and yields each item, decoded one at a time
+
+        :yield: each decoded item in the array
+        :rtype: Iterator[Any]
+        """
+        self._expect(b'[')
+        if self._peek() == ord(']'):
+            self._pos += 1
+            return
+        while True:
+            yield self.read_value()
+            char = self._peek()
+            self._pos += 1
+            if char == ord(']'):
+                return
+            if char != ord(','):
+                raise ValueError(f'Expected \',\' or \']\' at position {self.tell()-1} of JSON')
+
+    def count_array(self) -> int:
+        """
+        Steps over the array at the reader without decoding its items
+
+        :return: number of items in the array
+        :rtype: int
+        """
+        self._expect(b'[')
+        if self._peek() == ord(']'):
+            self._pos += 1
+            return 0
+        count = 0
+        while True:
+            self.skip_value()
+            count += 1
+            char = self._peek()
+            self._pos += 1
+            if char == ord(']'):
+                return count
+            if char != ord(','):
+                raise ValueError(f'Expected \',\' or \']\' at position {self.tell()-1} of JSON')
+
+
+@contextmanager
+def open_json_stream(source: Union[bytes, str, BinaryIO]) -> Iterator[JSONStreamReader]:
+    """
+    :param source: raw JSON, file path of a JSON file, or a file object opened in binary mode such as a ZIP entry
+    :type source: Union[bytes, str, BinaryIO]
+    :yield: reader positioned at the start of the JSON
+    :rtype: Iterator[JSONStreamReader]
+    """
+    if isinstance(source, (bytes, bytearray)):
+        yield JSONStreamReader(io.BytesIO(source))
+    elif isinstance(source, str):
+        with open(source, 'rb') as f:
+            yield JSONStreamReader(f)
+    else:
+        yield JSONStreamReader(source)
+
+
+def get_top_level_keys(source: Union[bytes, str, BinaryIO]) -> List[str]:
+    """
+    :param source: raw JSON, file path of a JSON file, or a file object opened in binary mode
+    :type source: Union[bytes, str, BinaryIO]
+    :raises ValueError: the JSON is not an object or is invalid
+    :return: keys of the JSON object, without decoding any of the values
+    :rtype: List[str]
+    """
+    with open_json_stream(source) as reader:
+        return list(reader.iter_object())
+
+
+def load_top_level_values(source: Union[bytes, str, BinaryIO], keys: List[str]) -> dict:
+    """
+    Loads some of the top level values of a JSON object, skipping the rest
+
+    :param source: raw JSON, file path of a JSON file, or a file object opened in binary mode
+    :type source: Union[bytes, str, BinaryIO]
+    :param keys: keys of the values to load
+    :type keys: List[str]
+    :raises ValueError: the JSON is not an object or is invalid
+    :return: dictionary of the keys found in the JSON object and their values
+    :rtype: dict
+    """
+    values = {}
+    with open_json_stream(source) as reader:
+        for key in reader.iter_object():
+            if key in keys:
+                values[key] = reader.read_value()
+    return values
+
+
+def iter_array_items(source: Union[bytes, str, BinaryIO], key: str) -> Iterator[Any]:
+    """
+    Yields the items of a top level array of a JSON object one at a time, e.g. the evidence of a PTRAC. Yields
+    nothing if the key is missing or isn't an array.
+
+    :param source: raw JSON, file path of a JSON file, or a file object opened in binary mode
+    :type source: Union[bytes, str, BinaryIO]
+    :param key: key of the array
+    :type key: str
+    :yield: each decoded item in the array
+    :rtype: Iterator[Any]
+    """
+    with open_json_stream(source) as reader:
+        for object_key in reader.iter_object():
+            if object_key == key and reader.peek_type() == "array":
+                yield from reader.iter_array()
+                return
+
+
+def load_ptrac_summary(source: Union[bytes, str, BinaryIO]) -> dict:
+    """
+    Loads the report and client info of a PTRAC, and counts its findings and evidence, in a single pass that skips
+    over the findings, evidence and everything else without decoding them
+
+    :param source: raw PTRAC JSON, file path of a PTRAC file, or a file object opened in binary mode
+    :type source: Union[bytes, str, BinaryIO]
+    :raises ValueError: the JSON is not an object or is invalid
+    :return: dictionary of {"report_info": dict or None, "client_info": dict or None, "findings": int, "evidence": int}
+    :rtype: dict
+    """
+    summary = {"report_info": None, "client_info": None, "findings": 0, "evidence": 0}
+    with open_json_stream(source) as reader:
+        for key in reader.iter_object():
+            if key in ["report_info", "client_info"]:
+                summary[key] = reader.read_value()
+            elif key in ["flaws_array", "evidence"] and reader.peek_type() == "array":
+                summary["findings" if key == "flaws_array" else "evidence"] = reader.count_array()
+    return summary
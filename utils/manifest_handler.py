@@ -0,0 +1,300 @@
+import json
+import os
+import threading
+import time
+from typing import Union
+
+import settings
+import utils.globals as globals
+import utils.log_handler as logger
+log = logger.log
+import utils.general_utils as utils
+
+
+MANIFESTS_FOLDER_PATH = "exported_data/manifests"
+
+
+class ExportManifest():
+    """
+    A class to record which clients and reports an export run has finished, with the file path and size of each
+    exported file. Each run writes its own manifest to `exported_data/manifests/<workflow>_<script_time>.json`.
+
+    The manifest is saved by writing a temp file and renaming it over the previous version, so a crash during a save
+    leaves the last complete version on disk instead of a partially written file.
+
+    Structure of the manifest JSON:
+    {
+        "workflow": "export_clients",
+        "base_url": "https://example.plextrac.com",
+        "started_at": "2024_06_17_20_25_33",
+        "updated_at": 1718655933.537,
+        "status": "in_progress", # or "complete"
+        "content_store": null, # folder path of the content store, if used
+        "clients": {
+            "1045": {"file_path": "exported_data/client_ZIPs/Green Testing_1045_2024_06_17_20_25_33.zip", "size": 52310, "reports": ["345951070"], "record_hash": "9f86d08..."}
+        },
+        "reports": {
+            "345951070": {"file_path": "exported_data/client_ZIPs/Green Testing_1045_2024_06_17_20_25_33.zip", "size": 48102, "client_id": 1045, "record_hash": "60303ae..."}
+        }
+    }
+    """
+    def __init__(self, workflow: str, base_url: str, file_path: str = None, content_store_path: str = None):
+        """
+        Create a manifest for a new export run. Nothing is written to disk until the first save.
+
+        :param workflow: name of the export workflow, used to find manifests of previous runs of the same workflow
+        :type workflow: str
+        :param base_url: URL to PT instance the data is exported from
+        :type base_url: str
+        :param file_path: file path to save the manifest to, defaults to a new manifest file for the current run
+        :type file_path: str, optional
+        :param content_store_path: folder path of the content store the run saves data to, if the content store is used.
+        the manifest is then the snapshot index of the run, and file paths point to objects in the content store, defaults to None
+        :type content_store_path: str, optional
+        """
+        if file_path == None:
+            file_path = f'{MANIFESTS_FOLDER_PATH}/{workflow}_{globals.script_time}.json'
+        self.file_path = file_path
+        self.data = {
+            "workflow": workflow,
+            "base_url": base_url,
+            "started_at": globals.script_time,
+            "updated_at": time.time(),
+            "status": "in_progress",
+            "content_store": content_store_path,
+            "clients": {},
+            "reports": {}
+        }
+        self._lock = threading.Lock()
+        self._unsaved_changes = 0
+
+    @classmethod
+    def load(cls, file_path: str) -> "ExportManifest":
+        """
+        Loads the manifest of a previous export run
+
+        :param file_path: file path of the manifest JSON
+        :type file_path: str
+        :return: loaded manifest
+        :rtype: ExportManifest
+        """
+        with open(file_path, 'r', encoding="utf8") as f:
+            data = json.load(f)
+        manifest = cls(data['workflow'], data['base_url'], file_path=file_path)
+        manifest.data = data
+        return manifest
+
+    @classmethod
+    def find_previous(cls, workflow: str, base_url: str, status: str = None, content_store_path: str = None) -> Union["ExportManifest", None]:
+        """
+        Finds the manifest of the most recent previous run of a workflow, against the same Plextrac instance, that saved
+        data to the same place (files or content store)
+
+        :param workflow: name of the export workflow
+        :type workflow: str
+        :param base_url: URL to PT instance the data was exported from
+        :type base_url: str
+        :param status: only return a manifest with this status, "in_progress" or "complete", defaults to any status
+        :type status: str, optional
+        :param content_store_path: folder path of the content store, if used, defaults to None
+        :type content_store_path: str, optional
+        :return: the most recent manifest, or None if no manifest was found
+        :rtype: Union[ExportManifest, None]
+        """
+        if not os.path.isdir(MANIFESTS_FOLDER_PATH):
+            return None
+        current_file_name = f'{workflow}_{globals.script_time}.json'
+        # file names end with the script time, which sorts chronologically
+        file_names = sorted([f for f in os.listdir(MANIFESTS_FOLDER_PATH) if f.startswith(f'{workflow}_') and f.endswith(".json") and f != current_file_name], reverse=True)
+        for file_name in file_names:
+            try:
+                manifest = cls.load(f'{MANIFESTS_FOLDER_PATH}/{file_name}')
+            except Exception as e:
+                log.exception(f'Could not load export manifest \'{file_name}\', skipping...\n{e}')
+                continue
+            if manifest.data['workflow'] != workflow or manifest.data['base_url'] != base_url:
+                continue
+            if manifest.data.get('content_store') != content_store_path:
+                continue
+            if status != None and manifest.data['status'] != status:
+                continue
+            return manifest
+        return None
+
+    def resume_from(self, previous: "ExportManifest") -> None:
+        """
+        Copies the finished clients and reports from the manifest of a previous run into this manifest, so they are
+        skipped by this run. Entries whose exported file no longer exists are not copied.
+
+        :param previous: manifest of the run to resume
+        :type previous: ExportManifest
+        """
+        with self._lock:
+            for object_type in ["clients", "reports"]:
+                for id, entry in previous.data[object_type].items():
+                    if os.path.exists(entry['file_path']):
+                        self.data[object_type][id] = entry
+            self.data['resumed_from'] = previous.file_path
+        log.info(f'Resuming export from \'{previous.file_path}\'. Found {len(self.data["clients"])} finished client(s) and {len(self.data["reports"])} finished report(s)')
+        self.save()
+
+    def is_completed(self, object_type: str, id) -> bool:
+        """
+        :param object_type: "clients" or "reports"
+        :type object_type: str
+        :param id: client_id or report id
+        :return: whether the client or report was already exported in this run, or the run it resumed
+        :rtype: bool
+        """
+        with self._lock:
+            return str(id) in self.data[object_type]
+
+    def get_entry(self, object_type: str, id) -> Union[dict, None]:
+        """
+        :param object_type: "clients" or "reports"
+        :type object_type: str
+        :param id: client_id or report id
+        :return: manifest entry of the client or report, or None if it was not exported
+        :rtype: Union[dict, None]
+        """
+        with self._lock:
+            return self.data[object_type].get(str(id))
+
+    def get_unchanged_entry(self, object_type: str, id, record_hash: str) -> Union[dict, None]:
+        """
+        Used by incremental exports to check whether a client or report changed since this manifest's run
+
+        :param object_type: "clients" or "reports"
+        :type object_type: str
+        :param id: client_id or report id
+        :param record_hash: current hash of the client or report, see `get_client_hash` and `get_report_hash` in data_utils,
+        compared to the `record_hash` recorded in the manifest. None if changes can't be detected
+        :type record_hash: str
+        :return: manifest entry if the client or report was exported with the same `record_hash` and the exported file still exists, otherwise None
+        :rtype: Union[dict, None]
+        """
+        entry = self.get_entry(object_type, id)
+        if entry == None or record_hash == None or entry.get('record_hash') != record_hash:
+            return None
+        if not os.path.exists(entry['file_path']):
+            return None
+        return entry
+
+    def add_completed(self, object_type: str, id, file_path: str, **details) -> None:
+        """
+        Records that a client or report finished exporting. The manifest is saved every
+        `settings.manifest_checkpoint_interval` calls.
+
+        :param object_type: "clients" or "reports"
+        :type object_type: str
+        :param id: client_id or report id
+        :param file_path: file path the client or report was exported to
+        :type file_path: str
+        :param details: any other values to store with the entry, like the size of the report in a client ZIP
+        """
+        entry = {"file_path": file_path, "size": os.path.getsize(file_path)}
+        entry.update(details)
+        with self._lock:
+            self.data[object_type][str(id)] = entry
+            self._unsaved_changes += 1
+            save_needed = self._unsaved_changes >= max(1, settings.manifest_checkpoint_interval)
+        if save_needed:
+            self.save()
+
+    def save(self) -> None:
+        """
+        Writes the manifest to disk. The JSON is written to a temp file, flushed to disk, then renamed over the
+        previous version in a single step.
+        """
+        utils.create_directory("exported_data")
+        utils.create_directory(MANIFESTS_FOLDER_PATH)
+        with self._lock:
+            self.data['updated_at'] = time.time()
+            temp_file_path = f'{self.file_path}.tmp'
+            with open(temp_file_path, 'w', encoding="utf8") as f:
+                json.dump(self.data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file_path, self.file_path)
+            self._unsaved_changes = 0
+        log.debug(f'Saved export manifest \'{self.file_path}\'')
+
+    def finish(self) -> None:
+        """
+        Marks the export run as complete and saves the manifest
+        """
+        with self._lock:
+            self.data['status'] = "complete"
+        self.save()
+        log.info(f'Saved export manifest to \'{self.file_path}\'')
+
+
+def start_export_manifest(workflow: str, base_url: str, resume: bool = False, content_store_path: str = None) -> ExportManifest:
+    """
+    Creates the manifest for a new export run. If `resume` is set and the most recent run of the workflow against the
+    same instance did not finish, the new manifest starts with everything that run already exported.
+
+    :param workflow: name of the export workflow
+    :type workflow: str
+    :param base_url: URL to PT instance the data is exported from
+    :type base_url: str
+    :param resume: whether to resume the last unfinished run, defaults to False
+    :type resume: bool, optional
+    :param content_store_path: folder path of the content store the run saves data to, if used, defaults to None
+    :type content_store_path: str, optional
+    :return: manifest for the new run
+    :rtype: ExportManifest
+    """
+    manifest = ExportManifest(workflow, base_url, content_store_path=content_store_path)
+    if resume:
+        previous = ExportManifest.find_previous(workflow, base_url, content_store_path=content_store_path)
+        if previous == None or previous.data['status'] != "in_progress":
+            log.info(f'Did not find an unfinished \'{workflow}\' run to resume. Starting a new export')
+        else:
+            manifest.resume_from(previous)
+    return manifest
+
+
+def find_incremental_base(workflow: str, base_url: str, incremental: bool = False, content_store_path: str = None) -> Union[ExportManifest, None]:
+    """
+    Finds the manifest of the last complete run of a workflow to compare against for an incremental export
+
+    :param workflow: name of the export workflow
+    :type workflow: str
+    :param base_url: URL to PT instance the data is exported from
+    :type base_url: str
+    :param incremental: whether the export is incremental, defaults to False
+    :type incremental: bool, optional
+    :param content_store_path: folder path of the content store the run saves data to, if used, defaults to None
+    :type content_store_path: str, optional
+    :return: manifest of the last complete run, or None if the export is not incremental or no complete run was found
+    :rtype: Union[ExportManifest, None]
+    """
+    if not incremental:
+        return None
+    previous = ExportManifest.find_previous(workflow, base_url, status="complete", content_store_path=content_store_path)
+    if previous == None:
+        log.info(f'Did not find a complete \'{workflow}\' run to compare against. Exporting everything')
+    else:
+        log.info(f'Incremental export - only exporting new or changed data since \'{previous.file_path}\'')
+    return previous
+
+
+def link_unchanged_file(previous_file_path: str, file_path: str) -> str:
+    """
+    Adds a file from a previous export to the current export without copying the data. A hard link is created at
+    `file_path`. If the file system does not support hard links, the file from the previous export is referenced instead.
+
+    :param previous_file_path: file path of the unchanged file from the previous export
+    :type previous_file_path: str
+    :param file_path: file path the file would have been exported to in the current export
+    :type file_path: str
+    :return: file path to record in the manifest, `file_path` if linked, otherwise `previous_file_path`
+    :rtype: str
+    """
+    try:
+        os.link(previous_file_path, file_path)
+        return file_path
+    except OSError as e:
+        log.debug(f'Could not hard link \'{previous_file_path}\' to \'{file_path}\', referencing previous export instead. {e}')
+        return previous_file_path
@@ -0,0 +1,181 @@
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, List
+
+import utils.log_handler as logger
+log = logger.log
+
+
+METRICS_FOLDER_PATH = "exported_data/metrics"
+
+
+class EndpointMetrics():
+    """
+    A class to hold the measurements of every request sent to a single API endpoint
+    """
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0 # requests that failed to get a response
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.status_codes: Dict[str, int] = {}
+        self.retries = 0
+        self.retry_time = 0.0
+        self.latencies: List[float] = []
+
+    def get_percentile(self, percentile: float) -> float:
+        """
+        :param percentile: percentile between 0 and 100
+        :type percentile: float
+        :return: latency in seconds that the given percent of requests finished within, using the nearest-rank method
+        :rtype: float
+        """
+        if len(self.latencies) < 1:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[max(0, math.ceil(percentile/100 * len(latencies)) - 1)]
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "status_codes": self.status_codes,
+            "retries": self.retries,
+            "retry_time": round(self.retry_time, 3),
+            "total_time": round(sum(self.latencies), 3),
+            "p50": round(self.get_percentile(50), 3),
+            "p95": round(self.get_percentile(95), 3),
+            "p99": round(self.get_percentile(99), 3)
+        }
+
+
+class RequestMetrics():
+    """
+    A class to record request level metrics for each API endpoint, keyed by the `name` each `api.*` function passes to
+    `request_handler`. Records are added by all workers, so every update is lock protected.
+    """
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointMetrics] = {}
+        self._lock = threading.Lock()
+
+    def _get_endpoint(self, name: str) -> EndpointMetrics:
+        endpoint = self.endpoints.get(name)
+        if endpoint == None:
+            endpoint = EndpointMetrics()
+            self.endpoints[name] = endpoint
+        return endpoint
+
+    def add_request(self, name: str, latency: float, status_code: int = None, bytes_out: int = 0, bytes_in: int = 0) -> None:
+        """
+        Records a single request attempt. A retried request is recorded once per attempt.
+
+        :param name: name of API endpoint
+        :type name: str
+        :param latency: seconds from sending the request to receiving the whole response
+        :type latency: float
+        :param status_code: status code of the response, or None if the request failed to get a response
+        :type status_code: int, optional
+        :param bytes_out: size of the request body, defaults to 0
+        :type bytes_out: int, optional
+        :param bytes_in: size of the response body, defaults to 0
+        :type bytes_in: int, optional
+        """
+        with self._lock:
+            endpoint = self._get_endpoint(name)
+            endpoint.requests += 1
+            endpoint.latencies.append(latency)
+            endpoint.bytes_out += bytes_out
+            endpoint.bytes_in += bytes_in
+            if status_code == None:
+                endpoint.errors += 1
+                return
+            endpoint.status_codes[str(status_code)] = endpoint.status_codes.get(str(status_code), 0) + 1
+
+    def add_retry(self, name: str, delay: float) -> None:
+        """
+        Records a retry and the time waited before it was sent
+
+        :param name: name of API endpoint
+        :type name: str
+        :param delay: seconds waited before retrying
+        :type delay: float
+        """
+        with self._lock:
+            endpoint = self._get_endpoint(name)
+            endpoint.retries += 1
+            endpoint.retry_time += delay
+
+    def to_dict(self) -> Dict[str, dict]:
+        """
+        :return: dictionary of {endpoint name: metrics of the endpoint}, sorted by the total time spent on each endpoint
+        :rtype: Dict[str, dict]
+        """
+        with self._lock:
+            endpoints = {name: endpoint.to_dict() for name, endpoint in self.endpoints.items()}
+        return dict(sorted(endpoints.items(), key=lambda item: item[1]['total_time'], reverse=True))
+
+    def get_summary_table(self) -> str:
+        """
+        :return: table with a row of metrics for each endpoint a request was sent to, for printing
+        :rtype: str
+        """
+        headers = ["Endpoint", "Requests", "Errors", "Retries", "Retry (s)", "Sent (MB)", "Recv (MB)", "Total (s)", "p50 (s)", "p95 (s)", "p99 (s)", "Status Codes"]
+        rows = []
+        for name, metrics in self.to_dict().items():
+            rows.append([
+                name,
+                str(metrics['requests']),
+                str(metrics['errors']),
+                str(metrics['retries']),
+                str(round(metrics['retry_time'], 1)),
+                str(round(metrics['bytes_out']/1024/1024, 2)),
+                str(round(metrics['bytes_in']/1024/1024, 2)),
+                str(round(metrics['total_time'], 1)),
+                str(round(metrics['p50'], 2)),
+                str(round(metrics['p95'], 2)),
+                str(round(metrics['p99'], 2)),
+                " ".join(f'{code}:{count}' for code, count in sorted(metrics['status_codes'].items()))
+            ])
+        widths = [max(len(row[i]) for row in [headers] + rows) for i in range(len(headers))]
+        lines = [" | ".join(value.ljust(widths[i]) for i, value in enumerate(row)).rstrip() for row in [headers] + rows]
+        lines.insert(1, "-+-".join("-"*width for width in widths))
+        return "\n".join(lines)
+
+    def log_summary(self) -> None:
+        """
+        Logs the summary table of all requests sent so far
+        """
+        if len(self.endpoints) < 1:
+            return
+        log.info(f'Request metrics by endpoint:\n{self.get_summary_table()}')
+
+    def save(self, file_path: str = None) -> str:
+        """
+        Saves the metrics of each endpoint to a JSON file
+
+        :param file_path: file path to save the metrics to, defaults to `exported_data/metrics/request_metrics_<current time>.json`,
+        so each workflow run in the same session is saved to its own file
+        :type file_path: str, optional
+        :return: file path the metrics were saved to
+        :rtype: str
+        """
+        if file_path == None:
+            file_path = f'{METRICS_FOLDER_PATH}/request_metrics_{time.strftime("%Y_%m_%d_%H_%M_%S", time.localtime())}.json'
+        if os.path.dirname(file_path) != "":
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w', encoding="utf8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        log.info(f'Saved request metrics to \'{file_path}\'')
+        return file_path
+
+    def reset(self) -> None:
+        """
+        Clears the metrics of every endpoint, to start measuring the next workflow run
+        """
+        with self._lock:
+            self.endpoints = {}
@@ -1,12 +1,21 @@
 import requests
+import requests.adapters
 import requests.packages
-from typing import Dict
+from typing import BinaryIO, Callable, Dict, Union
 from json import JSONDecodeError
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import atexit
+from http.cookiejar import DefaultCookiePolicy
+import random
 import time
+import threading
 
 import settings
 import utils.log_handler as logger
 log = logger.log
+from utils.metrics_handler import RequestMetrics
+from utils.cassette_handler import PTCassette
 
 from api.exceptions import *
 
@@ -24,8 +33,420 @@ if not settings.verify_ssl:
     # noinspection PyUnresolvedReferences
     requests.packages.urllib3.disable_warnings()
 
-def _do(http_method: str, base_url: str, headers: dict, endpoint: str, name: str, data: Dict = None, files = None) -> PTWrapperLibraryResponse:
+
+class PTSessionPool():
+    """
+    A class to manage pooled, keep-alive HTTP sessions. One `requests.Session` is kept per Plextrac instance, keyed
+    by `Auth.base_url`, so every request sent to the same instance can reuse an open TCP+TLS connection instead of
+    doing a new handshake.
+
+    A session can be shared by several users or tenants on the same instance, like the source and target of a
+    migration, so sessions don't keep cookies. Requests are authenticated by their own headers only.
+    """
+    def __init__(self, pool_size: int):
+        """
+        :param pool_size: max number of connections kept alive to each Plextrac instance
+        :type pool_size: int
+        """
+        self.pool_size = max(1, int(pool_size))
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, base_url: str) -> requests.Session:
+        """
+        Returns the session for a Plextrac instance, creating it on first use
+
+        :param base_url: URL to PT instance including protocol (ex. https://example.plextrac.com)
+        :type base_url: str
+        :return: pooled session shared by all requests to the instance
+        :rtype: requests.Session
+        """
+        with self._lock:
+            session = self._sessions.get(base_url)
+            if session == None:
+                log.debug(f'Creating pooled session for \'{base_url}\' with {self.pool_size} connection(s)')
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=False)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.verify = settings.verify_ssl
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                self._sessions[base_url] = session
+            return session
+
+    def get_stats(self) -> Dict[str, dict]:
+        """
+        Returns pool hit and miss counters for each Plextrac instance. A hit is a request sent over a connection
+        that was already open. A miss is a request that had to open a new connection.
+
+        :return: dictionary of {base_url: {"requests": int, "hits": int, "misses": int}}
+        :rtype: Dict[str, dict]
+        """
+        stats = {}
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for base_url, session in sessions:
+            num_requests = 0
+            num_connections = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool == None:
+                        continue
+                    num_requests += pool.num_requests
+                    num_connections += pool.num_connections
+            stats[base_url] = {
+                "requests": num_requests,
+                "hits": max(0, num_requests - num_connections),
+                "misses": num_connections
+            }
+        return stats
+
+    def log_stats(self) -> None:
+        """
+        Logs the pool hit and miss counters for each Plextrac instance a request was sent to
+        """
+        for base_url, stats in self.get_stats().items():
+            log.info(f'Connection pool for \'{base_url}\' - Requests: {stats["requests"]} | Reused connections (hits): {stats["hits"]} | New connections (misses): {stats["misses"]}')
+
+    def close(self) -> None:
+        """
+        Closes all sessions and their open connections
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+session_pool = PTSessionPool(settings.connection_pool_size)
+
+
+class PTRateLimiter():
+    """
+    A class to limit the load put on a Plextrac instance by all workers sending requests. Every request waits for a
+    token from a token bucket refilled at `requests_per_second`, and for a free slot out of `max_concurrency`.
+
+    In adaptive mode the limits are lowered when the instance is struggling, and raised back while it is healthy:
+    - a 429 or 5xx response, a failed connection, or a response much slower than usual halves the current limits
+    - every `current concurrency` healthy responses raise the concurrency limit by 1 and the rate by 10%, up to the configured limits
+    """
+    SLOW_RESPONSE_FACTOR = 3 # a response this many times slower than the usual latency counts as the instance struggling
+    BACKOFF_COOLDOWN = 1.0 # seconds, limits are only lowered once per this interval, so a burst of errors counts once
+    POLL_INTERVAL = 0.01 # seconds between checks for a free slot by requests sent from an event loop, see `try_acquire`
+
+    def __init__(self, requests_per_second: float = 0, max_concurrency: int = 0, adaptive: bool = False):
+        """
+        :param requests_per_second: max requests sent per second, 0 for no limit
+        :type requests_per_second: float
+        :param max_concurrency: max requests waiting on a response at the same time, 0 for no limit
+        :type max_concurrency: int
+        :param adaptive: whether to lower and raise the limits based on how the instance responds, defaults to False
+        :type adaptive: bool, optional
+        """
+        self.max_rate = max(0.0, float(requests_per_second))
+        self.max_concurrency = max(0, int(max_concurrency))
+        self.adaptive = adaptive
+        self.rate = self.max_rate
+        self.concurrency = self.max_concurrency
+        self.throttled_requests = 0
+        self.total_wait_time = 0.0
+        self.backoffs = 0
+        self._tokens = max(1.0, self.max_rate)
+        self._last_refill = time.monotonic()
+        self._in_flight = 0
+        self._healthy_responses = 0
+        self._usual_latency = None
+        self._last_backoff = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        """
+        Blocks until a request can be sent. Must be followed by `release` once the request finishes.
+        """
+        start = time.monotonic()
+        with self._cond:
+            while self.concurrency > 0 and self._in_flight >= self.concurrency:
+                self._cond.wait()
+            self._in_flight += 1
+
+        while self.rate > 0:
+            with self._cond:
+                now = time.monotonic()
+                self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+        self.add_wait_time(time.monotonic() - start)
+
+    def try_acquire(self) -> float:
+        """
+        Non blocking version of `acquire`, for requests sent from an event loop. Takes a slot and a token only when both
+        are free. Must be followed by `release` once the request finishes, if the request could be sent.
+
+        :return: 0 if the request can be sent, otherwise seconds to wait before trying again
+        :rtype: float
+        """
+        with self._cond:
+            if self.concurrency > 0 and self._in_flight >= self.concurrency:
+                return self.POLL_INTERVAL
+            if self.rate > 0:
+                now = time.monotonic()
+                self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens < 1:
+                    return (1 - self._tokens) / self.rate
+                self._tokens -= 1
+            self._in_flight += 1
+            return 0
+
+    def add_wait_time(self, waited: float) -> None:
+        """
+        Counts a request held back by the limits, if it waited at all
+
+        :param waited: seconds the request waited for a slot and a token
+        :type waited: float
+        """
+        if waited > 0.001:
+            with self._cond:
+                self.throttled_requests += 1
+                self.total_wait_time += waited
+
+    def release(self, latency: float, status_code: int = None) -> None:
+        """
+        Frees the slot taken by `acquire` and, in adaptive mode, adjusts the limits based on the response
+
+        :param latency: seconds until the response headers were received, or until the request failed
+        :type latency: float
+        :param status_code: status code of the response, or None if the request failed to connect
+        :type status_code: int, optional
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if self.adaptive:
+                struggling = status_code == None or status_code == 429 or status_code >= 500
+                if self._usual_latency != None and latency > self._usual_latency * self.SLOW_RESPONSE_FACTOR:
+                    struggling = True
+                if struggling:
+                    self._back_off()
+                else:
+                    self._usual_latency = latency if self._usual_latency == None else self._usual_latency * 0.9 + latency * 0.1
+                    self._ramp_up()
+            self._cond.notify_all()
+
+    def _back_off(self) -> None:
+        now = time.monotonic()
+        if now - self._last_backoff < self.BACKOFF_COOLDOWN:
+            return
+        self._last_backoff = now
+        self._healthy_responses = 0
+        self.backoffs += 1
+        if self.max_concurrency > 0:
+            self.concurrency = max(1, self.concurrency // 2)
+        if self.max_rate > 0:
+            self.rate = max(min(1.0, self.max_rate), self.rate / 2)
+        log.debug(f'Instance is struggling, lowered request limits to {self.rate} request(s)/sec and {self.concurrency} concurrent request(s)')
+
+    def _ramp_up(self) -> None:
+        self._healthy_responses += 1
+        if self._healthy_responses < max(1, self.concurrency):
+            return
+        self._healthy_responses = 0
+        if self.max_concurrency > 0:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+        if self.max_rate > 0:
+            self.rate = min(self.max_rate, self.rate * 1.1)
+
+    def log_stats(self, base_url: str = None) -> None:
+        """
+        Logs how many requests were held back by the limits, if any
+
+        :param base_url: Plextrac instance the limiter is for, to mention in the log, defaults to None
+        :type base_url: str, optional
+        """
+        if self.throttled_requests < 1 and self.backoffs < 1:
+            return
+        limiter_name = f'Rate limiter for \'{base_url}\'' if base_url != None else 'Rate limiter'
+        log.info(f'{limiter_name} - Throttled requests: {self.throttled_requests} | Total time waited: {round(self.total_wait_time, 1)}s | Limits lowered: {self.backoffs} time(s)')
+
+
+class PTRateLimiterPool():
+    """
+    A class to keep one `PTRateLimiter` per Plextrac instance, keyed by `Auth.base_url` like `PTSessionPool`. The
+    limits apply to each instance on its own, so during a migration the source and target instances each get the
+    configured limits, and an instance that is struggling doesn't slow down requests sent to the other.
+    """
+    def __init__(self, requests_per_second: float = 0, max_concurrency: int = 0, adaptive: bool = False):
+        """
+        Limits given to the `PTRateLimiter` of each instance, see `PTRateLimiter`
+        """
+        self.requests_per_second = requests_per_second
+        self.max_concurrency = max_concurrency
+        self.adaptive = adaptive
+        self._limiters: Dict[str, PTRateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get_limiter(self, base_url: str) -> PTRateLimiter:
+        """
+        Returns the rate limiter for a Plextrac instance, creating it on first use
+
+        :param base_url: URL to PT instance including protocol (ex. https://example.plextrac.com)
+        :type base_url: str
+        :return: rate limiter shared by all requests sent to this instance
+        :rtype: PTRateLimiter
+        """
+        with self._lock:
+            limiter = self._limiters.get(base_url)
+            if limiter == None:
+                limiter = PTRateLimiter(self.requests_per_second, self.max_concurrency, adaptive=self.adaptive)
+                self._limiters[base_url] = limiter
+            return limiter
+
+    def log_stats(self) -> None:
+        """
+        Logs the stats of the rate limiter of each Plextrac instance a request was sent to
+        """
+        with self._lock:
+            limiters = list(self._limiters.items())
+        for base_url, limiter in limiters:
+            limiter.log_stats(base_url)
+
+
+rate_limiters = PTRateLimiterPool(settings.requests_per_second, settings.max_concurrent_requests, adaptive=settings.adaptive_rate_limit)
+request_metrics = RequestMetrics()
+cassette: PTCassette = None # set by `start_cassette` when recording or replaying responses
+
+
+class PTAuthHeaders(dict):
     """
+    Request headers of an authenticated user, updated in place when the auth token is renewed. The headers carry the
+    function to renew their token, so a request rejected with a 401 renews the token of the user that sent it, even
+    when several users or tenants are authenticated to the same instance.
+    """
+    def __init__(self, refresh: Callable[[str], bool] = None):
+        """
+        :param refresh: function called with the token a request was rejected with, returns whether there is a new token to retry with, defaults to None
+        :type refresh: Callable[[str], bool], optional
+        """
+        super().__init__()
+        self.refresh = refresh
+
+
+def start_cassette(mode: str, file_path: str, replay_speed: float = 0) -> PTCassette:
+    """
+    Starts recording the response of every request to a cassette file, or replaying responses from one instead of
+    sending requests. See `PTCassette`.
+
+    :param mode: "record" or "replay"
+    :type mode: str
+    :param file_path: file path of the cassette
+    :type file_path: str
+    :param replay_speed: when replaying, speed to replay the recorded response times at, 0 for no delay, defaults to 0
+    :type replay_speed: float, optional
+    :return: the started cassette
+    :rtype: PTCassette
+    """
+    global cassette
+    cassette = PTCassette(mode, file_path, replay_speed=replay_speed)
+    if mode == "record":
+        atexit.register(cassette.close)
+    return cassette
+
+
+def log_stats() -> None:
+    """
+    Logs the connection pool and rate limiter stats for all requests sent so far, and the metrics of each endpoint for
+    the requests sent since the last time the stats were logged. Called at the end of each workflow run, so the metrics
+    are reset after they are logged and saved, and the next run in the same session only shows its own requests.
+    """
+    session_pool.log_stats()
+    rate_limiters.log_stats()
+    request_metrics.log_summary()
+    if settings.save_request_metrics:
+        request_metrics.save()
+    request_metrics.reset()
+
+
+IDEMPOTENT_METHODS = ["GET", "PUT", "DELETE"]
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024 # bytes of a streamed response read at a time
+
+
+def _get_retry_after(status_code: int, headers) -> Union[float, None]:
+    """
+    Parses the Retry-After header of a 429 or 503 response, sent as either a number of seconds or an HTTP date
+
+    :param status_code: status code of the response
+    :type status_code: int
+    :param headers: headers of the response
+    :type headers: Mapping[str, str]
+    :return: seconds to wait before retrying, or None if the response doesn't have a valid Retry-After header
+    :rtype: Union[float, None]
+    """
+    if status_code not in [429, 503]:
+        return None
+    retry_after = headers.get("Retry-After")
+    if retry_after == None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_retry_delay(retries: int, status_code: int = None, headers = None) -> float:
+    """
+    Returns the time to wait before the next retry. Uses the Retry-After header sent by the instance if there is one,
+    otherwise exponential backoff with full jitter, a random time between 0 and `retry_backoff_base * 2^(retries-1)`.
+    Both are capped at `settings.retry_backoff_max`.
+
+    :param retries: number of the retry about to be sent, starting at 1
+    :type retries: int
+    :param status_code: status code of the failed attempt, if a response was received, defaults to None
+    :type status_code: int, optional
+    :param headers: headers of the response of the failed attempt, defaults to None
+    :type headers: Mapping[str, str], optional
+    :return: seconds to wait
+    :rtype: float
+    """
+    retry_after = _get_retry_after(status_code, headers) if headers != None else None
+    if retry_after != None:
+        return min(retry_after, settings.retry_backoff_max)
+    return random.uniform(0, min(settings.retry_backoff_max, settings.retry_backoff_base * 2 ** (retries-1)))
+
+
+def _rewind_files(files) -> None:
+    """
+    Moves file objects in multipart form data back to the start, so a retried request sends the whole file again
+    """
+    if files == None:
+        return
+    for value in files.values():
+        file = value[1] if isinstance(value, tuple) and len(value) > 1 else value
+        if hasattr(file, "seek"):
+            file.seek(0)
+
+
+def _do(http_method: str, base_url: str, headers: dict, endpoint: str, name: str, data: Dict = None, files = None, retry_safe: bool = None, stream_to: BinaryIO = None) -> PTWrapperLibraryResponse:
+    """
+    Sends a request, retrying up to `settings.retries` times with exponential backoff. Each kind of failure is retried
+    based on its own setting:
+    - connection errors and timeouts - `settings.retry_connection_errors`
+    - responses that aren't valid JSON - `settings.retry_bad_json`
+    - responses with a status code in `settings.retry_status_codes`, 5xx and 429 by default. other 4xx are never retried
+    - a 401 response is sent again once after the auth token is renewed, see `PTAuthHeaders`
+    
+    Requests that aren't idempotent are only retried if they are marked as safe to retry, since a request that failed
+    on the client side may have still been processed by the instance.
+
     :param http_method: HTTP method, GET, POST, PUT, DELETE
     :type http_method: str
     :param base_url: URL to PT instance including protocol (ex. https://example.plextrac.com)
@@ -40,6 +461,11 @@ def _do(http_method: str, base_url: str, headers: dict, endpoint: str, name: str
     :type data: Dict, optional
     :param files: file data send in a multipart form request, defaults to None
     :type files: _type_, optional
+    :param retry_safe: whether the request can be retried, defaults to True for GET, PUT, and DELETE requests and False for POST requests
+    :type retry_safe: bool, optional
+    :param stream_to: seekable file opened in binary mode to write the body of a successful response to, a chunk at a
+    time, instead of loading and decoding it as JSON. the file is emptied before each attempt, defaults to None
+    :type stream_to: BinaryIO, optional
     :raises PTWrapperLibraryException: general request failure
     :raises PTWrapperLibraryJSONResponse: request doesn't return JSON data
     :raises PTWrapperLibraryFailed: non 200 response
@@ -49,48 +475,111 @@ def _do(http_method: str, base_url: str, headers: dict, endpoint: str, name: str
     full_url = base_url + endpoint
     log_line_pre = f"method={http_method}, url={full_url}"
     log_line_post = ', '.join((log_line_pre, "success={}, status_code={}, message={}"))
-    
+    if retry_safe == None:
+        retry_safe = http_method in IDEMPOTENT_METHODS
+    max_retries = settings.retries if retry_safe else 0
+
+    rate_limiter = rate_limiters.get_limiter(base_url)
     retries = 0
-    while retries <= settings.retries:
+    auth_refreshed = False
+    while True:
         # Log HTTP params and perform an HTTP request, catching and re-raising any exceptions
         try:
             log.debug(log_line_pre)
-            response = requests.request(method=http_method, url=full_url, verify=settings.verify_ssl, headers=headers, json=data, files=files)
+            rate_limiter.acquire()
+            request_start = time.monotonic()
+            status_code = None
+            headers_latency = None
+            bytes_out = 0
+            bytes_in = 0
+            # the auth headers can be renewed in place by another worker, send a copy so the token sent is known
+            sent_headers = dict(headers) if headers != None else None
+            sent_token = sent_headers.get("Authorization") if sent_headers != None else None
+            try:
+                # the cassette keeps whole responses, so responses are only streamed when it isn't used
+                stream = stream_to != None and cassette == None
+                if cassette != None and cassette.mode == "replay":
+                    response = cassette.replay(http_method, base_url, endpoint, data)
+                    headers_latency = time.monotonic() - request_start
+                else:
+                    response = session_pool.get_session(base_url).request(method=http_method, url=full_url, verify=settings.verify_ssl, headers=sent_headers, json=data, files=files, stream=stream)
+                    headers_latency = response.elapsed.total_seconds()
+                    if cassette != None:
+                        cassette.record(http_method, endpoint, data, response, time.monotonic() - request_start)
+                status_code = response.status_code
+                bytes_out = len(response.request.body) if response.request != None and isinstance(response.request.body, (bytes, str)) else 0
+                if stream_to != None and 299 >= status_code >= 200:
+                    stream_to.seek(0)
+                    stream_to.truncate()
+                    for chunk in (response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE) if stream else [response.content]):
+                        stream_to.write(chunk)
+                        bytes_in += len(chunk)
+                    stream_to.flush()
+                else:
+                    bytes_in = len(response.content)
+            finally:
+                latency = time.monotonic() - request_start
+                # the limiter compares response times across all requests to the instance, so it gets the time until the
+                # response headers arrived, without the time to download a large body like a PTRAC
+                rate_limiter.release(headers_latency if headers_latency != None else latency, status_code)
+                request_metrics.add_request(name, latency, status_code, bytes_out=bytes_out, bytes_in=bytes_in)
         except requests.exceptions.RequestException as e:
-            if retries < settings.retries:
+            if settings.retry_connection_errors and retries < max_retries:
                 retries += 1
-                log.exception(f'Request failed - {name}. Retrying... ({retries}/{settings.retries})\nException: {str(e)}')
-                time.sleep(5)
-                continue # if this part doesn't succeed you can't continue. prevents incrementing `retries` more than once in a single attempt
+                delay = _get_retry_delay(retries)
+                log.exception(f'Request failed - {name}. Retrying in {round(delay, 1)}s... ({retries}/{max_retries})\nException: {str(e)}')
+                request_metrics.add_retry(name, delay)
+                time.sleep(delay)
+                _rewind_files(files)
+                continue
             else:
                 raise PTWrapperLibraryException(f'Request failed - {name}') from e
+        # Retry failed status codes before checking the response body, error pages are often not JSON
+        is_success = 299 >= response.status_code >= 200
+        log_line = log_line_post.format(is_success, response.status_code, response.reason)
+        # Renew an expired auth token and send the request again, once. the auth headers are updated in place when renewed
+        refresh = getattr(headers, "refresh", None)
+        if response.status_code == 401 and not auth_refreshed and sent_token != None and refresh != None:
+            auth_refreshed = True
+            log.debug(f'{log_line}. Renewing auth token and retrying...')
+            if refresh(sent_token):
+                _rewind_files(files)
+                continue
+        if not is_success and response.status_code in settings.retry_status_codes and retries < max_retries:
+            retries += 1
+            delay = _get_retry_delay(retries, response.status_code, response.headers)
+            log.exception(f'{log_line}. Retrying in {round(delay, 1)}s... ({retries}/{max_retries})')
+            request_metrics.add_retry(name, delay)
+            time.sleep(delay)
+            _rewind_files(files)
+            continue
+        # A streamed response body was already written to the file
+        if stream_to != None and is_success:
+            log.debug(log_line)
+            return PTWrapperLibraryResponse(response, response.status_code, message=response.reason)
         # Deserialize JSON output to Python object, or return failed PTWrapperLibraryResponse on exception
         try:
             data_out = response.json()
         except (ValueError, JSONDecodeError) as e:
-            if retries < settings.retries:
+            if is_success and settings.retry_bad_json and retries < max_retries:
                 retries += 1
-                log.exception(log_line_post.format(False, None, e))
-                time.sleep(5)
-                continue # if this part doesn't succeed you can't continue. prevents incrementing `retries` more than once in a single attempt
-            else:
+                delay = _get_retry_delay(retries)
+                log.exception(f'{log_line_post.format(False, response.status_code, e)}. Retrying in {round(delay, 1)}s... ({retries}/{max_retries})')
+                request_metrics.add_retry(name, delay)
+                time.sleep(delay)
+                _rewind_files(files)
+                continue
+            elif is_success:
                 raise PTWrapperLibraryJSONResponse(f'Bad JSON response - {name}') from e
+            data_out = {}
         # If status_code in 200-299 range, return success PTWrapperLibraryResponse with data, otherwise raise exception
-        is_success = 299 >= response.status_code >= 200
-        log_line = log_line_post.format(is_success, response.status_code, response.reason)
         if is_success:
             log.debug(log_line)
             return PTWrapperLibraryResponse(response, response.status_code, message=response.reason, json=data_out)
-        if retries < settings.retries:
-            retries += 1
-            log.exception(log_line)
-            time.sleep(5)
-            continue # if this part doesn't succeed you can't continue. prevents incrementing `retries` more than once in a single attempt
-        else:
-            log.exception(f'{log_line}, pt_message={data_out.get("message")}')
-            raise PTWrapperLibraryFailed(f'{name} - {response.status_code}: {response.reason}')
+        log.exception(f'{log_line}, pt_message={data_out.get("message") if isinstance(data_out, dict) else None}')
+        raise PTWrapperLibraryFailed(f'{name} - {response.status_code}: {response.reason}')
     
-def get(base_url: str, headers: dict, endpoint: str, name: str) -> PTWrapperLibraryResponse:
+def get(base_url: str, headers: dict, endpoint: str, name: str, stream_to: BinaryIO = None) -> PTWrapperLibraryResponse:
     """
     GET request wrapper
 
@@ -102,10 +591,12 @@ def get(base_url: str, headers: dict, endpoint: str, name: str) -> PTWrapperLibr
     :type endpoint: str
     :param name: name of API endpoint, mentioned during exceptions
     :type name: str
+    :param stream_to: file to stream the response body to instead of decoding it as JSON, for large downloads, defaults to None
+    :type stream_to: BinaryIO, optional
     :return: custom wrapper for Python requests.Response object
     :rtype: PTWrapperLibraryResponse
     """    
-    return _do(http_method='GET', base_url=base_url, headers=headers, endpoint=endpoint, name=name)
+    return _do(http_method='GET', base_url=base_url, headers=headers, endpoint=endpoint, name=name, stream_to=stream_to)
 
 # sending image file in POST Upload Image to Tenant requires the following files data
 # {
@@ -113,7 +604,7 @@ def get(base_url: str, headers: dict, endpoint: str, name: str) -> PTWrapperLibr
 #     'file': file
 # }
 # where file is img in `with open(f'{image_path}{image_file_name}.{ext}', "rb") as img:`
-def post(base_url: str, headers: dict, endpoint: str, name: str, data: Dict = None, files = None) -> PTWrapperLibraryResponse:
+def post(base_url: str, headers: dict, endpoint: str, name: str, data: Dict = None, files = None, retry_safe: bool = False) -> PTWrapperLibraryResponse:
     """
     POST request wrapper
 
@@ -129,10 +620,12 @@ def post(base_url: str, headers: dict, endpoint: str, name: str, data: Dict = No
     :type data: Dict, optional
     :param files: file data send in a multipart form request, defaults to None
     :type files: _type_, optional
+    :param retry_safe: whether the request can be retried. only set for POST requests that don't create or change data, like list requests, defaults to False
+    :type retry_safe: bool, optional
     :return: custom wrapper for Python requests.Response object
     :rtype: PTWrapperLibraryResponse
     """  
-    return _do(http_method='POST', base_url=base_url, headers=headers, endpoint=endpoint, name=name, data=data, files=files)
+    return _do(http_method='POST', base_url=base_url, headers=headers, endpoint=endpoint, name=name, data=data, files=files, retry_safe=retry_safe)
     
 def put(base_url: str, headers: dict, endpoint: str, name: str, data: Dict = None) -> PTWrapperLibraryResponse:
     """
@@ -0,0 +1,260 @@
+import html
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, Tuple
+
+import utils.log_handler as logger
+log = logger.log
+import utils.json_stream_utils as json_stream
+import utils.concurrency_utils as concurrency
+from utils.catalog_handler import CATALOG_FILE_PATH, ExportCatalog
+from utils.content_store_handler import ContentStore
+
+
+SEARCH_INDEX_WORKERS = 4 # PTRACs read at the same time when indexing
+SEARCH_INDEX_BATCH_SIZE = 50 # PTRACs written to the index in a single transaction
+SEARCH_RESULTS_LIMIT = 20
+# markers around the matched words in snippets of search results. control characters, so they can't be confused with the text
+SNIPPET_MATCH_START = "\x02"
+SNIPPET_MATCH_END = "\x03"
+
+# the index is kept in the export catalog database, so results can be joined to where each report was exported
+SEARCH_INDEX_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS search_documents USING fts5(
+    sha256 UNINDEXED,
+    section UNINDEXED,
+    title,
+    content
+);
+CREATE TABLE IF NOT EXISTS search_indexed (
+    sha256 TEXT PRIMARY KEY,
+    documents INTEGER,
+    indexed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS reports_by_sha256 ON reports (sha256);
+"""
+
+_HTML_TAG = re.compile(r'<[^>]+>')
+_WHITESPACE = re.compile(r'\s+')
+_BLOB = re.compile(r'\S{256,}') # base64 images and other long strings without spaces that are never searched for
+# keys of finding values that are not text anyone would search for
+SEARCH_SKIPPED_KEYS = ["flaw_id", "id", "cuid", "client_id", "report_id", "createdAt", "updatedAt", "last_update", "exhibits"]
+
+
+def get_text(value) -> str:
+    """
+    :param value: string, or dictionary or list of strings, from a PTRAC. other values are ignored
+    :return: text of every string in the value, with HTML tags, HTML entities and long blobs such as base64 images removed
+    :rtype: str
+    """
+    strings = []
+    def add_strings(value):
+        if isinstance(value, str):
+            strings.append(value)
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                if key not in SEARCH_SKIPPED_KEYS:
+                    add_strings(item)
+        elif isinstance(value, list):
+            for item in value:
+                add_strings(item)
+    add_strings(value)
+    text = html.unescape(_HTML_TAG.sub(" ", " ".join(strings)))
+    return _WHITESPACE.sub(" ", _BLOB.sub(" ", text)).strip()
+
+
+def get_ptrac_documents(source) -> List[Tuple[str, str, str]]:
+    """
+    Reads the searchable text of a PTRAC: each finding in `flaws_array`, the `summary`, and each narrative in
+    `report_info.exec_summary.custom_fields`. The PTRAC is read as a stream, so findings are decoded one at a time and
+    the evidence is skipped without being decoded.
+
+    :param source: raw PTRAC JSON, file path of a PTRAC file, or a file object opened in binary mode such as a ZIP entry
+    :type source: Union[bytes, str, BinaryIO]
+    :raises ValueError: the PTRAC is not valid JSON
+    :return: list of (section, title, content) for each document, with section one of "finding", "summary" or "narrative"
+    :rtype: List[Tuple[str, str, str]]
+    """
+    documents = []
+    with json_stream.open_json_stream(source) as reader:
+        for key in reader.iter_object():
+            if key == "flaws_array" and reader.peek_type() == "array":
+                for finding in reader.iter_array():
+                    if isinstance(finding, dict):
+                        documents.append(("finding", get_text(finding.get('title')), get_text({finding_key: value for finding_key, value in finding.items() if finding_key != "title"})))
+            elif key == "summary":
+                content = get_text(reader.read_value())
+                if content != "":
+                    documents.append(("summary", "Summary", content))
+            elif key == "report_info" and reader.peek_type() == "object":
+                report_info = reader.read_value()
+                custom_fields = (report_info.get('exec_summary') or {}).get('custom_fields') or []
+                for field in custom_fields:
+                    if isinstance(field, dict):
+                        documents.append(("narrative", get_text(field.get('label')), get_text(field.get('text'))))
+    return documents
+
+
+def get_search_query(text: str) -> str:
+    """
+    Turns plain search text into an FTS5 query matching documents with every word of the text. Each word is quoted, so
+    words with punctuation like `CVE-2023-43717` or `example.com` match as a phrase instead of being FTS5 syntax.
+
+    :param text: plain search text
+    :type text: str
+    :return: FTS5 query
+    :rtype: str
+    """
+    return " ".join(f'"{word.replace(chr(34), chr(34)*2)}"' for word in text.split())
+
+
+class SearchIndex():
+    """
+    A class to keep a full-text search index of exported findings and narratives, using SQLite FTS5 in the export
+    catalog database `exported_data/catalog.db`. Each finding, summary and narrative of a PTRAC is one document.
+
+    PTRACs are indexed once per sha256 hash, so unchanged reports exported again by later backups are not read again.
+    Search results are joined to the catalog to show where each matching report was exported.
+    """
+    def __init__(self, file_path: str = CATALOG_FILE_PATH):
+        """
+        :param file_path: file path of the export catalog database, defaults to CATALOG_FILE_PATH
+        :type file_path: str, optional
+        """
+        self.file_path = file_path
+        self._connection = sqlite3.connect(file_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        # the catalog tables are created by ExportCatalog, make sure they exist before adding the index to them
+        ExportCatalog(file_path).close()
+        self._connection.executescript(SEARCH_INDEX_SCHEMA)
+        self._lock = threading.Lock()
+
+    def _get_unindexed_reports(self) -> List[List[dict]]:
+        """
+        :return: for each PTRAC in the catalog that isn't indexed yet, the catalog rows of every export of it, most recent first
+        :rtype: List[List[dict]]
+        """
+        rows = self._connection.execute(
+            "SELECT r.sha256, r.name, r.file_path, r.zip_entry, e.content_store FROM reports r JOIN exports e ON e.export_id = r.export_id "
+            "WHERE r.sha256 IS NOT NULL AND r.sha256 NOT IN (SELECT sha256 FROM search_indexed) ORDER BY r.export_id DESC"
+        ).fetchall()
+        rows_by_hash = {}
+        for row in rows:
+            rows_by_hash.setdefault(row['sha256'], []).append(dict(row))
+        return list(rows_by_hash.values())
+
+    @contextmanager
+    def _open_exported_ptrac(self, row: dict) -> Iterator[BinaryIO]:
+        """
+        Opens the PTRAC of a catalog row, whether it was exported to a client ZIP, a PTRAC file or the content store
+        """
+        if row['zip_entry'] != None:
+            with zipfile.ZipFile(row['file_path'], 'r') as zip_file:
+                with zip_file.open(row['zip_entry'], 'r') as f:
+                    yield f
+        elif row['content_store'] != None and not row['file_path'].endswith(".ptrac"):
+            content_store = ContentStore(row['content_store'])
+            yield content_store.get_bytes(content_store.get_hash_from_path(row['file_path']))
+        else:
+            with open(row['file_path'], 'rb') as f:
+                yield f
+
+    def _read_documents(self, rows: List[dict]) -> List[Tuple[str, str, str]]:
+        """
+        Reads the documents of a PTRAC from the most recent export of it that can still be read. Older exports may have
+        been deleted or moved.
+        """
+        for row in rows:
+            try:
+                with self._open_exported_ptrac(row) as source:
+                    return get_ptrac_documents(source)
+            except Exception as e:
+                log.debug(f'Could not read PTRAC of report \'{row["name"]}\' from \'{row["file_path"]}\'. {e}')
+        raise Exception(f'Could not read PTRAC of report \'{rows[0]["name"]}\' from any of its {len(rows)} export(s)')
+
+    def update(self) -> Tuple[int, int]:
+        """
+        Indexes every PTRAC in the export catalog that isn't indexed yet
+
+        :return: tuple of (number of PTRACs indexed, number of PTRACs that couldn't be read)
+        :rtype: Tuple[int, int]
+        """
+        with self._lock:
+            unindexed_reports = self._get_unindexed_reports()
+        log.info(f'Indexing {len(unindexed_reports)} new PTRAC(s)')
+        indexed = 0
+        failed = 0
+        batch = []
+        for rows, documents, e in concurrency.run_concurrently(self._read_documents, unindexed_reports, max_workers=SEARCH_INDEX_WORKERS):
+            if e != None:
+                log.exception(f'{e}, skipping...')
+                failed += 1
+                continue
+            batch.append((rows[0]['sha256'], documents))
+            indexed += 1
+            if len(batch) >= SEARCH_INDEX_BATCH_SIZE:
+                self._write(batch)
+                batch = []
+        self._write(batch)
+        return indexed, failed
+
+    def _write(self, batch: List[Tuple[str, List[Tuple[str, str, str]]]]) -> None:
+        """
+        Writes the documents of a batch of PTRACs to the index in a single transaction
+        """
+        if len(batch) < 1:
+            return
+        indexed_at = time.strftime("%Y_%m_%d_%H_%M_%S", time.localtime())
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT INTO search_documents (sha256, section, title, content) VALUES (?, ?, ?, ?)",
+                [(hash, section, title, content) for hash, documents in batch for section, title, content in documents]
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO search_indexed (sha256, documents, indexed_at) VALUES (?, ?, ?)",
+                [(hash, len(documents), indexed_at) for hash, documents in batch]
+            )
+
+    def search(self, query: str, limit: int = SEARCH_RESULTS_LIMIT, raw_query: bool = False) -> List[dict]:
+        """
+        Finds the findings and narratives matching a query, best matches first
+
+        :param query: words that must all be in the finding or narrative, or an FTS5 query if `raw_query` is True
+        :type query: str
+        :param limit: max number of findings and narratives to return, defaults to SEARCH_RESULTS_LIMIT
+        :type limit: int, optional
+        :param raw_query: pass the query to FTS5 as is, to use FTS5 syntax like OR, NEAR and prefix*, defaults to False
+        :type raw_query: bool, optional
+        :return: list of {"section", "title", "snippet", "sha256", "reports"}, where matched words in "snippet" are between
+        SNIPPET_MATCH_START and SNIPPET_MATCH_END, and "reports" is the catalog rows of
+        the most recent export of each report the PTRAC was exported as
+        :rtype: List[dict]
+        """
+        fts_query = query if raw_query else get_search_query(query)
+        with self._lock:
+            matches = [dict(row) for row in self._connection.execute(
+                "SELECT sha256, section, title, snippet(search_documents, 3, ?, ?, '...', 16) AS snippet FROM search_documents "
+                "WHERE search_documents MATCH ? ORDER BY rank LIMIT ?",
+                (SNIPPET_MATCH_START, SNIPPET_MATCH_END, fts_query, limit)
+            ).fetchall()]
+            reports_by_hash = {}
+            for hash in set(match['sha256'] for match in matches):
+                rows = self._connection.execute(
+                    "SELECT r.*, e.started_at FROM reports r JOIN exports e ON e.export_id = r.export_id WHERE r.sha256 = ? ORDER BY e.started_at DESC, r.export_id DESC",
+                    (hash,)
+                ).fetchall()
+                latest_rows = {}
+                for row in rows:
+                    latest_rows.setdefault(row['report_id'], dict(row))
+                reports_by_hash[hash] = list(latest_rows.values())
+        for match in matches:
+            match['reports'] = reports_by_hash[match['sha256']]
+        return matches
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -1,15 +1,17 @@
 import json
-import io
+import re
+import shutil
 import zipfile
 import os
-from typing import List, Union
-from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, Iterator, List, Tuple, Union
+from dataclasses import dataclass, field
 from rich import print
 
 from tkinter import Tk
 from tkinter.filedialog import askopenfilenames
 import beaupy as binput
 
+import settings
 import utils.globals as globals
 import utils.log_handler as logger
 log = logger.log
@@ -17,40 +19,181 @@ from utils.log_handler import IterationMetrics
 from utils.auth_handler import Auth
 import utils.data_utils as data
 import utils.general_utils as utils
+import utils.concurrency_utils as concurrency
+import utils.manifest_handler as manifest_handler
+from utils.manifest_handler import ExportManifest
+from utils.content_store_handler import ContentStore
+import utils.catalog_handler as catalog_handler
+from utils.catalog_handler import ExportCatalog
+import utils.request_handler as request_handler
+from utils.request_handler import DOWNLOAD_CHUNK_SIZE
 import api
 
 
+# entry written last to each client ZIP, listing the client JSON and report PTRAC entries so a restore of some of the
+# reports only has to read the ZIP's central directory, this entry, and the entries of the reports being restored
+CLIENT_ZIP_INDEX_FILE_NAME = "index.json"
+# report id in the name of a PTRAC entry, to find reports in client ZIPs exported before the index entry was added
+_PTRAC_ENTRY_REPORT_ID = re.compile(r'_(\d+)_\d{4}_\d{2}_\d{2}_\d{2}_\d{2}_\d{2}\.ptrac$')
+
 @dataclass
 class ClientZIP:
     client: Union[dict, None]
-    reports: List[dict]
+    reports: Dict[str, Callable[[], Union[dict, bytes]]] # {file name or report id: function returning the raw PTRAC JSON, or the PTRAC loaded from the content store}
+    report_ids: List[str] = field(default_factory=list) # ids of the selected reports in `reports`, when only some reports are loaded
     
 class ClientReportsWorkflow:
     
-    def create_client_zip_with_json_objects(self, client, reports, folder_path):
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # add client json to ZIP buffer
-            json_buffer = io.StringIO()
-            json.dump(client, json_buffer)
-            json_data = json_buffer.getvalue()
-            zip_file.writestr(utils.sanitize_file_name(f'{client["name"]}_{client["client_id"]}_{globals.script_time}.json'), json_data)
-
-            # add report jsons to ZIP buffer
-            for report in reports:
-                if report['ptrac'] == None:
-                    continue # report doesn't have ptrac, request to get ptrac must have failed
-                json_obj = report['ptrac']
-                json_buffer = io.StringIO()
-                json.dump(json_obj, json_buffer)
-                json_data = json_buffer.getvalue()
-                zip_file.writestr(utils.sanitize_file_name(f'{report["report_data"]["name"]}_{report["report_data"]["id"]}_{globals.script_time}.ptrac'), json_data)
-
-        # save ZIP file
+    def get_catalog_details(self, ptrac: Union[bytes, BinaryIO]) -> dict:
+        """
+        :return: hash and findings count of a downloaded PTRAC to save in the export catalog, read while the PTRAC is still in its temp file
+        :rtype: dict
+        """
+        return catalog_handler.get_ptrac_details(ptrac) if settings.update_export_catalog else {}
+
+
+    def get_client_zip_file_path(self, client, folder_path) -> str:
         zip_file_name = utils.sanitize_file_name(f'{client["name"]}_{client["client_id"]}_{globals.script_time}.zip')
-        with open(f'{folder_path}/{zip_file_name}', 'wb') as f:
-            f.write(zip_buffer.getvalue())
-        log.success(f'Created client ZIP for \'{client["name"]}\' with {len(reports)} report(s)')
+        return f'{folder_path}/{zip_file_name}'
+
+
+    def create_client_zip(self, client, reports, folder_path, previous_manifest: ExportManifest = None) -> Tuple[str, List[dict]]:
+        """
+        Creates a client ZIP on disk. The PTRAC of each report is written to its ZIP entry as soon as it is downloaded and
+        then released, so only the reports currently being downloaded are held in memory instead of the whole client.
+
+        The ZIP is written to a `.part` file and renamed once complete, so an interrupted export never leaves a partial
+        ZIP with the final name.
+
+        If the manifest of a previous export is passed in, reports that haven't changed since that export are copied from
+        the previous client ZIP instead of being downloaded again.
+
+        :return: tuple of (file path of the created client ZIP, list of {"report", "file_name", "size", "report_hash"} for each report added to the ZIP)
+        :rtype: Tuple[str, List[dict]]
+        """
+        zip_file_path = self.get_client_zip_file_path(client, folder_path)
+        temp_file_path = f'{zip_file_path}.part'
+
+        exported_reports = []
+        try:
+            with zipfile.ZipFile(temp_file_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                # add client json to ZIP
+                client_file_name = utils.sanitize_file_name(f'{client["name"]}_{client["client_id"]}_{globals.script_time}.json')
+                zip_file.writestr(client_file_name, json.dumps(client))
+
+                # copy unchanged report ptracs from the previous export, entry to entry without loading them
+                reports_to_download = []
+                previous_zips = {}
+                for report in reports:
+                    report_hash = data.get_report_hash(report)
+                    previous_entry = previous_manifest.get_unchanged_entry("reports", report['id'], report_hash) if previous_manifest != None else None
+                    if previous_entry == None or previous_entry.get('file_name') == None:
+                        reports_to_download.append(report)
+                        continue
+                    file_name = utils.sanitize_file_name(f'{report["name"]}_{report["id"]}_{globals.script_time}.ptrac')
+                    try:
+                        if previous_entry['file_path'] not in previous_zips:
+                            previous_zips[previous_entry['file_path']] = zipfile.ZipFile(previous_entry['file_path'], 'r')
+                        previous_zip = previous_zips[previous_entry['file_path']]
+                        size = previous_zip.getinfo(previous_entry['file_name']).file_size
+                        with previous_zip.open(previous_entry['file_name'], 'r') as src, zip_file.open(file_name, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as dst:
+                            shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK_SIZE)
+                    except Exception as e:
+                        log.debug(f'Could not copy unchanged report \'{report["name"]}\' from \'{previous_entry["file_path"]}\', downloading instead. {e}')
+                        reports_to_download.append(report)
+                        continue
+                    exported_reports.append({"report": report, "file_name": file_name, "size": size, "report_hash": report_hash, "unchanged": True})
+                for previous_zip in previous_zips.values():
+                    previous_zip.close()
+                if len(reports_to_download) < len(reports):
+                    log.info(f'Copied {len(reports)-len(reports_to_download)} unchanged report(s) for client \'{client["name"]}\' from previous export')
+
+                # add report ptracs to ZIP as they finish downloading to temp files
+                download_report = lambda report: data.download_ptrac_report_to_temp_file(report, auth=globals.auth, folder_path=folder_path)
+                for report, downloaded, e in concurrency.run_concurrently(download_report, reports_to_download, max_workers=settings.export_workers):
+                    if e != None:
+                        log.exception(f'Could not download ptrac for report \'{report["name"]}\' under client \'{client["name"]}\', skipping...')
+                        continue
+                    ptrac_file, size = downloaded
+                    with ptrac_file:
+                        catalog_details = self.get_catalog_details(ptrac_file)
+                        file_name = utils.sanitize_file_name(f'{report["name"]}_{report["id"]}_{globals.script_time}.ptrac')
+                        with zip_file.open(file_name, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as dst:
+                            shutil.copyfileobj(ptrac_file, dst, DOWNLOAD_CHUNK_SIZE)
+                    exported_reports.append({"report": report, "file_name": file_name, "size": size, "report_hash": data.get_report_hash(report), **catalog_details})
+
+                # add index of the ZIP's entries
+                zip_index = {
+                    "client_file_name": client_file_name,
+                    "reports": {str(exported_report['report']['id']): {"file_name": exported_report['file_name'], "name": exported_report['report']['name'], "size": exported_report['size']} for exported_report in exported_reports}
+                }
+                zip_file.writestr(CLIENT_ZIP_INDEX_FILE_NAME, json.dumps(zip_index))
+        except Exception:
+            # don't leave the partial ZIP behind
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+
+        os.replace(temp_file_path, zip_file_path)
+        log.success(f'Created client ZIP for \'{client["name"]}\' with {len(exported_reports)} of {len(reports)} report(s)')
+        return zip_file_path, exported_reports
+
+
+    def create_client_in_content_store(self, client, reports, content_store: ContentStore, previous_manifest: ExportManifest = None) -> Tuple[str, List[dict]]:
+        """
+        Saves a client and the PTRACs of its reports to the content store. Reports that haven't changed since the export
+        of the previous manifest point to the same objects in the content store and are not downloaded again.
+
+        :return: tuple of (file path of the client object in the content store, list of {"report", "file_path", "file_name", "size", "report_hash"} for each report saved)
+        :rtype: Tuple[str, List[dict]]
+        """
+        client_file_path = content_store.get_object_path(content_store.put_json(client))
+
+        exported_reports = []
+        reports_to_download = []
+        for report in reports:
+            report_hash = data.get_report_hash(report)
+            previous_entry = previous_manifest.get_unchanged_entry("reports", report['id'], report_hash) if previous_manifest != None else None
+            if previous_entry == None:
+                reports_to_download.append(report)
+                continue
+            exported_reports.append({"report": report, "file_path": previous_entry['file_path'], "file_name": None, "size": previous_entry['size'], "report_hash": report_hash, "unchanged": True})
+        if len(reports_to_download) < len(reports):
+            log.info(f'{len(reports)-len(reports_to_download)} report(s) for client \'{client["name"]}\' unchanged since previous export')
+
+        def save_report(report):
+            ptrac_file, size = data.download_ptrac_report_to_temp_file(report, auth=globals.auth, folder_path=content_store.folder_path)
+            with ptrac_file:
+                catalog_details = self.get_catalog_details(ptrac_file)
+                return content_store.get_object_path(content_store.put_ptrac(ptrac_file)), catalog_details
+        for report, saved, e in concurrency.run_concurrently(save_report, reports_to_download, max_workers=settings.export_workers):
+            if e != None:
+                log.exception(f'Could not download ptrac for report \'{report["name"]}\' under client \'{client["name"]}\', skipping...')
+                continue
+            file_path, catalog_details = saved
+            exported_reports.append({"report": report, "file_path": file_path, "file_name": None, "size": os.path.getsize(file_path), "report_hash": data.get_report_hash(report), **catalog_details})
+
+        log.success(f'Saved client \'{client["name"]}\' with {len(exported_reports)} of {len(reports)} report(s) to content store')
+        return client_file_path, exported_reports
+
+
+    def link_unchanged_client_zip(self, client, reports, folder_path, previous_manifest: ExportManifest) -> Union[str, None]:
+        """
+        Checks if a client and all of its reports are unchanged since a previous export. If so, the client ZIP from the
+        previous export is hard linked into the current export, or referenced if hard links aren't supported.
+
+        :return: file path of the linked client ZIP, or None if the client or any of its reports changed
+        :rtype: Union[str, None]
+        """
+        previous_client_entry = previous_manifest.get_unchanged_entry("clients", client['client_id'], data.get_client_hash(client))
+        if previous_client_entry == None:
+            return None
+        if set(previous_client_entry.get('reports', [])) != set([str(report['id']) for report in reports]):
+            return None
+        for report in reports:
+            if previous_manifest.get_unchanged_entry("reports", report['id'], data.get_report_hash(report)) == None:
+                return None
+        return manifest_handler.link_unchanged_file(previous_client_entry['file_path'], self.get_client_zip_file_path(client, folder_path))
 
 
     def select_zip_files(self, initial_directory=None):
@@ -63,39 +206,181 @@ class ClientReportsWorkflow:
         if not (os.path.exists(initial_directory) and os.path.isdir(initial_directory)):
             initial_directory = utils.get_script_root_path()
         file_paths = askopenfilenames(
-            filetypes=[("Zip files", "*.zip")],
+            filetypes=[("Zip files", "*.zip"), ("Content store export manifests", "*.json")],
             initialdir=initial_directory
         )
         return file_paths
     
 
-    def extract_data_from_client_ZIP(self, zip_path) -> ClientZIP:
+    def get_client_ZIP_index(self, zip_ref: zipfile.ZipFile) -> dict:
+        """
+        Gets the index entry of a client ZIP. For client ZIPs exported before the index entry was added, the index is
+        built from the entry names in the ZIP's central directory, sniffing the type of JSON entries if there is more than one.
+
+        :param zip_ref: open client ZIP
+        :type zip_ref: zipfile.ZipFile
+        :return: dictionary of {"client_file_name": str or None, "reports": {report id: {"file_name": str}}}
+        :rtype: dict
+        """
+        file_names = zip_ref.namelist()
+        if CLIENT_ZIP_INDEX_FILE_NAME in file_names:
+            return json.loads(zip_ref.read(CLIENT_ZIP_INDEX_FILE_NAME))
+
+        json_file_names = [file_name for file_name in file_names if file_name.endswith('.json')]
+        client_file_name = json_file_names[0] if len(json_file_names) == 1 else next((file_name for file_name in json_file_names if self.sniff_client_ZIP_entry(zip_ref, file_name) == "client"), None)
+        reports = {}
+        for file_name in file_names:
+            match = _PTRAC_ENTRY_REPORT_ID.search(file_name)
+            if match != None:
+                reports[match.group(1)] = {"file_name": file_name}
+        return {"client_file_name": client_file_name, "reports": reports}
+
+
+    def sniff_client_ZIP_entry(self, zip_ref: zipfile.ZipFile, file_name: str) -> Union[str, None]:
+        """
+        Gets the type of a JSON entry in a client ZIP, reading it as a stream instead of decompressing all of it at once
+        """
+        with zip_ref.open(file_name, 'r') as f:
+            return utils.sniff_json_object_type(f)
+
+
+    def read_client_ZIP_PTRAC(self, zip_path: str, file_name: str) -> bytes:
+        """
+        Reads the raw bytes of a PTRAC entry from a client ZIP. Raises an exception if the entry is not a PTRAC.
+        """
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            ptrac = zip_ref.read(file_name)
+        if not utils.probe_is_ptrac(ptrac):
+            raise Exception(f'Encountered invalid PTRAC in client ZIP \'{file_name}\'')
+        return ptrac
+
+
+    def extract_data_from_client_ZIP(self, zip_path, report_ids: List = None) -> ClientZIP:
         """
-        Extract JSON files from a zip file and return them as a list of dictionaries.
+        Extract the client JSON from a client ZIP, and a reader for the PTRAC of each report. The entries are looked up
+        in the ZIP's index entry. PTRACs are only read from the ZIP when their reader is called, as each report is
+        imported, so only the PTRACs being uploaded are held in memory instead of every PTRAC in the ZIP. PTRACs are read
+        as the raw bytes of their ZIP entry instead of being parsed, so they can be uploaded as they are.
+
+        If `report_ids` is passed in, only the PTRACs of those reports are read. The rest of the ZIP is never read.
+
+        For client ZIPs exported before the index entry was added, JSON entries whose name doesn't have a report id are
+        sniffed, a stream at a time, to find the client JSON and any other PTRACs.
         """
-        client_json = None
-        report_json_list = []
         try:
             with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                for file_name in zip_ref.namelist():
-                    if file_name.endswith('.json') or file_name.endswith('.ptrac'):
-                        with zip_ref.open(file_name) as file:
-                            json_data = json.load(file)
-                            if utils.get_json_object_type(json_data) == "client":
-                                client_json = json_data
-                            elif utils.get_json_object_type(json_data) == "ptrac":
-                                report_json_list.append(json_data)
+                zip_index = self.get_client_ZIP_index(zip_ref)
+                if zip_index.get('client_file_name') == None:
+                    log.exception(f'Client ZIP file \'{zip_path}\' did not contain a valid client JSON')
+                    return ClientZIP(None, {})
+                client_json = json.loads(zip_ref.read(zip_index['client_file_name']))
+
+                # {report id, or file name of PTRACs found without an id: file name}
+                if report_ids != None:
+                    report_ids = [str(report_id) for report_id in report_ids]
+                    report_file_names = {report_id: zip_index['reports'][report_id]['file_name'] for report_id in report_ids if report_id in zip_index['reports']}
+                else:
+                    report_file_names = {report_id: report_entry['file_name'] for report_id, report_entry in zip_index['reports'].items()}
+                    if CLIENT_ZIP_INDEX_FILE_NAME not in zip_ref.namelist():
+                        indexed_file_names = set(report_file_names.values()) | set([zip_index['client_file_name']])
+                        for file_name in zip_ref.namelist():
+                            if file_name in indexed_file_names:
+                                continue
+                            if not (file_name.endswith('.json') or file_name.endswith('.ptrac')):
+                                log.exception(f'Encountered unknown file in client ZIP \'{file_name}\'.')
+                            elif self.sniff_client_ZIP_entry(zip_ref, file_name) == "ptrac":
+                                report_file_names[file_name] = file_name
                             else:
                                 log.exception(f'Encountered invalid file in client ZIP \'{file_name}\'.')
-                    else:
-                        log.exception(f'Encountered unknown file in client ZIP \'{file_name}\'.')
-            if client_json == None:
-                log.exception(f'Client ZIP file \'{zip_path}\' did not contain a valid client JSON')
-                return ClientZIP(None, [])
-            return ClientZIP(client_json, report_json_list)
+            log.debug(f'Found {len(report_file_names)} of {len(zip_index["reports"])} report(s) in client ZIP \'{zip_path}\'')
         except Exception as e:
             log.exception(f'Could not find or load client ZIP file \'{zip_path}\'\n{e}')
-            return ClientZIP(None, [])
+            return ClientZIP(None, {})
+
+        read_ptrac = lambda file_name: lambda: self.read_client_ZIP_PTRAC(zip_path, file_name)
+        report_ptracs = {file_name: read_ptrac(file_name) for file_name in report_file_names.values()}
+        return ClientZIP(client_json, report_ptracs, list(report_file_names.keys()) if report_ids != None else [])
+
+
+    def extract_data_from_content_store_manifest(self, manifest_path, report_ids: List = None) -> Iterator[ClientZIP]:
+        """
+        Loads clients, and a reader for the PTRAC of each of their reports, from the manifest of an export saved to the
+        content store. Clients are loaded one at a time as the caller iterates, and PTRACs when their reader is called.
+        If `report_ids` is passed in, only clients with any of these reports are loaded, with only those reports.
+
+        The manifests of exports saved to client ZIPs don't hold any data, so they are rejected as invalid.
+        """
+        if report_ids != None:
+            report_ids = [str(report_id) for report_id in report_ids]
+        try:
+            manifest = ExportManifest.load(manifest_path)
+        except Exception as e:
+            log.exception(f'Could not load content store export manifest \'{manifest_path}\'\n{e}')
+            yield ClientZIP(None, {})
+            return
+        if manifest.data.get('content_store') == None:
+            log.exception(f'Manifest \'{manifest_path}\' is not from an export saved to the content store. Import the client ZIPs it lists instead')
+            yield ClientZIP(None, {})
+            return
+        content_store = ContentStore(manifest.data['content_store'])
+        for client_id, client_entry in manifest.data['clients'].items():
+            client_report_ids = [report_id for report_id in client_entry.get('reports', []) if report_ids == None or report_id in report_ids]
+            if report_ids != None and len(client_report_ids) < 1:
+                continue
+            try:
+                client_json = content_store.get_json(content_store.get_hash_from_path(client_entry['file_path']))
+                read_ptrac = lambda file_path: lambda: content_store.get_ptrac(content_store.get_hash_from_path(file_path))
+                report_ptracs = {f'report {report_id}': read_ptrac(manifest.data['reports'][report_id]['file_path']) for report_id in client_report_ids}
+                yield ClientZIP(client_json, report_ptracs, client_report_ids if report_ids != None else [])
+            except Exception as e:
+                log.exception(f'Could not load client {client_id} from content store\n{e}')
+                yield ClientZIP(None, {})
+
+
+    def create_client(self, client: dict, auth: Auth) -> int:
+        """
+        Creates a new client from a client exported from this or another instance. Raises an exception if the client
+        could not be created.
+
+        :param client: client object returned from the POST List Clients endpoint
+        :type client: dict
+        :param auth: Auth object of the instance to create the client in
+        :type auth: Auth
+        :return: id of the created client
+        :rtype: int
+        """
+        payload = dict(client)
+        payload.pop("cuid", None)
+        payload.pop("tenant_id", None)
+        payload.pop("client_id", None)
+        # TODO figure out how to handle logo
+        payload.pop("logo", None)
+        payload.pop("doc_type", None)
+        # TODO figure out how to handle users
+        payload.pop("users", None)
+        # payload['name'] = "Green Testing import" # TODO remove - only for testing
+        payload["tags"] = list(payload.get("tags") or []) + ["green_delete"] # TODO remove - only for testing
+        response = api.clients.create_client(auth.base_url, auth.get_auth_headers(), payload)
+        log.success(f'Created client \'{payload["name"]}\'')
+        return response.json['client_id']
+
+
+    def load_client_ZIPs(self, file_paths, report_ids: List = None) -> Iterator[Tuple[str, ClientZIP]]:
+        """
+        Loads clients from a list of client ZIP files, or from the manifests of exports saved to the content store.
+        Clients are loaded one at a time as the caller iterates.
+
+        :param report_ids: only load these reports, and the clients they are under, defaults to loading every report
+        :type report_ids: List, optional
+        :yield: tuple of (file path, loaded ClientZIP)
+        :rtype: Iterator[Tuple[str, ClientZIP]]
+        """
+        for file_path in file_paths:
+            if file_path.endswith(".json"):
+                for client_zip in self.extract_data_from_content_store_manifest(file_path, report_ids=report_ids):
+                    yield file_path, client_zip
+            else:
+                yield file_path, self.extract_data_from_client_ZIP(file_path, report_ids=report_ids)
 
 
     def start(self):
@@ -184,40 +469,113 @@ Overview of Steps:
 
 
         # get and sort reports from instance
-        sorted_client_reports = [[] for client in selected_clients]
+        reports_by_client_id = {}
         if "include client reports" in export_clients_options:
             spinner = binput.spinners.Spinner(binput.spinners.DOTS, "Loading reports from instance...")
             spinner.start()
             reports = []
             data.get_page_of_reports(reports=reports, auth=globals.auth)
             # sort reports into groups related to clients
-            for i, report_group in enumerate(sorted_client_reports):
-                for report in reports:
-                    if report['client_id'] == clients[i]['client_id']:
-                        # get ptrac for each report
-                        ptrac = None
-                        try:
-                            response = api.reports.export_report_to_ptrac(globals.auth.base_url, globals.auth.get_auth_headers(), report['client_id'], report['id'])
-                            ptrac = response.json
-                        except Exception as e:
-                            log.exception(f'Could not download ptrac for report \'{report["name"]}\' under client \'{clients[i]["name"]}\', skipping...')
-                        report_group.append({"report_data":report, "ptrac":ptrac})
+            reports_by_client_id = data.group_reports_by_client_id(reports)
             spinner.stop()
 
-        # create and export client ZIPs
-        utils.create_directory("exported_data")
-        utils.create_directory("exported_data/client_ZIPs")
-        folder_path = "exported_data/client_ZIPs"
-
-        for i, client in enumerate(selected_clients):
-            self.create_client_zip_with_json_objects(client, sorted_client_reports[i], folder_path)
+        self.run_export_clients(selected_clients, reports_by_client_id)
 
         # return to main menu
         log.info(f'Finished exporting clients')
+        request_handler.log_stats()
         input(f'Press enter to continue...')
         main.start()
 
 
+    def run_export_clients(self, selected_clients: List[dict], reports_by_client_id: Dict[int, List[dict]]) -> int:
+        """
+        Exports clients, and the reports under them, to client ZIPs or the content store. Does not prompt the user, so
+        it can be run by the interactive workflow or a headless job.
+
+        :param selected_clients: clients to export
+        :type selected_clients: List[dict]
+        :param reports_by_client_id: reports to export with each client, empty to only export the clients
+        :type reports_by_client_id: Dict[int, List[dict]]
+        :return: number of clients that could not be fully exported
+        :rtype: int
+        """
+        # create and export client ZIPs, or save to content store instead of client ZIPs
+        utils.create_directory("exported_data")
+        folder_path = "exported_data/client_ZIPs"
+        content_store = ContentStore() if settings.use_content_store else None
+        content_store_path = content_store.folder_path if content_store != None else None
+        if content_store == None:
+            utils.create_directory(folder_path)
+
+        # skip clients already exported by the run being resumed
+        manifest = manifest_handler.start_export_manifest("export_clients", globals.auth.base_url, resume=getattr(globals.args, "resume", False), content_store_path=content_store_path)
+        clients_to_export = [client for client in selected_clients if not manifest.is_completed("clients", client['client_id'])]
+        if len(clients_to_export) < len(selected_clients):
+            log.info(f'Skipping {len(selected_clients)-len(clients_to_export)} client(s) already exported')
+
+        # reuse data that hasn't changed since the last complete export. the hash recorded for each report needs its last
+        # updated time, so it is loaded even when there is no previous export to compare to
+        if getattr(globals.args, "incremental", False):
+            reports_by_client_id = data.group_reports_by_client_id(data.add_report_updated_at([report for client in clients_to_export for report in reports_by_client_id.get(client['client_id'], [])], auth=globals.auth))
+        previous_manifest = manifest_handler.find_incremental_base("export_clients", globals.auth.base_url, incremental=getattr(globals.args, "incremental", False), content_store_path=content_store_path)
+
+        # record what was exported in the catalog
+        catalog = ExportCatalog() if settings.update_export_catalog else None
+        export_id = catalog.start_export(manifest) if catalog != None else None
+
+        metrics = IterationMetrics(len(clients_to_export))
+        failed_clients = 0
+        for client in clients_to_export:
+            try:
+                client_reports = reports_by_client_id.get(client['client_id'], [])
+                client_hash = data.get_client_hash(client)
+
+                # unchanged clients in the content store already point to the same objects, nothing to link
+                linked_zip_file_path = self.link_unchanged_client_zip(client, client_reports, folder_path, previous_manifest) if previous_manifest != None and content_store == None else None
+                if linked_zip_file_path != None:
+                    log.success(f'Client \'{client["name"]}\' and its {len(client_reports)} report(s) unchanged since last export, linked \'{linked_zip_file_path}\'')
+                    linked_reports = []
+                    for report in client_reports:
+                        previous_entry = previous_manifest.get_entry("reports", report['id'])
+                        manifest.add_completed("reports", report['id'], linked_zip_file_path, size=previous_entry['size'], client_id=client['client_id'], file_name=previous_entry['file_name'], record_hash=previous_entry.get('record_hash'))
+                        linked_reports.append({"report": report, "file_name": previous_entry['file_name'], "size": previous_entry['size'], "report_hash": previous_entry.get('record_hash'), "unchanged": True})
+                    manifest.add_completed("clients", client['client_id'], linked_zip_file_path, reports=[str(report['id']) for report in client_reports], record_hash=client_hash, unchanged_since=previous_manifest.data['started_at'])
+                    if catalog != None:
+                        catalog.add_client(export_id, client, linked_zip_file_path, linked_reports)
+                    log.info(metrics.print_iter_metrics())
+                    continue
+
+                if content_store != None:
+                    zip_file_path, exported_reports = self.create_client_in_content_store(client, client_reports, content_store, previous_manifest=previous_manifest)
+                else:
+                    zip_file_path, exported_reports = self.create_client_zip(client, client_reports, folder_path, previous_manifest=previous_manifest)
+                for exported_report in exported_reports:
+                    manifest.add_completed("reports", exported_report['report']['id'], exported_report.get('file_path', zip_file_path), size=exported_report['size'], client_id=client['client_id'], file_name=exported_report['file_name'], record_hash=exported_report['report_hash'])
+                if catalog != None:
+                    catalog.add_client(export_id, client, zip_file_path, exported_reports)
+                if len(exported_reports) < len(client_reports):
+                    failed_clients += 1 # client is not marked as finished, so it is exported again when resuming
+                else:
+                    manifest.add_completed("clients", client['client_id'], zip_file_path, reports=[str(exported_report['report']['id']) for exported_report in exported_reports], record_hash=client_hash)
+            except Exception as e:
+                log.exception(f'Could not create client ZIP for \'{client["name"]}\', skipping...\n{e}')
+                failed_clients += 1
+            log.info(metrics.print_iter_metrics())
+
+        if failed_clients > 0:
+            manifest.save()
+            log.info(f'Could not fully export {failed_clients} client(s). Run the script with --resume to retry the client(s) that failed to export')
+        else:
+            manifest.finish()
+        if catalog != None:
+            catalog.finish_export(export_id, manifest.data['status'])
+            catalog.close()
+        if content_store != None:
+            content_store.log_stats()
+        return failed_clients
+
+
     def import_clients(self):
         import main # importing here to prevent circular imports
 
@@ -230,49 +588,77 @@ Overview of Steps:
         # import data from client ZIPs
         spinner = binput.spinners.Spinner(binput.spinners.DOTS, "Importing clients from file(s)...")
         spinner.start()
-        for file_path in zip_file_paths:
-            zip = self.extract_data_from_client_ZIP(file_path)
-            if zip.client == None:
-                log.exception(f'Skipping invalid client ZIP file \'{file_path}\'...')
-                continue
-
-            # create client
-            payload = zip.client
-            payload.pop("cuid")
-            payload.pop("tenant_id")
-            payload.pop("client_id")
-            # TODO figure out how to handle logo
-            payload.pop("logo")
-            payload.pop("doc_type")
-            # TODO figure out how to handle users
-            payload.pop("users")
-            # payload['name'] = "Green Testing import" # TODO remove - only for testing
-            payload["tags"].append("green_delete") # TODO remove - only for testing
-            try:
-                response = api.clients.create_client(globals.auth.base_url, globals.auth.get_auth_headers(), payload)
-                client_id = response.json['client_id']
-                log.success(f'Created client \'{payload["name"]}\'')
-            except Exception as e:
-                log.exception(f'Could not create client. Skipping client and {len(zip.reports)} subsequent report(s)...')
-                continue
-
-            # import ptracs
-            for ptrac in zip.reports:
-                try:
-                    json_str = json.dumps(ptrac)
-                    json_file_like = io.BytesIO(json_str.encode('utf-8'))
-                    multipart_form_data = {
-                        'file': json_file_like
-                    }
-                    response = api.reports.import_ptrac_report(globals.auth.base_url, globals.auth.get_auth_headers(), client_id, multipart_form_data)
-                    log.success(f'Created report \'{ptrac["report_info"]["name"]}\' for client \'{zip.client["name"]}\'')
-                except Exception as e:
-                    log.exception(f'Could not create report. Skipping...')
-                    continue
-
+        import_results, _ = self.run_import_clients(zip_file_paths)
         spinner.stop()
+        self.log_import_results(import_results)
 
         # return to main menu
         log.info(f'Finished importing clients')
+        request_handler.log_stats()
         input(f'Press enter to continue...')
         main.start()
+
+
+    def run_import_clients(self, zip_file_paths: List[str], report_ids: List = None) -> Tuple[Dict[str, dict], List[str]]:
+        """
+        Creates a client, and reports under it, from each client ZIP or content store export manifest. Does not prompt
+        the user, so it can be run by the interactive workflow or a headless job.
+
+        :param zip_file_paths: file paths of client ZIPs or content store export manifests
+        :type zip_file_paths: List[str]
+        :param report_ids: only restore these reports, and the clients they are under. files that don't contain any of
+        the reports are skipped without creating their client. defaults to restoring every client and report
+        :type report_ids: List, optional
+        :return: tuple of (dictionary of {file_path: {"clients": int, "reports": int, "failed": [str]}} with the result of
+        each file, list of the `report_ids` that weren't found in any of the files)
+        :rtype: Tuple[Dict[str, dict], List[str]]
+        """
+        # per file accounting of {file_path: {"clients": int, "reports": int, "failed": [str]}}
+        import_results = {}
+        found_report_ids = set()
+        def create_clients_and_load_ptracs():
+            # clients are created while the reports of earlier clients are still being imported
+            for file_path, zip in self.load_client_ZIPs(zip_file_paths, report_ids=report_ids):
+                result = import_results.setdefault(file_path, {"clients": 0, "reports": 0, "failed": []})
+                if zip.client == None:
+                    log.exception(f'Skipping invalid client ZIP file \'{file_path}\'...')
+                    result['failed'].append("invalid client ZIP file")
+                    continue
+                found_report_ids.update(zip.report_ids)
+                if report_ids != None and len(zip.reports) < 1:
+                    log.info(f'Client \'{zip.client["name"]}\' in \'{file_path}\' has none of the selected reports, skipping...')
+                    continue
+
+                # create client
+                try:
+                    client_id = self.create_client(zip.client, globals.auth)
+                    result['clients'] += 1
+                except Exception as e:
+                    log.exception(f'Could not create client. Skipping client and {len(zip.reports)} subsequent report(s)...')
+                    result['failed'].append(f'client \'{zip.client["name"]}\' and {len(zip.reports)} report(s) - {e}')
+                    continue
+
+                for report_name, read_ptrac in zip.reports.items():
+                    yield file_path, zip.client, client_id, report_name, read_ptrac
+
+        # read and import ptracs, up to settings.import_workers at a time
+        import_ptrac = lambda loaded_ptrac: data.import_ptrac_report(loaded_ptrac[4](), loaded_ptrac[2], auth=globals.auth)
+        for (file_path, client, client_id, report_name, read_ptrac), response, e in concurrency.run_concurrently(import_ptrac, create_clients_and_load_ptracs(), max_workers=settings.import_workers):
+            if e == None:
+                log.success(f'Created report from \'{report_name}\' for client \'{client["name"]}\'')
+                import_results[file_path]['reports'] += 1
+            else:
+                log.exception(f'Could not create report. Skipping...\n{e}')
+                import_results[file_path]['failed'].append(f'report \'{report_name}\' - {e}')
+
+        missing_report_ids = [str(report_id) for report_id in report_ids if str(report_id) not in found_report_ids] if report_ids != None else []
+        for report_id in missing_report_ids:
+            log.error(f'Report {report_id} was not found in any of the selected files')
+        return import_results, missing_report_ids
+
+
+    def log_import_results(self, import_results: Dict[str, dict]) -> None:
+        for file_path, result in import_results.items():
+            log.info(f'{file_path} | Clients created: {result["clients"]} | Reports created: {result["reports"]} | Failed: {len(result["failed"])}')
+            for failure in result['failed']:
+                log.error(f'Failed: {file_path} | {failure}')
@@ -0,0 +1,305 @@
+import argparse
+import glob
+import os
+from typing import List, Union
+
+import yaml
+
+import utils.globals as globals
+import utils.log_handler as logger
+log = logger.log
+import utils.data_utils as data
+import utils.request_handler as request_handler
+from utils.auth_handler import Auth
+from utils.file_type_handler import file_type_cache
+from utils.catalog_handler import ExportCatalog
+from workflows.clients_reports import ClientReportsWorkflow
+from workflows.migration import MigrationWorkflow
+from workflows.reports import ReportsWorkflow
+
+
+JOB_WORKFLOWS = ["export_clients", "export_reports", "import_clients", "import_reports", "migrate_clients"]
+# files each import workflow loads when a directory is given as a path
+IMPORT_FILE_EXTENSIONS = {
+    "import_clients": [".zip", ".json"],
+    "import_reports": [".ptrac", ".json"]
+}
+# types of JSON files each import workflow loads when a directory is given as a path, other JSON files are ignored
+IMPORT_FILE_TYPES = {
+    "import_clients": ["export_manifest"],
+    "import_reports": ["ptrac", "export_manifest"]
+}
+
+
+class JobRunner:
+    """
+    Runs workflows without any prompts, for scheduled or unattended runs. Each job is a dictionary naming the workflow
+    and what it should select, from the command line or a job file:
+
+    ```
+    jobs:
+      - workflow: export_clients
+        client_ids: [1045]      # clients to export. with tags, clients matching either are exported
+        tags: [weekly_backup]   # clients with any of these tags
+        include_reports: true   # defaults to true
+        incremental: true       # same as the --incremental option, for this job only
+      - workflow: export_reports
+        report_ids: [345951070] # reports to export. with client_ids and tags, reports matching any are exported
+        client_ids: [1045]      # reports under these clients
+        tags: [final]           # reports with any of these tags
+      - workflow: import_clients
+        paths: ["exported_data/client_ZIPs/*.zip"]  # files, folders or glob patterns. with report_ids and no paths, found in the export catalog
+        report_ids: [345951070] # only restore these reports, and their clients. defaults to every report
+      - workflow: import_reports
+        paths: ["exported_data/report_PTRACs"]
+        client_id: 1045         # existing client to import the reports to
+      - workflow: migrate_clients
+        client_ids: [1045]      # same selectors as export_clients
+        include_reports: true
+        target:                 # instance to copy the clients to, the instance in config.yaml is the source
+          instance_url: https://other.plextrac.com
+          username: user@example.com
+          password: password
+    ```
+
+    Export jobs with no selectors only run with `all: true`, so a typo can't export the whole instance by accident.
+    """
+
+    def run_jobs(self, jobs: List[dict]) -> bool:
+        """
+        Runs each job in order. A failed job doesn't stop the jobs after it.
+
+        :param jobs: list of jobs
+        :type jobs: List[dict]
+        :return: whether every job finished without failures
+        :rtype: bool
+        """
+        all_succeeded = True
+        for i, job in enumerate(jobs):
+            log.info(f'Starting job {i+1}/{len(jobs)}: {job.get("workflow")}')
+            try:
+                succeeded = self.run_job(job)
+            except Exception as e:
+                log.exception(f'Job {i+1} \'{job.get("workflow")}\' failed\n{e}')
+                succeeded = False
+            if succeeded:
+                log.success(f'Finished job {i+1}/{len(jobs)}: {job.get("workflow")}')
+            else:
+                log.error(f'Job {i+1}/{len(jobs)}: {job.get("workflow")} finished with failures')
+            all_succeeded = all_succeeded and succeeded
+        request_handler.log_stats()
+        return all_succeeded
+
+
+    def run_job(self, job: dict) -> bool:
+        """
+        :param job: workflow and selectors of the job
+        :type job: dict
+        :raises ValueError: the job is missing a workflow or required selectors
+        :return: whether the job finished without failures
+        :rtype: bool
+        """
+        workflow = job.get("workflow")
+        if workflow not in JOB_WORKFLOWS:
+            raise ValueError(f'Invalid workflow \'{workflow}\', must be one of {JOB_WORKFLOWS}')
+
+        # resume and incremental can be set per job, otherwise the command line options are used
+        cli_args = globals.args
+        globals.args = argparse.Namespace(**vars(cli_args)) if cli_args != None else argparse.Namespace()
+        for option in ["resume", "incremental"]:
+            if option in job:
+                setattr(globals.args, option, bool(job[option]))
+        try:
+            if workflow == "export_clients":
+                return self.export_clients(job)
+            if workflow == "export_reports":
+                return self.export_reports(job)
+            if workflow == "import_clients":
+                return self.import_clients(job)
+            if workflow == "migrate_clients":
+                return self.migrate_clients(job)
+            return self.import_reports(job)
+        finally:
+            globals.args = cli_args
+
+
+    def export_clients(self, job: dict) -> bool:
+        clients = []
+        data.get_page_of_clients(clients=clients, auth=globals.auth)
+        selected_clients = select_records(clients, "client_id", job.get("client_ids"), job.get("tags"), job.get("all", False))
+        log.info(f'Selected {len(selected_clients)} of {len(clients)} client(s)')
+        if len(selected_clients) < 1:
+            return False
+
+        reports_by_client_id = {}
+        if job.get("include_reports", True):
+            reports = []
+            data.get_page_of_reports(reports=reports, auth=globals.auth)
+            reports_by_client_id = data.group_reports_by_client_id(reports)
+
+        return ClientReportsWorkflow().run_export_clients(selected_clients, reports_by_client_id) == 0
+
+
+    def export_reports(self, job: dict) -> bool:
+        reports = []
+        data.get_page_of_reports(reports=reports, auth=globals.auth)
+        client_ids = [str(client_id) for client_id in job.get("client_ids") or []]
+        # with only client_ids, reports are selected by client alone
+        if len(client_ids) > 0 and not (job.get("report_ids") or job.get("tags") or job.get("all", False)):
+            selected_reports = []
+        else:
+            selected_reports = select_records(reports, "id", job.get("report_ids"), job.get("tags"), job.get("all", False))
+        # reports under the selected clients
+        selected_report_ids = [report['id'] for report in selected_reports]
+        selected_reports += [report for report in reports if str(report['client_id']) in client_ids and report['id'] not in selected_report_ids]
+        log.info(f'Selected {len(selected_reports)} of {len(reports)} report(s)')
+        if len(selected_reports) < 1:
+            return False
+
+        return ReportsWorkflow().run_export_reports(selected_reports) == 0
+
+
+    def import_clients(self, job: dict) -> bool:
+        workflow = ClientReportsWorkflow()
+        report_ids = job.get("report_ids") or None
+        if not job.get("paths") and report_ids != None:
+            # find the exports holding the reports in the export catalog, instead of opening every client ZIP
+            catalog = ExportCatalog()
+            file_paths = catalog.find_client_files(report_ids)
+            catalog.close()
+            log.info(f'Found {len(file_paths)} file(s) holding the selected report(s) in the export catalog')
+        else:
+            file_paths = get_file_paths(job.get("paths"), IMPORT_FILE_EXTENSIONS["import_clients"], IMPORT_FILE_TYPES["import_clients"])
+            log.info(f'Selected {len(file_paths)} file(s)')
+        if len(file_paths) < 1:
+            return False
+
+        import_results, missing_report_ids = workflow.run_import_clients(file_paths, report_ids=report_ids)
+        workflow.log_import_results(import_results)
+        return len(missing_report_ids) < 1 and all(len(result['failed']) < 1 for result in import_results.values())
+
+
+    def import_reports(self, job: dict) -> bool:
+        workflow = ReportsWorkflow()
+        if job.get("client_id") == None:
+            raise ValueError(f'import_reports job requires the client_id of the client to import reports to')
+        file_paths = get_file_paths(job.get("paths"), IMPORT_FILE_EXTENSIONS["import_reports"], IMPORT_FILE_TYPES["import_reports"])
+        log.info(f'Selected {len(file_paths)} file(s)')
+        if len(file_paths) < 1:
+            return False
+
+        clients = []
+        data.get_page_of_clients(clients=clients, auth=globals.auth)
+        selected_client = next((client for client in clients if str(client['client_id']) == str(job['client_id'])), None)
+        if selected_client == None:
+            raise ValueError(f'Did not find client with client_id {job["client_id"]} in Plextrac instance')
+
+        imported_files, failed_files = workflow.run_import_reports(file_paths, selected_client)
+        workflow.log_import_results(imported_files, failed_files)
+        return len(failed_files) < 1
+
+
+    def migrate_clients(self, job: dict) -> bool:
+        target = job.get("target") or {}
+        missing = [key for key in ["instance_url", "username", "password"] if target.get(key) in [None, ""]]
+        if len(missing) > 0:
+            raise ValueError(f'migrate_clients job requires {", ".join(missing)} under target')
+
+        clients = []
+        data.get_page_of_clients(clients=clients, auth=globals.auth)
+        selected_clients = select_records(clients, "client_id", job.get("client_ids"), job.get("tags"), job.get("all", False))
+        log.info(f'Selected {len(selected_clients)} of {len(clients)} client(s)')
+        if len(selected_clients) < 1:
+            return False
+
+        reports_by_client_id = {}
+        if job.get("include_reports", True):
+            reports = []
+            data.get_page_of_reports(reports=reports, auth=globals.auth)
+            reports_by_client_id = data.group_reports_by_client_id(reports)
+
+        target_auth = Auth(target)
+        target_auth.authenticate_headless()
+
+        workflow = MigrationWorkflow()
+        migration_results = workflow.run_migrate_clients(globals.auth, target_auth, selected_clients, reports_by_client_id)
+        workflow.log_migration_results(migration_results)
+        return all(len(result['failed']) < 1 for result in migration_results.values())
+
+
+def select_records(records: List[dict], id_key: str, ids: Union[List, None], tags: Union[List[str], None], select_all: bool = False) -> List[dict]:
+    """
+    :param records: clients or reports to select from
+    :type records: List[dict]
+    :param id_key: key of the record id, "client_id" or "id"
+    :type id_key: str
+    :param ids: ids of records to select
+    :type ids: Union[List, None]
+    :param tags: select records with any of these tags
+    :type tags: Union[List[str], None]
+    :param select_all: select every record if no ids or tags are given, defaults to False
+    :type select_all: bool, optional
+    :return: records matching any of the ids or tags
+    :rtype: List[dict]
+    """
+    ids = [str(id) for id in ids or []]
+    tags = tags or []
+    if len(ids) < 1 and len(tags) < 1:
+        if not select_all:
+            log.error(f'No ids or tags were given to select from. Add `all: true` to the job (or --all) to select everything')
+            return []
+        return records
+    return [record for record in records if str(record[id_key]) in ids or any(tag in (record.get("tags") or []) for tag in tags)]
+
+
+def get_file_paths(paths: Union[List[str], str, None], extensions: List[str], object_types: List[str] = None) -> List[str]:
+    """
+    :param paths: file paths, folder paths or glob patterns. files in a folder with one of `extensions` are selected
+    :type paths: Union[List[str], str, None]
+    :param extensions: file extensions to select from folders
+    :type extensions: List[str]
+    :param object_types: types of JSON files to select from folders, found with the file type cache. ZIP files are not
+    checked. defaults to selecting every file with one of `extensions`
+    :type object_types: List[str], optional
+    :return: sorted list of the selected file paths
+    :rtype: List[str]
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    file_paths = []
+    for path in paths or []:
+        matches = glob.glob(path) if glob.has_magic(path) else [path]
+        if len(matches) < 1:
+            log.error(f'Did not find any files matching \'{path}\'')
+        for match in matches:
+            if os.path.isdir(match):
+                file_paths += [os.path.join(match, file_name) for file_name in sorted(os.listdir(match)) if os.path.splitext(file_name)[1] in extensions and file_name.endswith(".zip")]
+                json_extensions = [extension for extension in extensions if extension != ".zip"]
+                file_paths_by_type = file_type_cache.scan_folder(match, json_extensions)
+                for object_type, object_file_paths in file_paths_by_type.items():
+                    if object_types == None or object_type in object_types:
+                        file_paths += object_file_paths
+                    else:
+                        log.info(f'Skipping {len(object_file_paths)} file(s) in \'{match}\' that are not {" or ".join(object_types)} files')
+            elif os.path.isfile(match):
+                file_paths.append(match)
+            else:
+                log.error(f'Did not find file \'{match}\'')
+    return sorted(set(file_paths))
+
+
+def load_job_file(file_path: str) -> List[dict]:
+    """
+    Loads jobs from a YAML (or JSON) job file, either a list of jobs or a dictionary with a `jobs` list
+
+    :param file_path: file path of the job file
+    :type file_path: str
+    :return: list of jobs
+    :rtype: List[dict]
+    """
+    with open(file_path, 'r', encoding="utf8") as f:
+        loaded = yaml.safe_load(f)
+    jobs = loaded.get("jobs", []) if isinstance(loaded, dict) else loaded
+    if not isinstance(jobs, list):
+        raise ValueError(f'Job file \'{file_path}\' must contain a list of jobs')
+    return jobs
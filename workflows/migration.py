@@ -0,0 +1,194 @@
+from rich import print
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+import beaupy as binput
+
+import settings
+import utils.globals as globals
+import utils.log_handler as logger
+log = logger.log
+from utils.auth_handler import Auth
+import utils.data_utils as data
+import utils.concurrency_utils as concurrency
+import utils.request_handler as request_handler
+from utils.request_handler import PTWrapperLibraryResponse
+from workflows.clients_reports import ClientReportsWorkflow
+
+
+class MigrationWorkflow:
+    """
+    Copies clients and their reports from one Plextrac instance to another without keeping anything on disk. Each
+    report's PTRAC is downloaded from the source instance into memory and passed through a bounded queue to be
+    uploaded to the target instance, so reports are downloaded from the source while earlier reports are still being
+    uploaded to the target.
+    """
+
+    def download_report_ptrac(self, report: dict, source_auth: Auth) -> BinaryIO:
+        """
+        Downloads the PTRAC of a report from the source instance into memory. The number of PTRACs held at once is
+        limited by `run_migrate_clients`.
+
+        :raises Exception: the report could not be downloaded, or the instance didn't return a PTRAC
+        :return: in memory file at the start of the PTRAC
+        :rtype: BinaryIO
+        """
+        ptrac_file, _ = data.download_ptrac_report_to_temp_file(report, auth=source_auth, in_memory=True)
+        return ptrac_file
+
+
+    def upload_report_ptrac(self, ptrac_file: BinaryIO, client_id: int, target_auth: Auth) -> PTWrapperLibraryResponse:
+        """
+        Uploads a PTRAC downloaded by `download_report_ptrac` to a client in the target instance, and releases it
+        """
+        with ptrac_file:
+            return data.import_ptrac_report(ptrac_file, client_id, auth=target_auth)
+
+
+    def start(self):
+        import main # importing here to prevent circular imports
+
+        if globals.auth == None:
+            log.info(f'Must authenticate to a Plextrac instance first')
+            globals.auth = Auth()
+            globals.auth.handle_authentication()
+
+        binput.console.clear()
+        log.debug(f'starting workflow \'migration\'')
+        print(f'''[b u]Migration Workflow[/b u]
+
+This workflow copies clients, and the reports under them, from the instance you
+are currently authenticated to into a different Plextrac instance. Nothing is
+kept on disk. Reports are downloaded from the current instance while earlier
+reports are still being imported into the other instance.
+
+Overview of Steps:
+- authenticate to the instance to migrate to
+- select which clients to migrate
+- choose whether to migrate reports with client
+
+[b]Would you like to migrate clients from {globals.auth.base_url}[/b]''')
+        action = binput.select([":migrate clients", ":main menu"], cursor=">", cursor_style='white')
+        print(f'Selected {action[1:]}\n')
+        log.debug(f'selected: {action}')
+
+        if action == ":migrate clients":
+            self.migrate_clients()
+        else:
+            main.start()
+
+
+    def migrate_clients(self):
+        import main # importing here to prevent circular imports
+
+        # authenticate to the target instance, the current session stays the source
+        log.info(f'Authenticate to the Plextrac instance to migrate clients to')
+        target_auth = Auth()
+        target_auth.handle_authentication()
+        if target_auth.base_url == globals.auth.base_url and target_auth.tenant_id == globals.auth.tenant_id:
+            log.exception(f'Cannot migrate clients to the same tenant they are being migrated from. Exiting to main menu')
+            input(f'Press enter to continue...')
+            main.start()
+
+        # get clients from source instance
+        spinner = binput.spinners.Spinner(binput.spinners.DOTS, "Loading clients from instance...")
+        spinner.start()
+        clients = []
+        data.get_page_of_clients(clients=clients, auth=globals.auth)
+        spinner.stop()
+        if len(clients) < 1:
+            log.exception(f'Did not find any clients in Plextrac instance. Exiting to main menu')
+            input(f'Press enter to continue...')
+            main.start()
+
+        # user selects clients
+        print(f'[b]Loaded Client list:[/b]')
+        selected_clients = binput.select_multiple(
+            options=clients,
+            # need to replace square brackets with something else since beaupy uses square brackets to define styles, effectively excluding them from allowed chars
+            preprocessor=lambda client:f'Name: {client["name"]} | ID: {client["client_id"]} | Tags: {str(client.get("tags", [])).replace("[","<").replace("]", ">")}',
+            tick_character="x",
+            tick_style="green",
+            cursor_style="dark_goldenrod",
+            minimal_count=1,
+            pagination=True,
+            page_size=10
+        )
+        print(f'Selected {len(selected_clients)} client(s)\n')
+        include_reports = binput.confirm(f'Migrate the reports under the selected client(s)?', cursor_style="white")
+        print("- including reports in client migration\n" if include_reports else "- ignoring reports under client(s)\n")
+
+        # get and sort reports from source instance
+        reports_by_client_id = {}
+        if include_reports:
+            spinner = binput.spinners.Spinner(binput.spinners.DOTS, "Loading reports from instance...")
+            spinner.start()
+            reports = []
+            data.get_page_of_reports(reports=reports, auth=globals.auth)
+            reports_by_client_id = data.group_reports_by_client_id(reports)
+            spinner.stop()
+
+        migration_results = self.run_migrate_clients(globals.auth, target_auth, selected_clients, reports_by_client_id)
+        self.log_migration_results(migration_results)
+
+        # return to main menu
+        log.info(f'Finished migrating clients')
+        request_handler.log_stats()
+        input(f'Press enter to continue...')
+        main.start()
+
+
+    def run_migrate_clients(self, source_auth: Auth, target_auth: Auth, selected_clients: List[dict], reports_by_client_id: Dict[int, List[dict]]) -> Dict[str, dict]:
+        """
+        Creates each selected client in the target instance, and streams the PTRAC of each of its reports from the source
+        instance to the new client. Does not prompt the user, so it can be run by the interactive workflow or a headless job.
+
+        Clients are created one at a time, as the reports of earlier clients are still being migrated. Up to
+        `settings.export_workers` reports are downloaded and `settings.import_workers` reports are uploaded at the same
+        time, with up to `settings.migration_queue_size` downloaded reports waiting in memory to be uploaded. At most
+        `export_workers + migration_queue_size + import_workers + 1` PTRACs are held in memory at once, see `run_pipeline`.
+
+        :param source_auth: Auth object of the instance to migrate clients from
+        :type source_auth: Auth
+        :param target_auth: Auth object of the instance to migrate clients to
+        :type target_auth: Auth
+        :param selected_clients: clients to migrate
+        :type selected_clients: List[dict]
+        :param reports_by_client_id: reports to migrate with each client
+        :type reports_by_client_id: Dict[int, List[dict]]
+        :return: dictionary of {client name: {"client_id": int or None, "reports": int, "failed": [str]}} with the result of each client
+        :rtype: Dict[str, dict]
+        """
+        client_reports_workflow = ClientReportsWorkflow()
+        migration_results = {}
+        def create_clients_and_list_reports() -> Iterator[Tuple[str, int, dict]]:
+            for client in selected_clients:
+                client_name = f'{client["name"]} ({client["client_id"]})'
+                result = migration_results.setdefault(client_name, {"client_id": None, "reports": 0, "failed": []})
+                reports = reports_by_client_id.get(client['client_id'], [])
+                try:
+                    result['client_id'] = client_reports_workflow.create_client(client, target_auth)
+                except Exception as e:
+                    log.exception(f'Could not create client \'{client["name"]}\' in target instance. Skipping client and {len(reports)} report(s)...')
+                    result['failed'].append(f'client and {len(reports)} report(s) - {e}')
+                    continue
+                for report in reports:
+                    yield client_name, result['client_id'], report
+
+        download_ptrac = lambda migrating: (migrating[1], self.download_report_ptrac(migrating[2], source_auth))
+        import_ptrac = lambda downloaded: self.upload_report_ptrac(downloaded[1], downloaded[0], target_auth)
+        for (client_name, client_id, report), response, e in concurrency.run_pipeline(download_ptrac, import_ptrac, create_clients_and_list_reports(), producer_workers=settings.export_workers, consumer_workers=settings.import_workers, queue_size=settings.migration_queue_size):
+            if e == None:
+                log.success(f'Migrated report \'{report["name"]}\' to client \'{client_name}\'')
+                migration_results[client_name]['reports'] += 1
+            else:
+                log.exception(f'Could not migrate report \'{report["name"]}\'. Skipping...\n{e}')
+                migration_results[client_name]['failed'].append(f'report \'{report["name"]}\' - {e}')
+
+        return migration_results
+
+
+    def log_migration_results(self, migration_results: Dict[str, dict]) -> None:
+        for client_name, result in migration_results.items():
+            log.info(f'{client_name} | New client ID: {result["client_id"]} | Reports migrated: {result["reports"]} | Failed: {len(result["failed"])}')
+            for failure in result['failed']:
+                log.error(f'Failed: {client_name} | {failure}')
@@ -1,8 +1,6 @@
 from rich import print
 import os
-import json
-import io
-from typing import Union
+from typing import Dict, Iterator, List, Tuple, Union
 
 from tkinter import Tk
 from tkinter.filedialog import askopenfilenames
@@ -12,31 +10,65 @@ import settings
 import utils.globals as globals
 import utils.log_handler as logger
 log = logger.log
+from utils.log_handler import IterationMetrics
 from utils.auth_handler import Auth
 import utils.data_utils as data
 import utils.general_utils as utils
-import api
+import utils.concurrency_utils as concurrency
+import utils.manifest_handler as manifest_handler
+from utils.manifest_handler import ExportManifest
+from utils.content_store_handler import ContentStore
+from utils.file_type_handler import file_type_cache
+import utils.catalog_handler as catalog_handler
+from utils.catalog_handler import ExportCatalog
+import utils.request_handler as request_handler
 
 
 class ReportsWorkflow:
 
-    def create_report_ptrac_with_json_object(self, report, folder_path):
-        # get PTRAC JSON
-        try:
-            response = api.reports.export_report_to_ptrac(globals.auth.base_url, globals.auth.get_auth_headers(), report['client_id'], report['id'])
-            ptrac = response.json
-        except Exception as e:
-            log.exception(f'Could not download ptrac for report \'{report["name"]}\', skipping...')
-            return
-        
-        # save PTRAC file
+    def get_report_ptrac_file_path(self, report, folder_path) -> str:
         file_name = utils.sanitize_file_name(f'{report["name"]}_{report["id"]}_{globals.script_time}.ptrac')
-        json_buffer = io.StringIO()
-        json.dump(ptrac, json_buffer)
-        json_data = json_buffer.getvalue()
-        with open(f'{folder_path}/{file_name}', 'w') as f:
-            f.write(json_data)
-        log.success(f'Created report PTRAC {folder_path}/{file_name}')
+        return f'{folder_path}/{file_name}'
+
+
+    def create_report_ptrac_with_json_object(self, report, folder_path) -> str:
+        """
+        Downloads the PTRAC of a report and saves it to `folder_path`. Raises an exception if the report could not be
+        downloaded or saved, so the caller can decide how to handle the failure of a single report.
+
+        :return: file path of the created PTRAC file
+        :rtype: str
+        """
+        # stream PTRAC to a temp file, renamed once the whole PTRAC is downloaded and checked
+        file_path = self.get_report_ptrac_file_path(report, folder_path)
+        temp_file_path = f'{file_path}.part'
+        try:
+            with open(temp_file_path, 'w+b') as f:
+                data.download_ptrac_report(report, f, auth=globals.auth)
+            os.replace(temp_file_path, file_path)
+        except Exception:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+        return file_path
+
+
+    def create_report_ptrac_in_content_store(self, report, content_store: ContentStore) -> Tuple[str, dict]:
+        """
+        Downloads the PTRAC of a report and saves it to the content store. The PTRAC is streamed to a temp file as it is
+        received, then read from there by the content store. Raises an exception if the report could not be downloaded
+        or saved.
+
+        The catalog details are read from the temp file, since the object in the content store is compressed.
+
+        :return: file path of the PTRAC object in the content store, and the details of the PTRAC to save in the export catalog
+        :rtype: Tuple[str, dict]
+        """
+        os.makedirs(content_store.folder_path, exist_ok=True)
+        ptrac_file, _ = data.download_ptrac_report_to_temp_file(report, auth=globals.auth, folder_path=content_store.folder_path)
+        with ptrac_file as f:
+            catalog_details = catalog_handler.get_ptrac_details(f) if settings.update_export_catalog else {}
+            return content_store.get_object_path(content_store.put_ptrac(f)), catalog_details
 
 
     def select_ptrac_files(self, initial_directory=None):
@@ -49,26 +81,65 @@ class ReportsWorkflow:
         if not (os.path.exists(initial_directory) and os.path.isdir(initial_directory)):
             initial_directory = utils.get_script_root_path()
         file_paths = askopenfilenames(
-            filetypes=[("Ptrac files", "*.ptrac")],
+            filetypes=[("Ptrac files", "*.ptrac"), ("Content store export manifests", "*.json")],
             initialdir=initial_directory
         )
         return file_paths
     
 
-    def load_data_from_report_PTRAC(self, file_path) -> Union[dict, None]:
+    def load_data_from_report_PTRAC(self, file_path) -> Union[str, None]:
+        """
+        Checks that a file is a PTRAC without loading the whole file, using the file type cache. The file is read again
+        when it is uploaded.
+
+        :return: file path of the PTRAC, or None if the file is invalid
+        :rtype: Union[str, None]
+        """
         file_name = os.path.basename(file_path)
         try:
-            with open(file_path) as file:
-                ptrac = json.load(file)
-                if utils.get_json_object_type(ptrac) == "ptrac":
-                    return ptrac
-                else:
-                    log.exception(f'Encountered invalid PTRAC file \'{file_name}\'. Skipping...')
+            if file_type_cache.get_file_type(file_path) == "ptrac":
+                return file_path
+            else:
+                log.exception(f'Encountered invalid PTRAC file \'{file_name}\'. Skipping...')
         except Exception as e:
             log.exception(f'Could not find or load report PTRAC file \'{file_path}\'\n{e}')
             return None
 
 
+    def load_report_PTRACs(self, file_paths) -> Iterator[Tuple[str, Union[dict, str, None]]]:
+        """
+        Loads the PTRACs from a list of PTRAC files, or from the manifests of exports saved to the content store.
+        PTRACs are loaded one at a time as the caller iterates. PTRAC files are only checked here, not loaded, so they
+        can be uploaded as they are.
+
+        :yield: tuple of (file path or manifest path and report id, file path of the PTRAC file or PTRAC loaded from the content store, or None if the file is invalid)
+        :rtype: Iterator[Tuple[str, Union[dict, str, None]]]
+        """
+        for file_path in file_paths:
+            # PTRACs can be saved with a .json extension too, other .json files are content store export manifests
+            if not file_path.endswith(".json") or (os.path.isfile(file_path) and file_type_cache.get_file_type(file_path) == "ptrac"):
+                yield file_path, self.load_data_from_report_PTRAC(file_path)
+                continue
+            try:
+                manifest = ExportManifest.load(file_path)
+            except Exception as e:
+                log.exception(f'Could not load content store export manifest \'{file_path}\'\n{e}')
+                yield file_path, None
+                continue
+            if manifest.data.get('content_store') == None:
+                log.exception(f'Manifest \'{file_path}\' is not from an export saved to the content store. Import the PTRAC files it lists instead')
+                yield file_path, None
+                continue
+            content_store = ContentStore(manifest.data['content_store'])
+            for report_id, report_entry in manifest.data['reports'].items():
+                try:
+                    yield f'{file_path} - report {report_id}', content_store.get_ptrac(content_store.get_hash_from_path(report_entry['file_path']))
+                except Exception as e:
+                    log.exception(f'Could not load report {report_id} from content store\n{e}')
+                    yield f'{file_path} - report {report_id}', None
+        file_type_cache.save()
+
+
     def start(self):
         import main # importing here to prevent circular imports
 
@@ -138,19 +209,100 @@ Overview of Steps:
         )
         print(f'Selected {len(selected_reports)} reports(s)\n')
 
-        # create and export report PTRACs
-        utils.create_directory("exported_data")
-        utils.create_directory("exported_data/report_PTRACs")
-        folder_path = "exported_data/report_PTRACs"
-
-        for report in selected_reports:
-            self.create_report_ptrac_with_json_object(report, folder_path)
+        self.run_export_reports(selected_reports)
 
         # return to main menu
         log.info(f'Finished exporting reports')
+        request_handler.log_stats()
         input(f'Press enter to continue...')
         main.start()
 
+
+    def run_export_reports(self, selected_reports: List[dict]) -> int:
+        """
+        Exports reports to PTRAC files or the content store. Does not prompt the user, so it can be run by the
+        interactive workflow or a headless job.
+
+        :param selected_reports: reports to export
+        :type selected_reports: List[dict]
+        :return: number of reports that could not be exported
+        :rtype: int
+        """
+        # create and export report PTRACs, or save to content store instead of files
+        utils.create_directory("exported_data")
+        folder_path = "exported_data/report_PTRACs"
+        content_store = ContentStore() if settings.use_content_store else None
+        content_store_path = content_store.folder_path if content_store != None else None
+        if content_store == None:
+            utils.create_directory(folder_path)
+
+        # skip reports already exported by the run being resumed
+        manifest = manifest_handler.start_export_manifest("export_reports", globals.auth.base_url, resume=getattr(globals.args, "resume", False), content_store_path=content_store_path)
+        reports_to_export = [report for report in selected_reports if not manifest.is_completed("reports", report['id'])]
+        if len(reports_to_export) < len(selected_reports):
+            log.info(f'Skipping {len(selected_reports)-len(reports_to_export)} report(s) already exported')
+
+        # record what was exported in the catalog
+        catalog = ExportCatalog() if settings.update_export_catalog else None
+        export_id = catalog.start_export(manifest) if catalog != None else None
+
+        # reuse PTRACs of reports that haven't changed since the last complete export. the hash recorded for each report
+        # needs its last updated time, so it is loaded even when there is no previous export to compare to
+        if getattr(globals.args, "incremental", False):
+            reports_to_export = data.add_report_updated_at(reports_to_export, auth=globals.auth)
+        previous_manifest = manifest_handler.find_incremental_base("export_reports", globals.auth.base_url, incremental=getattr(globals.args, "incremental", False), content_store_path=content_store_path)
+        if previous_manifest != None:
+            changed_reports = []
+            for report in reports_to_export:
+                report_hash = data.get_report_hash(report)
+                previous_entry = previous_manifest.get_unchanged_entry("reports", report['id'], report_hash)
+                if previous_entry == None:
+                    changed_reports.append(report)
+                    continue
+                if content_store != None:
+                    file_path = previous_entry['file_path'] # same object in the content store
+                else:
+                    file_path = manifest_handler.link_unchanged_file(previous_entry['file_path'], self.get_report_ptrac_file_path(report, folder_path))
+                manifest.add_completed("reports", report['id'], file_path, client_id=report['client_id'], record_hash=report_hash, unchanged_since=previous_manifest.data['started_at'])
+                if catalog != None:
+                    catalog.add_report(export_id, report, file_path, details={"size": os.path.getsize(file_path), "report_hash": report_hash, "unchanged": True})
+            log.info(f'{len(reports_to_export)-len(changed_reports)} report(s) unchanged since last export, {len(changed_reports)} new or changed report(s) to export')
+            reports_to_export = changed_reports
+
+        # reports are downloaded by a pool of workers, each PTRAC is saved as soon as its download finishes
+        metrics = IterationMetrics(len(reports_to_export))
+        failed_reports = {}
+        if content_store != None:
+            export_report = lambda report: self.create_report_ptrac_in_content_store(report, content_store)
+        else:
+            export_report = lambda report: self.create_report_ptrac_with_json_object(report, folder_path)
+        for report, saved, e in concurrency.run_concurrently(export_report, reports_to_export, max_workers=settings.export_workers):
+            if e == None:
+                file_path, catalog_details = saved if content_store != None else (saved, None)
+                log.success(f'Created report PTRAC {file_path}')
+                manifest.add_completed("reports", report['id'], file_path, client_id=report['client_id'], record_hash=data.get_report_hash(report))
+                if catalog != None:
+                    catalog.add_report(export_id, report, file_path, details={"size": os.path.getsize(file_path), "report_hash": data.get_report_hash(report), **(catalog_details if catalog_details != None else catalog_handler.get_ptrac_details(file_path))})
+            else:
+                log.exception(f'{e}, skipping...')
+                failed_reports[report['id']] = f'{e} - {e.__cause__}' if e.__cause__ != None else str(e)
+            log.info(metrics.print_iter_metrics())
+
+        if len(failed_reports) > 0:
+            log.error(f'Could not export {len(failed_reports)} of {len(reports_to_export)} report(s)')
+            for report_id, error in failed_reports.items():
+                log.error(f'Report ID: {report_id} | {error}')
+            manifest.save()
+            log.info(f'Run the script with --resume to retry the failed report(s)')
+        else:
+            manifest.finish()
+        if catalog != None:
+            catalog.finish_export(export_id, manifest.data['status'])
+            catalog.close()
+        if content_store != None:
+            content_store.log_stats()
+        return len(failed_reports)
+
         
     def import_reports(self):
         import main # importing here to prevent circular imports
@@ -188,32 +340,56 @@ Overview of Steps:
         print(f'All selected PTRACs will be imported to create a new report under the selected client.')
         spinner = binput.spinners.Spinner(binput.spinners.DOTS, "Importing reports from file(s)...")
         spinner.start()
-        for file_path in ptrac_file_paths:
-            # load ptrac dict from file
-            ptrac = self.load_data_from_report_PTRAC(file_path)
-            if ptrac == None:
-                log.exception(f'Skipping invalid report PTRAC file \'{file_path}\'...')
-                continue
-
-            # TODO - add ability to add report tags at this step
-
-            # import ptrac
-            try:
-                json_str = json.dumps(ptrac)
-                json_file_like = io.BytesIO(json_str.encode('utf-8'))
-                multipart_form_data = {
-                    'file': json_file_like
-                }
-                response = api.reports.import_ptrac_report(globals.auth.base_url, globals.auth.get_auth_headers(), selected_client['client_id'], multipart_form_data)
-                log.success(f'Created report \'{ptrac["report_info"]["name"]}\' for client \'{selected_client["name"]}\'')
-            except Exception as e:
-                log.exception(f'Could not create report. Skipping...')
-                continue
-
+        imported_files, failed_files = self.run_import_reports(ptrac_file_paths, selected_client)
         spinner.stop()
+        self.log_import_results(imported_files, failed_files)
 
         # return to main menu
         log.info(f'Finished importing reports')
+        request_handler.log_stats()
         input(f'Press enter to continue...')
         main.start()
 
+
+    def run_import_reports(self, ptrac_file_paths: List[str], selected_client: dict) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Creates a report under a client from each PTRAC file, or each report in a content store export manifest. Does
+        not prompt the user, so it can be run by the interactive workflow or a headless job.
+
+        :param ptrac_file_paths: file paths of PTRACs or content store export manifests
+        :type ptrac_file_paths: List[str]
+        :param selected_client: client to create the reports under
+        :type selected_client: dict
+        :return: tuple of (list of file paths imported, dictionary of {file_path: error} for each file that failed)
+        :rtype: Tuple[List[str], Dict[str, str]]
+        """
+        imported_files = []
+        failed_files = {}
+        def load_valid_ptracs():
+            for file_path, ptrac in self.load_report_PTRACs(ptrac_file_paths):
+                if ptrac == None:
+                    log.exception(f'Skipping invalid report PTRAC file \'{file_path}\'...')
+                    failed_files[file_path] = "invalid PTRAC file"
+                    continue
+                yield file_path, ptrac
+
+        # TODO - add ability to add report tags at this step
+
+        # import ptracs, up to settings.import_workers at a time
+        import_ptrac = lambda loaded_ptrac: data.import_ptrac_report(loaded_ptrac[1], selected_client['client_id'], auth=globals.auth)
+        for (file_path, ptrac), response, e in concurrency.run_concurrently(import_ptrac, load_valid_ptracs(), max_workers=settings.import_workers):
+            if e == None:
+                log.success(f'Created report from \'{file_path}\' for client \'{selected_client["name"]}\'')
+                imported_files.append(file_path)
+            else:
+                log.exception(f'Could not create report from \'{file_path}\'. Skipping...\n{e}')
+                failed_files[file_path] = str(e)
+
+        return imported_files, failed_files
+
+
+    def log_import_results(self, imported_files: List[str], failed_files: Dict[str, str]) -> None:
+        log.info(f'Imported {len(imported_files)} report(s), {len(failed_files)} file(s) failed')
+        for file_path, error in failed_files.items():
+            log.error(f'Failed: {file_path} | {error}')
+